@@ -3,6 +3,12 @@ from datetime import timedelta
 import os
 from dotenv import load_dotenv
 from extensions import db, jwt, bcrypt, cors
+from tasks import init_task_queue
+from cache import init_cache
+from geo import init_geo
+from passwords import init_passwords
+from rate_limit import init_rate_limit
+from serialization import init_serialization
 
 # Load environment variables
 load_dotenv()
@@ -16,12 +22,62 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-key')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=1)
+    app.config['MATCHING_TOP_K'] = int(os.environ.get('MATCHING_TOP_K', 50))
+    app.config['MATCHING_MAX_LIMIT'] = int(os.environ.get('MATCHING_MAX_LIMIT', 200))
+    app.config['MATCHING_FANOUT_TOP_N'] = int(os.environ.get('MATCHING_FANOUT_TOP_N', 100))
+    # How far back each matching index sync looks for requests committed late by other workers
+    app.config['MATCHING_SYNC_OVERLAP_SECONDS'] = int(os.environ.get('MATCHING_SYNC_OVERLAP_SECONDS', 60))
+    app.config['TASK_QUEUE_BACKEND'] = os.environ.get('TASK_QUEUE_BACKEND', 'thread')
+    app.config['TASK_QUEUE_WORKERS'] = int(os.environ.get('TASK_QUEUE_WORKERS', 4))
+    app.config['REALTIME_HEARTBEAT_SECONDS'] = int(os.environ.get('REALTIME_HEARTBEAT_SECONDS', 15))
+    app.config['REALTIME_QUEUE_SIZE'] = int(os.environ.get('REALTIME_QUEUE_SIZE', 100))
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'database')  # database, memory, shared or none
+    app.config['CACHE_DEFAULT_TTL'] = int(os.environ.get('CACHE_DEFAULT_TTL', 60))
+    app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+    app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+    app.config['PROFILING_MAX_STATEMENTS'] = int(os.environ.get('PROFILING_MAX_STATEMENTS', 200))
+    app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 500))  # 0 disables the log
+    app.config['BULK_MAX_ITEMS'] = int(os.environ.get('BULK_MAX_ITEMS', 1000))  # JSON bodies; streamed uploads are chunked
+    app.config['BULK_CHUNK_SIZE'] = int(os.environ.get('BULK_CHUNK_SIZE', 500))
+    app.config['SQLITE_WAL'] = os.environ.get('SQLITE_WAL', 'true').lower() in ('1', 'true', 'yes')
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    app.config['DB_CONFLICT_RETRIES'] = int(os.environ.get('DB_CONFLICT_RETRIES', 5))
+    app.config['QUOTE_SWEEP_INTERVAL_SECONDS'] = int(os.environ.get('QUOTE_SWEEP_INTERVAL_SECONDS', 0))  # 0: CLI/cron only
+    app.config['QUOTE_SWEEP_BATCH_SIZE'] = int(os.environ.get('QUOTE_SWEEP_BATCH_SIZE', 1000))
+    app.config['SEARCH_MAX_PER_PAGE'] = int(os.environ.get('SEARCH_MAX_PER_PAGE', 100))
+    app.config['GAZETTEER_PATH'] = os.environ.get(
+        'GAZETTEER_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.csv'))
+    app.config['SERVICE_AREA_DEFAULT_RADIUS_KM'] = float(os.environ.get('SERVICE_AREA_DEFAULT_RADIUS_KM', 100))
+    app.config['SERVICE_AREA_MAX_RADIUS_KM'] = float(os.environ.get('SERVICE_AREA_MAX_RADIUS_KM', 500))
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))  # 0: hash inline
+    app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+    app.config['RATE_LIMIT_MAX_KEYS'] = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+    app.config['LOGIN_RATE_IP_BURST'] = int(os.environ.get('LOGIN_RATE_IP_BURST', 30))  # 0 disables a bucket
+    app.config['LOGIN_RATE_IP_PER_MINUTE'] = float(os.environ.get('LOGIN_RATE_IP_PER_MINUTE', 60))
+    app.config['LOGIN_RATE_EMAIL_BURST'] = int(os.environ.get('LOGIN_RATE_EMAIL_BURST', 5))
+    app.config['LOGIN_RATE_EMAIL_PER_MINUTE'] = float(os.environ.get('LOGIN_RATE_EMAIL_PER_MINUTE', 6))
+    app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', 0))  # 0: always read the row
+    app.config['TOKEN_DENYLIST_REFRESH_SECONDS'] = int(os.environ.get('TOKEN_DENYLIST_REFRESH_SECONDS', 30))
+    app.config['JSON_ENCODER'] = os.environ.get('JSON_ENCODER', 'auto')  # auto, orjson or stdlib
+    app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 500))  # Rows fetched and flushed at a time
+    app.config['OUTBOX_WORKERS'] = int(os.environ.get('OUTBOX_WORKERS', 2))  # 0: drain with `flask drain-outbox`
+    app.config['OUTBOX_BATCH_SIZE'] = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+    app.config['OUTBOX_POLL_SECONDS'] = float(os.environ.get('OUTBOX_POLL_SECONDS', 5))
+    app.config['OUTBOX_MAX_ATTEMPTS'] = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 10))
+    app.config['OUTBOX_RETRY_SECONDS'] = float(os.environ.get('OUTBOX_RETRY_SECONDS', 5))  # Doubled per attempt
 
     # Initialize extensions
     db.init_app(app)
     jwt.init_app(app)
     bcrypt.init_app(app)
     cors.init_app(app)
+    init_task_queue(app)
+    init_cache(app)
+    init_geo(app)
+    init_passwords(app)
+    init_rate_limit(app)
+    init_serialization(app)
 
     @app.route('/api/health')
     def health_check():
@@ -29,13 +85,25 @@ def create_app():
 
     # Import models and routes
     with app.app_context():
-        from models import User, FreightRequest, Quote, Rating, Conversation, Message
+        from models import (User, FreightRequest, Quote, Rating, Conversation, Message,
+                            ProviderServiceArea, ProviderSpecialty, ProviderInbox,
+                            ProviderRatingStats, RevokedToken, OutboxEvent)
         from auth import init_auth_routes
         from freight_requests import init_freight_routes
         from quotes import init_quote_routes
         from matching import init_matching_routes
         from ratings import init_rating_routes
         from messaging import init_messaging_routes
+        from realtime import init_realtime_routes
+        from search import init_search_routes
+        from export import init_export_routes
+        from commands import init_commands
+        from profiling import init_profiling
+        from concurrency import init_concurrency
+        from identity import init_identity
+        from events import init_events
+
+        init_concurrency(app)
 
         # Initialize routes
         init_auth_routes(app)
@@ -44,10 +112,18 @@ def create_app():
         init_matching_routes(app)
         init_rating_routes(app)
         init_messaging_routes(app)
+        init_realtime_routes(app)
+        init_search_routes(app)
+        init_export_routes(app)
+        init_commands(app)
+        init_profiling(app)
 
         # Create database tables
         db.create_all()
 
+        init_identity(app)
+        init_events(app)
+
     return app
 
 app = create_app()
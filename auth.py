@@ -1,7 +1,36 @@
 from flask import jsonify, request
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 from extensions import db, bcrypt
 from models import User
+from cache import cached
+from passwords import HasherBusy, hash_password, check_password, needs_rehash
+from rate_limit import throttle
+from identity import create_user_token, revoke_token
+import json
+
+def parse_profile_list(value):
+    """Accept service areas/specialties as a list or a JSON-encoded list."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = json.loads(value)
+    return list(value)
+
+def upgrade_password_hash(user_id, old_hash, password):
+    """Re-hash a password at the current cost, unless it was changed in the meantime.
+
+    Called on the login request, which already holds the password. Never
+    enqueue it: a task backend may hand its arguments to an external broker.
+    """
+    User.query.filter_by(id=user_id, password=old_hash)\
+        .update({'password': hash_password(password)}, synchronize_session=False)
+    db.session.commit()
+
+def hasher_busy():
+    response = jsonify({'error': 'Too many logins in progress, try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
 
 def init_auth_routes(app):
     bcrypt.init_app(app)
@@ -19,6 +48,10 @@ def init_auth_routes(app):
         # Validate user type
         if data['user_type'] not in ['shipper', 'provider']:
             return jsonify({'error': 'Invalid user type. Must be either "shipper" or "provider"'}), 400
+
+        limited = throttle((request.remote_addr, 'LOGIN_RATE_IP'))
+        if limited:
+            return limited
         
         # Check if user already exists
         if User.query.filter_by(email=data['email']).first():
@@ -26,23 +59,23 @@ def init_auth_routes(app):
         
         try:
             # Hash password
-            hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+            hashed_password = hash_password(data['password'])
             
             # Create new user
             new_user = User(
                 email=data['email'],
                 password=hashed_password,
                 company_name=data['company_name'],
-                user_type=data['user_type'],
-                service_areas=data.get('service_areas'),
-                specialties=data.get('specialties')
+                user_type=data['user_type']
             )
+            new_user.set_service_areas(parse_profile_list(data.get('service_areas')))
+            new_user.set_specialties(parse_profile_list(data.get('specialties')))
             
             db.session.add(new_user)
             db.session.commit()
             
             # Create access token
-            access_token = create_access_token(identity=new_user.id)
+            access_token = create_user_token(new_user)
             
             return jsonify({
                 'message': 'Registration successful',
@@ -55,6 +88,12 @@ def init_auth_routes(app):
                 }
             }), 201
             
+        except HasherBusy:
+            db.session.rollback()
+            return hasher_busy()
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': 'Registration failed', 'details': str(e)}), 500
@@ -66,15 +105,28 @@ def init_auth_routes(app):
         # Validate required fields
         if not data.get('email') or not data.get('password'):
             return jsonify({'error': 'Email and password are required'}), 400
+
+        # Turn floods away before spending any bcrypt time on them
+        limited = throttle((request.remote_addr, 'LOGIN_RATE_IP'),
+                           (str(data['email']).strip().lower(), 'LOGIN_RATE_EMAIL'))
+        if limited:
+            return limited
         
         try:
             # Find user by email
             user = User.query.filter_by(email=data['email']).first()
             
             # Check if user exists and password is correct
-            if user and bcrypt.check_password_hash(user.password, data['password']):
+            if user and check_password(user.password, data['password']):
+                if needs_rehash(user.password):
+                    try:
+                        upgrade_password_hash(user.id, user.password, data['password'])
+                    except HasherBusy:
+                        # The login itself succeeded; a later one upgrades the hash
+                        db.session.rollback()
+
                 # Create access token
-                access_token = create_access_token(identity=user.id)
+                access_token = create_user_token(user)
                 
                 return jsonify({
                     'message': 'Login successful',
@@ -88,12 +140,26 @@ def init_auth_routes(app):
                 }), 200
             else:
                 return jsonify({'error': 'Invalid email or password'}), 401
-                
+
+        except HasherBusy:
+            return hasher_busy()
         except Exception as e:
             return jsonify({'error': 'Login failed', 'details': str(e)}), 500
 
+    @app.route('/api/auth/logout', methods=['POST'])
+    @jwt_required()
+    def logout():
+        try:
+            revoke_token(get_jwt())
+            return jsonify({'message': 'Logged out'}), 200
+            
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': 'Logout failed', 'details': str(e)}), 500
+
     @app.route('/api/auth/me', methods=['GET'])
     @jwt_required()
+    @cached(lambda: f'user:{get_jwt_identity()}')
     def get_current_user():
         current_user_id = get_jwt_identity()
         
@@ -110,8 +176,8 @@ def init_auth_routes(app):
                     'user_type': user.user_type,
                     'rating': user.rating,
                     'total_ratings': user.total_ratings,
-                    'service_areas': user.service_areas,
-                    'specialties': user.specialties,
+                    'service_areas': json.dumps(user.service_area_list) if user.service_area_links else None,
+                    'specialties': json.dumps(user.specialty_list) if user.specialty_links else None,
                     'unread_messages': user.unread_messages
                 }
             }), 200
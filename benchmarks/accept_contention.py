@@ -0,0 +1,136 @@
+"""Stress accept_quote and submit_quote from many threads against SQLite in WAL mode.
+
+Every freight request gets several pending quotes. Worker threads then
+race to accept different quotes of the same requests while other providers
+keep quoting them. Afterwards each request must have exactly one accepted
+quote, matching selected_quote_id, status in_progress and a quote_count
+equal to its quotes, no quote left pending once the outbox is drained,
+and exactly one accept per request may have been told it succeeded. The run reports throughput with little contention
+(one accept per request) and with heavy contention, and fails if any
+invariant is broken.
+
+    python benchmarks/accept_contention.py --requests 50 --workers 16
+"""
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert
+from common import app, reset_database, auth_headers
+from extensions import db
+from models import User, FreightRequest, Quote
+from events import drain_outbox
+
+def seed(requests, quotes_per_request, late_providers):
+    reset_database()
+    shipper = User(email='shipper@bench', password='x', company_name='Shipper', user_type='shipper')
+    db.session.add(shipper)
+    providers = [User(email=f'provider{i}@bench', password='x', company_name=f'Provider {i}', user_type='provider')
+                 for i in range(quotes_per_request + late_providers)]
+    db.session.add_all(providers)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    request_ids = db.session.scalars(insert(FreightRequest).returning(FreightRequest.id), [{
+        'user_id': shipper.id, 'freight_type': 'road', 'origin': 'Hamburg', 'destination': 'Rotterdam',
+        'cargo_details': 'Pallets', 'status': 'quoted', 'quote_count': quotes_per_request, 'created_at': now
+    } for _ in range(requests)]).all()
+    quote_ids = db.session.scalars(insert(Quote).returning(Quote.id, sort_by_parameter_order=True), [{
+        'freight_request_id': request_id, 'provider_id': provider.id, 'price': 1000.0,
+        'estimated_delivery_date': now + timedelta(days=5), 'status': 'pending',
+        'valid_until': now + timedelta(hours=48), 'created_at': now
+    } for request_id in request_ids for provider in providers[:quotes_per_request]]).all()
+    db.session.commit()
+
+    quotes_by_request = {request_id: quote_ids[i * quotes_per_request:(i + 1) * quotes_per_request]
+                         for i, request_id in enumerate(request_ids)}
+    return shipper.id, [provider.id for provider in providers[quotes_per_request:]], quotes_by_request
+
+def check_invariants(request_ids):
+    failures = []
+    accepted = Counter(quote.freight_request_id for quote in
+                       Quote.query.filter(Quote.freight_request_id.in_(request_ids), Quote.status == 'accepted'))
+    pending = Counter(quote.freight_request_id for quote in
+                      Quote.query.filter(Quote.freight_request_id.in_(request_ids), Quote.status == 'pending'))
+    counts = dict(db.session.query(Quote.freight_request_id, func.count(Quote.id))
+                  .filter(Quote.freight_request_id.in_(request_ids)).group_by(Quote.freight_request_id))
+    for freight_request in FreightRequest.query.filter(FreightRequest.id.in_(request_ids)):
+        selected = db.session.get(Quote, freight_request.selected_quote_id) if freight_request.selected_quote_id else None
+        if accepted[freight_request.id] != 1:
+            failures.append(f'request {freight_request.id}: {accepted[freight_request.id]} accepted quotes')
+        if freight_request.status != 'in_progress':
+            failures.append(f'request {freight_request.id}: status {freight_request.status} after accept')
+        if not selected or selected.status != 'accepted':
+            failures.append(f'request {freight_request.id}: selected quote is not the accepted one')
+        if pending[freight_request.id]:
+            failures.append(f'request {freight_request.id}: {pending[freight_request.id]} quotes still pending')
+        if freight_request.quote_count != counts.get(freight_request.id, 0):
+            failures.append(f'request {freight_request.id}: quote_count {freight_request.quote_count}, '
+                            f'{counts.get(freight_request.id, 0)} quotes')
+    return failures
+
+def run(label, operations, workers):
+    def call(operation):
+        method, path, headers, body = operation
+        response = app.test_client().open(path, method=method, headers=headers, json=body)
+        return path.rsplit('/', 1)[-1] if method == 'POST' and path.endswith('accept') else 'submit', \
+            response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = Counter(pool.map(call, operations))
+    elapsed = time.perf_counter() - start
+    summary = ', '.join(f'{kind} {status}: {count}' for (kind, status), count in sorted(outcomes.items()))
+    print(f'{label:<18} {len(operations):>6} calls {elapsed:>7.2f}s {len(operations) / elapsed:>8.0f} calls/s  ({summary})')
+    return outcomes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--quotes', type=int, default=8, help='pending quotes per request')
+    parser.add_argument('--late-providers', type=int, default=4, help='providers quoting during the race')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    delivery = (datetime.utcnow() + timedelta(days=5)).isoformat()
+
+    failures = []
+    with app.app_context():
+        for label, contended in (('low contention', False), ('high contention', True)):
+            shipper_id, late_providers, quotes_by_request = seed(args.requests, args.quotes, args.late_providers)
+            shipper = auth_headers(shipper_id)
+            operations = []
+            for request_id, quote_ids in quotes_by_request.items():
+                # Low contention: one accept per request. High: every quote, plus late quotes
+                for quote_id in (quote_ids if contended else quote_ids[:1]):
+                    operations.append(('POST', f'/api/quotes/{quote_id}/accept', shipper, None))
+                if contended:
+                    operations.extend(('POST', f'/api/quotes/{request_id}', auth_headers(provider_id),
+                                       {'price': 900.0, 'estimated_delivery_date': delivery})
+                                      for provider_id in late_providers)
+            rng.shuffle(operations)
+
+            outcomes = run(label, operations, args.workers)
+            if any(status >= 500 for _, status in outcomes):
+                failures.append(f'{label}: server errors')
+            if outcomes[('accept', 200)] != len(quotes_by_request):
+                failures.append(f"{label}: {outcomes[('accept', 200)]} accepts succeeded "
+                                f'for {len(quotes_by_request)} requests')
+            drain_outbox()  # Rejects the quotes that lost
+            failures += [f'{label}: {failure}' for failure in check_invariants(list(quotes_by_request))]
+            db.session.remove()
+
+    if failures:
+        print(f'\n{len(failures)} invariant violations:')
+        for failure in failures[:20]:
+            print(f'  {failure}')
+        sys.exit(1)
+    print('\nInvariants hold: one successful accept per request, no lost status or counter updates')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark /api/matching/available-requests as the open backlog grows.
+
+Seeds N open freight requests (a share of them already quoted by the
+benchmark provider) and reports, per size, the SQL statements issued and
+the latency of the endpoint. With --legacy the old per-request scoring
+loop, including its "already quoted" probe, is timed alongside it.
+
+    python benchmarks/available_requests.py --sizes 1000,10000,100000
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+from common import app, QueryCounter, reset_database, auth_headers
+from extensions import db, bcrypt
+from models import User, FreightRequest, Quote
+from matching import calculate_match_score, load_provider_profile
+
+CITIES = ['Hamburg', 'Rotterdam', 'Antwerp', 'Le Havre', 'Gdansk', 'Genoa', 'Valencia',
+          'Felixstowe', 'Piraeus', 'Bremen', 'Marseille', 'Barcelona', 'Lisbon', 'Riga',
+          'Gothenburg', 'Copenhagen', 'Warsaw', 'Prague', 'Vienna', 'Milan']
+FREIGHT_TYPES = ['road', 'air', 'sea', 'rail']
+
+def seed(size, quoted_share):
+    """Create one shipper, one provider and `size` open freight requests."""
+    reset_database()
+
+    password = bcrypt.generate_password_hash('benchmark').decode('utf-8')
+    shipper = User(email='shipper@bench', password=password, company_name='Shipper', user_type='shipper')
+    provider = User(email='provider@bench', password=password, company_name='Provider', user_type='provider', rating=4.2)
+    provider.set_service_areas(['Hamburg', 'Rotterdam', 'Antwerp'])
+    provider.set_specialties(['sea'])
+    db.session.add_all([shipper, provider])
+    db.session.commit()
+
+    rng = random.Random(size)
+    now = datetime.utcnow()
+    db.session.execute(insert(FreightRequest), [{
+        'user_id': shipper.id,
+        'freight_type': rng.choice(FREIGHT_TYPES),
+        'origin': rng.choice(CITIES),
+        'destination': rng.choice(CITIES),
+        'cargo_details': 'Palletised goods',
+        'weight': rng.uniform(100, 20000),
+        'status': 'pending',
+        'urgency': 'normal',
+        'created_at': now
+    } for _ in range(size)])
+
+    quoted = rng.sample(range(1, size + 1), int(size * quoted_share))
+    if quoted:
+        db.session.execute(insert(Quote), [{
+            'freight_request_id': request_id,
+            'provider_id': provider.id,
+            'price': 1000.0,
+            'estimated_delivery_date': now,
+            'status': 'pending',
+            'valid_until': now,
+            'created_at': now
+        } for request_id in quoted])
+    db.session.commit()
+    return provider.id
+
+def legacy_available_requests(provider):
+    """The original implementation: score every open request, probing quotes one by one."""
+    profile = load_provider_profile(provider)
+    matched = []
+    for req in FreightRequest.query.filter(FreightRequest.status.in_(['pending', 'quoted'])).all():
+        if Quote.query.filter_by(freight_request_id=req.id, provider_id=provider.id).first():
+            continue
+        score = calculate_match_score(req, provider, profile)
+        if score > 0:
+            matched.append((score, req.id))
+    matched.sort(reverse=True)
+    return matched
+
+def measure(func, counter, repeat):
+    timings, queries = [], []
+    for _ in range(repeat):
+        db.session.expire_all()
+        before = counter.count
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count - before)
+    return statistics.median(timings), max(queries)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--quoted-share', type=float, default=0.05)
+    parser.add_argument('--legacy', action='store_true', help='also time the original N+1 loop')
+    args = parser.parse_args()
+
+    client = app.test_client()
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        print(f"{'open requests':>14} {'mode':>8} {'queries':>8} {'median ms':>10}")
+
+        for size in [int(s) for s in args.sizes.split(',')]:
+            provider_id = seed(size, args.quoted_share)
+            headers = auth_headers(provider_id)
+            url = f'/api/matching/available-requests?limit={args.limit}'
+
+            def call():
+                response = client.get(url, headers=headers)
+                assert response.status_code == 200, response.get_json()
+
+            cold_ms, cold_queries = measure(call, counter, 1)
+            warm_ms, warm_queries = measure(call, counter, args.repeat)
+            print(f'{size:>14} {"cold":>8} {cold_queries:>8} {cold_ms:>10.1f}')
+            print(f'{size:>14} {"warm":>8} {warm_queries:>8} {warm_ms:>10.1f}')
+
+            if args.legacy:
+                provider = db.session.get(User, provider_id)
+                legacy_ms, legacy_queries = measure(lambda: legacy_available_requests(provider), counter, 1)
+                print(f'{size:>14} {"legacy":>8} {legacy_queries:>8} {legacy_ms:>10.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Compare N single-item calls with the batch endpoints.
+
+Imports N freight requests one call at a time, then as one JSON array, an
+NDJSON stream and a CSV upload, and quotes N requests singly and in bulk.
+Reports items per second for each path.
+
+    python benchmarks/bulk_import.py --items 1000
+"""
+import argparse
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta
+
+from common import app, reset_database, auth_headers
+from extensions import db
+from models import User, FreightRequest
+from generate_data import CITIES, FREIGHT_TYPES
+
+def freight_items(count):
+    return [{
+        'freight_type': FREIGHT_TYPES[i % len(FREIGHT_TYPES)],
+        'origin': CITIES[i % len(CITIES)],
+        'destination': CITIES[(i * 7 + 3) % len(CITIES)],
+        'cargo_details': f'Weekly schedule load {i}',
+        'weight': 1000 + i
+    } for i in range(count)]
+
+def seed():
+    reset_database()
+    shipper = User(email='shipper@bench', password='x', company_name='Shipper', user_type='shipper')
+    provider = User(email='provider@bench', password='x', company_name='Provider', user_type='provider')
+    db.session.add_all([shipper, provider])
+    db.session.commit()
+    return shipper.id, provider.id
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<32} {count:>6} items {elapsed:>8.2f}s {count / elapsed:>10.0f} items/s')
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=1000)
+    args = parser.parse_args()
+    items = freight_items(args.items)
+    client = app.test_client()
+
+    with app.app_context():
+        def check(response, expected):
+            assert response.status_code == expected, response.get_json()
+
+        shipper_id, provider_id = seed()
+        shipper, provider = auth_headers(shipper_id), auth_headers(provider_id)
+        single = timed('freight requests, one per call', args.items, lambda: [
+            check(client.post('/api/freight-requests', json=item, headers=shipper), 201) for item in items
+        ])
+
+        # The single-item quotes go to the requests created above
+        request_ids = [request_id for (request_id,) in db.session.query(FreightRequest.id)]
+        delivery = (datetime.utcnow() + timedelta(days=7)).isoformat()
+        quotes = [{'freight_request_id': request_id, 'price': 1000.0, 'estimated_delivery_date': delivery}
+                  for request_id in request_ids]
+        single_quotes = timed('quotes, one per call', args.items, lambda: [
+            check(client.post(f"/api/quotes/{quote['freight_request_id']}", json=quote, headers=provider), 201)
+            for quote in quotes
+        ])
+
+        seed()
+        bulk = timed('freight requests, JSON array', args.items, lambda: [
+            check(client.post('/api/freight-requests/bulk', json=chunk, headers=shipper), 201)
+            for chunk in (items[i:i + app.config['BULK_MAX_ITEMS']]
+                          for i in range(0, len(items), app.config['BULK_MAX_ITEMS']))
+        ])
+
+        ndjson = '\n'.join(json.dumps(item) for item in items)
+        timed('freight requests, NDJSON stream', args.items, lambda: check(client.post(
+            '/api/freight-requests/bulk', data=ndjson, content_type='application/x-ndjson', headers=shipper
+        ), 201))
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(items[0]))
+        writer.writeheader()
+        writer.writerows(items)
+        timed('freight requests, CSV upload', args.items, lambda: check(client.post(
+            '/api/freight-requests/bulk', data=buffer.getvalue(), content_type='text/csv', headers=shipper
+        ), 201))
+
+        request_ids = [request_id for (request_id,) in db.session.query(FreightRequest.id).limit(args.items)]
+        quotes = [dict(quote, freight_request_id=request_id) for quote, request_id in zip(quotes, request_ids)]
+        bulk_quotes = timed('quotes, bulk', args.items, lambda: [
+            check(client.post('/api/quotes/bulk', json=quotes[i:i + app.config['BULK_MAX_ITEMS']],
+                              headers=provider), 201)
+            for i in range(0, len(quotes), app.config['BULK_MAX_ITEMS'])
+        ])
+
+    print(f'\nspeedup: freight requests {single / bulk:.0f}x, quotes {single_quotes / bulk_quotes:.0f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Shared setup for the benchmark scripts.
+
+Importing this module points the app at a throwaway SQLite database (or
+BENCH_DATABASE_URL), runs background tasks inline, and exposes helpers to
+reset the schema and count the SQL statements a piece of code issues.
+No outbox workers run; scripts drain domain events explicitly, so handler
+work stays out of the request timings.
+"""
+import os
+import sys
+import tempfile
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL',
+    'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+)
+os.environ.setdefault('TASK_QUEUE_BACKEND', 'eager')
+# No background denylist reloads interleaving with the statement counts
+os.environ.setdefault('TOKEN_DENYLIST_REFRESH_SECONDS', '0')
+os.environ.setdefault('OUTBOX_WORKERS', '0')
+
+from sqlalchemy import event
+from sqlalchemy.exc import SAWarning
+from app import app
+from extensions import db
+from identity import create_user_token
+from models import User
+from matching_engine import matching_index
+
+class QueryCounter:
+    """Counts statements sent to the database through an engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+def reset_database():
+    """Drop and recreate every table and forget in-process indexes."""
+    db.session.remove()
+    with warnings.catch_warnings():
+        # freight_request and quote reference each other, which SQLite cannot ALTER away
+        warnings.simplefilter('ignore', SAWarning)
+        db.drop_all()
+    db.create_all()
+    matching_index.reset()
+
+def auth_headers(user_id):
+    """Bearer header for user_id carrying the same claims as a token from login."""
+    return {'Authorization': f'Bearer {create_user_token(User.query.get(user_id))}'}
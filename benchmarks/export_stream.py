@@ -0,0 +1,172 @@
+"""Benchmark the streaming exports against paging through the list endpoint.
+
+Seeds one shipper with N freight requests, each with a few quotes and
+some with a rating, plus a conversation of N messages. Each export is
+then streamed as NDJSON and as CSV, reporting rows/s, SQL statements and
+peak Python memory (tracemalloc, in a separate pass). The freight history
+is also fetched page by page from /api/freight-requests for comparison.
+Finally a download is cut off part way and resumed from the cursor of the
+last row read, and the run fails unless the two parts add up to the full
+export, or if peak memory grows more than --max-growth times from the
+smallest size to the largest.
+
+    python benchmarks/export_stream.py --sizes 1000,10000
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from common import app, reset_database, auth_headers, QueryCounter
+from extensions import db
+from models import User, FreightRequest, Quote, Rating, Conversation, Message
+
+QUOTES_PER_REQUEST = 4
+PROVIDERS = 8
+
+def seed(rng, count):
+    reset_database()
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'id': 1, 'email': 'shipper@bench', 'password': 'x', 'company_name': 'Shipper', 'user_type': 'shipper'}
+    ] + [
+        {'id': 2 + i, 'email': f'provider{i}@bench', 'password': 'x', 'company_name': f'Carrier {i}',
+         'user_type': 'provider'} for i in range(PROVIDERS)
+    ])
+    start = now - timedelta(days=365)
+    db.session.execute(insert(FreightRequest), [{
+        'id': i, 'user_id': 1, 'freight_type': rng.choice(['road', 'air', 'sea', 'rail']),
+        'origin': 'Rotterdam', 'destination': 'Milan', 'cargo_details': 'Palletised machine parts',
+        'weight': rng.uniform(100, 20000), 'status': 'completed', 'urgency': 'normal',
+        'created_at': start + timedelta(minutes=i), 'quote_count': QUOTES_PER_REQUEST,
+        'selected_quote_id': (i - 1) * QUOTES_PER_REQUEST + 1
+    } for i in range(1, count + 1)])
+    db.session.execute(insert(Quote), [{
+        'freight_request_id': i, 'provider_id': 2 + (i + q) % PROVIDERS, 'price': rng.uniform(500, 5000),
+        'estimated_delivery_date': start + timedelta(days=3, minutes=i), 'status': 'accepted' if q == 0 else 'rejected',
+        'created_at': start + timedelta(minutes=i, seconds=q + 1), 'valid_until': start + timedelta(days=7, minutes=i)
+    } for i in range(1, count + 1) for q in range(QUOTES_PER_REQUEST)])
+    db.session.execute(insert(Rating), [{
+        'freight_request_id': i, 'provider_id': 2 + i % PROVIDERS, 'shipper_id': 1,
+        'rating': rng.randint(1, 5), 'review': 'On time', 'created_at': start + timedelta(days=4, minutes=i)
+    } for i in range(1, count + 1) if rng.random() < 0.3])
+    db.session.execute(insert(Conversation), [{
+        'id': 1, 'freight_request_id': 1, 'shipper_id': 1, 'provider_id': 2, 'last_message_at': now
+    }])
+    db.session.execute(insert(Message), [{
+        'conversation_id': 1, 'freight_request_id': 1, 'sender_id': 1 + i % 2, 'recipient_id': 2 - i % 2,
+        'content': 'Can you confirm the pickup window?', 'created_at': start + timedelta(seconds=i),
+        'message_type': 'text', 'system_message': False
+    } for i in range(count)])
+    db.session.commit()
+
+def stream(client, url, headers, limit=None):
+    """Body lines of a streamed response; stops reading after limit lines."""
+    response = client.get(url, headers=headers, buffered=False)
+    assert response.status_code == 200, (url, response.status_code)
+    lines, tail = [], ''
+    try:
+        for chunk in response.response:
+            tail += chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+            *complete, tail = tail.split('\n')
+            lines.extend(complete)
+            if limit is not None and len(lines) >= limit:
+                return lines[:limit]
+    finally:
+        response.close()
+    return lines + ([tail] if tail else [])
+
+def timed_export(client, counter, url, headers):
+    statements = counter.count
+    started = time.perf_counter()
+    lines = stream(client, url, headers)
+    return lines, time.perf_counter() - started, counter.count - statements
+
+def peak_memory(client, url, headers):
+    """Peak allocations while the body is read and thrown away."""
+    response = client.get(url, headers=headers, buffered=False)
+    tracemalloc.start()
+    try:
+        for _ in response.response:
+            pass
+    finally:
+        response.close()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def paged(client, counter, headers, per_page):
+    statements, calls = counter.count, 0
+    started = time.perf_counter()
+    page = 1
+    while True:
+        body = client.get(f'/api/freight-requests?page={page}&per_page={per_page}', headers=headers).get_json()
+        calls += 1
+        if page >= body['pages']:
+            break
+        page += 1
+    return calls, time.perf_counter() - started, counter.count - statements
+
+def check_resume(client, url, headers, cut):
+    full = [json.loads(line)['id'] for line in stream(client, url, headers)]
+    first = [json.loads(line) for line in stream(client, url, headers, limit=cut)]
+    separator = '&' if '?' in url else '?'
+    rest = [json.loads(line)['id'] for line in
+            stream(client, f'{url}{separator}cursor={first[-1]["cursor"]}', headers)]
+    return [record['id'] for record in first] + rest == full
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000')
+    parser.add_argument('--per-page', type=int, default=100, help='page size for the paged comparison')
+    parser.add_argument('--max-growth', type=float, default=2.0)
+    parser.add_argument('--seed', type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        client = app.test_client()
+        exports = [
+            ('freight history', '/api/exports/freight-history'),
+            ('messages', '/api/exports/conversations/1/messages'),
+        ]
+        peaks = {}
+        print(f'EXPORT_BATCH_SIZE {app.config["EXPORT_BATCH_SIZE"]}')
+        for size in sorted(int(s) for s in args.sizes.split(',')):
+            seed(random.Random(args.seed), size)
+            headers = auth_headers(1)
+            print(f'{size} rows')
+            for label, url in exports:
+                for export_format in ('ndjson', 'csv'):
+                    export_url = f'{url}?format={export_format}'
+                    lines, elapsed, statements = timed_export(client, counter, export_url, headers)
+                    rows = len(lines) - (export_format == 'csv')
+                    if rows != size:
+                        print(f'  {label} {export_format}: expected {size} rows, got {rows}')
+                        failed = True
+                    peak = peak_memory(client, export_url, headers)
+                    peaks.setdefault((label, export_format), []).append(peak)
+                    print(f'  export {label:16} {export_format:7} {rows / elapsed:9.0f} rows/s  '
+                          f'{statements:5} statements  peak {peak / 1024:8.0f} KiB')
+            calls, elapsed, statements = paged(client, counter, headers, args.per_page)
+            print(f'  paged  freight requests per_page={args.per_page}: {calls} calls, {statements} statements, '
+                  f'{size / elapsed:.0f} rows/s (without quotes or ratings)')
+            for label, url in exports:
+                if not check_resume(client, url, headers, cut=size // 3):
+                    print(f'  {label}: resuming from the cursor did not reproduce the full export')
+                    failed = True
+
+        for (label, export_format), values in peaks.items():
+            if len(values) > 1 and values[-1] > values[0] * args.max_growth:
+                print(f'{label} {export_format}: peak memory grew {values[-1] / values[0]:.1f}x')
+                failed = True
+    if failed:
+        raise SystemExit(1)
+    print('ok')
+
+if __name__ == '__main__':
+    main()
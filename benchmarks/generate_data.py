@@ -0,0 +1,320 @@
+"""Fill the schema with a synthetic, reproducible marketplace.
+
+At --scale 1.0 this writes roughly 50k users, 500k freight requests, 5M
+quotes and 10M messages. Lanes and provider activity are Zipf-skewed: a
+handful of hub cities and big carriers account for most of the traffic,
+with a long tail behind them. The same --seed always produces the same data.
+Derived counters (quote counts, unread counts, rating aggregates) are
+rebuilt with the reconcile helpers at the end, so the data is consistent
+with what the routes would have written.
+
+    python benchmarks/generate_data.py --scale 0.01
+    BENCH_DATABASE_URL=sqlite:////tmp/market.db python benchmarks/generate_data.py --scale 1
+
+Without BENCH_DATABASE_URL the data goes to a throwaway database; the
+load-test harness imports `generate` and works on it directly.
+"""
+import argparse
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, text
+from common import app, reset_database
+from extensions import db, bcrypt
+from models import (User, ProviderServiceArea, ProviderSpecialty, FreightRequest, Quote, Rating,
+                    Conversation, Message)
+from quotes import reconcile_quote_counts
+from messaging import reconcile_unread_counts
+from ratings import reconcile_provider_ratings
+from matching_engine import matching_index
+
+FULL_SCALE = {
+    'users': 50_000,
+    'freight_requests': 500_000,
+    'quotes': 5_000_000,
+    'messages': 10_000_000,
+}
+PROVIDER_SHARE = 0.2
+MESSAGES_PER_CONVERSATION = 40
+RATED_SHARE = 0.7
+READ_SHARE = 0.9
+PASSWORD = 'benchmark'
+
+# Ordered busiest first; weights follow the order
+CITIES = ['Rotterdam', 'Hamburg', 'Antwerp', 'Shanghai', 'Singapore', 'Los Angeles', 'Felixstowe',
+          'Le Havre', 'Bremen', 'Valencia', 'Genoa', 'Barcelona', 'Gdansk', 'Piraeus', 'Marseille',
+          'Dubai', 'New York', 'Chicago', 'Frankfurt', 'Paris', 'Milan', 'Madrid', 'Warsaw', 'Prague',
+          'Vienna', 'Munich', 'Lyon', 'Lisbon', 'Gothenburg', 'Copenhagen', 'Oslo', 'Stockholm',
+          'Helsinki', 'Riga', 'Tallinn', 'Vilnius', 'Budapest', 'Bucharest', 'Sofia', 'Zagreb',
+          'Ljubljana', 'Bratislava', 'Zurich', 'Basel', 'Brussels', 'Luxembourg', 'Dublin', 'Leeds',
+          'Glasgow', 'Porto']
+# Every city is in the bundled gazetteer, so generated rows are geocoded like API-created ones
+COORDINATES = {city: (place.latitude, place.longitude)
+               for city, place in ((city, app.extensions['gazetteer'].lookup(city)) for city in CITIES)}
+RADII_KM = [50, 100, 150, 250]
+FREIGHT_TYPES = ['road', 'sea', 'air', 'rail']
+STATUSES = ['pending', 'quoted', 'in_progress', 'completed', 'cancelled']
+STATUS_WEIGHTS = [25, 25, 15, 30, 5]
+RATING_WEIGHTS = [4, 5, 11, 30, 50]
+CARGO = ['Palletised consumer goods', 'Machine parts', 'Frozen seafood', 'Auto components',
+         'Textiles in cartons', 'Steel coils', 'Pharmaceuticals, temperature controlled',
+         'Furniture', 'Electronics', 'Bulk grain']
+PHRASES = ['Can you confirm the pickup window?', 'Loading dock is open from 7am.',
+           'Price includes customs clearance.', 'Please share the packing list.',
+           'We can move the delivery forward a day.', 'Truck is booked.', 'Any hazardous goods?',
+           'Invoice to follow after delivery.']
+
+def zipf_cum_weights(n, s=1.1):
+    """Cumulative Zipf weights for use with random.choices(cum_weights=...)."""
+    return list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+def pick_distinct(rng, population, cum_weights, k):
+    """Up to k distinct weighted picks, busiest first as they are drawn."""
+    k = min(k, len(population))
+    picked = {}
+    for _ in range(8 * k):
+        if len(picked) == k:
+            break
+        picked.setdefault(rng.choices(population, cum_weights=cum_weights)[0], None)
+    return list(picked)
+
+def volumes(scale):
+    counts = {name: max(1, int(count * scale)) for name, count in FULL_SCALE.items()}
+    counts['users'] = max(counts['users'], 10)
+    return counts
+
+class ChunkedWriter:
+    """Buffers rows per model and flushes them with executemany in dependency order."""
+
+    ORDER = [FreightRequest, Quote, Rating, Conversation, Message]
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.buffers = {model: [] for model in self.ORDER}
+        self.written = {model: 0 for model in self.ORDER}
+
+    def add(self, model, row):
+        self.buffers[model].append(row)
+        if len(self.buffers[model]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        # Parents before children, so foreign keys hold on backends that check them
+        for model in self.ORDER:
+            rows = self.buffers[model]
+            if rows:
+                db.session.execute(insert(model), rows)
+                self.written[model] += len(rows)
+                rows.clear()
+        db.session.commit()
+
+def _insert_users(rng, counts, now):
+    password = bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    providers = max(2, int(counts['users'] * PROVIDER_SHARE))
+    shippers = counts['users'] - providers
+    city_weights = zipf_cum_weights(len(CITIES))
+
+    users, areas, specialties = [], [], []
+    for user_id in range(1, counts['users'] + 1):
+        is_provider = user_id > shippers
+        users.append({
+            'id': user_id,
+            'email': f"{'provider' if is_provider else 'shipper'}{user_id}@bench.example",
+            'password': password,
+            'company_name': f"{'Carrier' if is_provider else 'Shipper'} {user_id}",
+            'user_type': 'provider' if is_provider else 'shipper',
+            'created_at': now - timedelta(days=rng.randint(30, 1000)),
+            'rating': 0.0,
+            'total_ratings': 0,
+            'unread_messages': 0
+        })
+        if is_provider:
+            served = set(rng.choices(CITIES, cum_weights=city_weights, k=rng.randint(3, 8)))
+            areas.extend({'user_id': user_id, 'area': area, 'latitude': COORDINATES[area][0],
+                          'longitude': COORDINATES[area][1], 'radius_km': rng.choice(RADII_KM)} for area in served)
+            offered = set(rng.choices(FREIGHT_TYPES, weights=[50, 25, 15, 10], k=rng.randint(1, 2)))
+            specialties.extend({'user_id': user_id, 'freight_type': kind} for kind in offered)
+
+    db.session.execute(insert(User), users)
+    db.session.execute(insert(ProviderServiceArea), areas)
+    db.session.execute(insert(ProviderSpecialty), specialties)
+    db.session.commit()
+    return list(range(1, shippers + 1)), list(range(shippers + 1, counts['users'] + 1))
+
+def _reset_sequences():
+    """Explicit ids leave Postgres sequences behind; move them past the generated rows."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in [User, FreightRequest, Quote, Rating, Conversation, Message]:
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+            f"(SELECT COALESCE(MAX(id), 1) FROM \"{table}\"))"
+        ))
+    db.session.commit()
+
+def generate(scale=0.01, seed=42, chunk_size=20_000, verbose=False):
+    """Reset the database and fill it. Returns the number of rows written per table."""
+    rng = random.Random(seed)
+    counts = volumes(scale)
+    now = datetime.utcnow().replace(microsecond=0)
+    reset_database()
+
+    shippers, providers = _insert_users(rng, counts, now)
+    city_weights = zipf_cum_weights(len(CITIES))
+    shipper_weights = zipf_cum_weights(len(shippers), s=0.8)
+    provider_weights = zipf_cum_weights(len(providers), s=1.2)
+
+    # Quotes and conversations go to requests that left 'pending'
+    quoted_requests = counts['freight_requests'] * sum(STATUS_WEIGHTS[1:]) / sum(STATUS_WEIGHTS)
+    quotes_per_request = max(1.0, counts['quotes'] / quoted_requests)
+    conversations = max(1, counts['messages'] // MESSAGES_PER_CONVERSATION)
+    conversation_chance = min(1.0, conversations / quoted_requests)
+    messages_per_conversation = max(1, counts['messages'] // conversations)
+
+    writer = ChunkedWriter(chunk_size)
+    quote_id = conversation_id = message_id = rating_id = 0
+    for request_id in range(1, counts['freight_requests'] + 1):
+        status = rng.choices(STATUSES, weights=STATUS_WEIGHTS)[0]
+        shipper_id = rng.choices(shippers, cum_weights=shipper_weights)[0]
+        origin, destination = rng.choices(CITIES, cum_weights=city_weights, k=2)
+        if status in ('pending', 'quoted'):
+            created_at = now - timedelta(minutes=rng.randint(1, 14 * 24 * 60))
+        else:
+            created_at = now - timedelta(minutes=rng.randint(14 * 24 * 60, 365 * 24 * 60))
+        writer.add(FreightRequest, {
+            'id': request_id,
+            'user_id': shipper_id,
+            'freight_type': rng.choices(FREIGHT_TYPES, weights=[50, 25, 15, 10])[0],
+            'origin': origin,
+            'destination': destination,
+            'origin_latitude': COORDINATES[origin][0],
+            'origin_longitude': COORDINATES[origin][1],
+            'destination_latitude': COORDINATES[destination][0],
+            'destination_longitude': COORDINATES[destination][1],
+            'cargo_details': rng.choice(CARGO),
+            'weight': round(rng.lognormvariate(7.5, 1.0), 1),
+            'dimensions': f'{rng.randint(1, 13)}x2.4x2.6',
+            'deadline': created_at + timedelta(days=rng.randint(3, 60)),
+            'status': status,
+            'created_at': created_at,
+            'urgency': rng.choices(['normal', 'urgent', 'very_urgent'], weights=[80, 15, 5])[0],
+            'quote_count': 0
+        })
+        if status == 'pending':
+            continue
+
+        bidders = pick_distinct(rng, providers, provider_weights,
+                                rng.randint(1, max(1, int(2 * quotes_per_request) - 1)))
+        closed = status in ('in_progress', 'completed')
+        for position, provider_id in enumerate(bidders):
+            quote_id += 1
+            quoted_at = created_at + timedelta(minutes=rng.randint(5, 48 * 60))
+            if status == 'quoted':
+                quote_status = 'pending'
+            elif closed and position == 0:
+                quote_status = 'accepted'
+            else:
+                quote_status = 'rejected'
+            writer.add(Quote, {
+                'id': quote_id,
+                'freight_request_id': request_id,
+                'provider_id': provider_id,
+                'price': round(rng.uniform(300, 15000), 2),
+                'estimated_delivery_date': quoted_at + timedelta(days=rng.randint(2, 30)),
+                'description': 'Door to door',
+                'status': quote_status,
+                'created_at': quoted_at,
+                'valid_until': quoted_at + timedelta(hours=48),
+                'insurance_coverage': 0.0
+            })
+
+        if status == 'completed' and rng.random() < RATED_SHARE:
+            rating_id += 1
+            writer.add(Rating, {
+                'id': rating_id,
+                'freight_request_id': request_id,
+                'provider_id': bidders[0],
+                'shipper_id': shipper_id,
+                'rating': rng.choices(range(1, 6), weights=RATING_WEIGHTS)[0],
+                'review': 'Delivered as agreed',
+                'created_at': created_at + timedelta(days=rng.randint(3, 40))
+            })
+
+        if rng.random() < conversation_chance:
+            conversation_id += 1
+            provider_id = rng.choice(bidders)
+            sent_at = created_at + timedelta(minutes=rng.randint(10, 24 * 60))
+            timeline = []
+            for _ in range(rng.randint(1, 2 * messages_per_conversation - 1)):
+                sent_at += timedelta(minutes=rng.randint(1, 240))
+                timeline.append(sent_at)
+            writer.add(Conversation, {
+                'id': conversation_id,
+                'freight_request_id': request_id,
+                'shipper_id': shipper_id,
+                'provider_id': provider_id,
+                'created_at': created_at,
+                'last_message_at': timeline[-1],
+                'shipper_archived': False,
+                'provider_archived': False,
+                'shipper_unread': 0,
+                'provider_unread': 0
+            })
+            for j, sent_at in enumerate(timeline):
+                message_id += 1
+                from_shipper = j % 2 == 0
+                writer.add(Message, {
+                    'id': message_id,
+                    'conversation_id': conversation_id,
+                    'freight_request_id': request_id,
+                    'sender_id': shipper_id if from_shipper else provider_id,
+                    'recipient_id': provider_id if from_shipper else shipper_id,
+                    'content': rng.choice(PHRASES),
+                    'created_at': sent_at,
+                    'read_at': sent_at + timedelta(minutes=30) if rng.random() < READ_SHARE else None,
+                    'message_type': 'text',
+                    'system_message': False
+                })
+
+        if verbose and request_id % 50_000 == 0:
+            print(f'  {request_id} freight requests generated')
+    writer.flush()
+
+    # freight_request and quote reference each other; link accepted quotes afterwards
+    accepted = select(Quote.id).where(Quote.freight_request_id == FreightRequest.id,
+                                      Quote.status == 'accepted').scalar_subquery()
+    db.session.execute(FreightRequest.__table__.update()
+                       .where(FreightRequest.status.in_(['in_progress', 'completed']))
+                       .values(selected_quote_id=accepted))
+    db.session.commit()
+    _reset_sequences()
+    reconcile_quote_counts()
+    reconcile_unread_counts()
+    reconcile_provider_ratings()
+    matching_index.reset()
+
+    written = {model.__tablename__: count for model, count in writer.written.items()}
+    written['user'] = counts['users']
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=float, default=0.01, help='1.0 = 50k users, 500k requests, 5M quotes, 10M messages')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=20_000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Generating into {db.engine.url.render_as_string(hide_password=True)}")
+        start = time.perf_counter()
+        written = generate(args.scale, args.seed, args.chunk_size, verbose=True)
+        elapsed = time.perf_counter() - start
+    for table, count in written.items():
+        print(f'{table:>16} {count:>10}')
+    print(f'done in {elapsed:.1f}s')
+
+if __name__ == '__main__':
+    main()
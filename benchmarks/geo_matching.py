@@ -0,0 +1,117 @@
+"""Benchmark radius matching over a large open backlog in the matching index.
+
+Loads N open freight requests into the in-process matching index, placed
+at gazetteer cities as the API geocodes them, then times top_matches for
+providers with one to eight service areas of 50-500 km. Results are
+checked against a brute-force scan that scores each request with
+Coverage.score, and the run fails if p95 exceeds --budget-ms.
+
+--scatter-km spreads the points around each city, as street-level
+geocoding would. Every request then becomes its own lane, so expect the
+cost to grow with the number of requests in range.
+
+    python benchmarks/geo_matching.py --requests 100000
+"""
+import argparse
+import heapq
+import math
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+from common import app
+from geo import KM_PER_DEGREE
+from matching_engine import (MatchingIndex, Coverage, rating_score,
+                             ORIGIN_SCORE, DESTINATION_SCORE, SPECIALTY_SCORE)
+from generate_data import CITIES, COORDINATES, FREIGHT_TYPES, zipf_cum_weights
+
+def scatter(rng, city, scatter_km):
+    latitude, longitude = COORDINATES[city]
+    distance, bearing = rng.uniform(0, scatter_km), rng.uniform(0, 2 * math.pi)
+    latitude += distance * math.cos(bearing) / KM_PER_DEGREE
+    longitude += distance * math.sin(bearing) / (KM_PER_DEGREE * math.cos(math.radians(latitude)))
+    return latitude, longitude
+
+def build_index(rng, count, scatter_km):
+    index = MatchingIndex()
+    weights = zipf_cum_weights(len(CITIES))
+    requests = []
+    for request_id in range(1, count + 1):
+        origin, destination = rng.choices(CITIES, cum_weights=weights, k=2)
+        origin_lat, origin_lon = scatter(rng, origin, scatter_km)
+        destination_lat, destination_lon = scatter(rng, destination, scatter_km)
+        request = SimpleNamespace(
+            id=request_id, status='pending', origin=origin, destination=destination,
+            freight_type=rng.choice(FREIGHT_TYPES), weight=rng.uniform(100, 20000),
+            origin_latitude=origin_lat, origin_longitude=origin_lon,
+            destination_latitude=destination_lat, destination_longitude=destination_lon
+        )
+        index.add(request)
+        requests.append(request)
+    return index, requests
+
+def random_provider(rng):
+    areas = [SimpleNamespace(area=f'depot {i}', latitude=lat, longitude=lon, radius_km=rng.uniform(50, 500))
+             for i, (lat, lon) in enumerate(COORDINATES[city] for city in rng.sample(CITIES, rng.randint(1, 8)))]
+    return Coverage(areas), set(rng.sample(FREIGHT_TYPES, rng.randint(1, 2))), rng.uniform(0, 5)
+
+def brute_force(requests, coverage, specialties, rating, k):
+    base = rating_score(rating)
+    scored = []
+    for request in requests:
+        score = coverage.score(request.origin, request.origin_latitude, request.origin_longitude, ORIGIN_SCORE) + \
+            coverage.score(request.destination, request.destination_latitude,
+                           request.destination_longitude, DESTINATION_SCORE) + \
+            SPECIALTY_SCORE * (request.freight_type in specialties)
+        if score:
+            scored.append((score + base, request.id))
+    return heapq.nlargest(k, scored)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=100_000)
+    parser.add_argument('--providers', type=int, default=50, help='distinct provider profiles to query')
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--scatter-km', type=float, default=0.0)
+    parser.add_argument('--budget-ms', type=float, default=100.0)
+    parser.add_argument('--check', type=int, default=10, help='queries verified against a full scan')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    index, requests = build_index(rng, args.requests, args.scatter_km)
+    print(f'indexed {args.requests} open requests in {time.perf_counter() - started:.1f}s')
+
+    timings, mismatches, scan_timings = [], 0, []
+    for query in range(args.providers):
+        coverage, specialties, rating = random_provider(rng)
+        start = time.perf_counter()
+        matches = index.top_matches(coverage, specialties, rating, args.limit)
+        timings.append((time.perf_counter() - start) * 1000)
+
+        if query < args.check:
+            start = time.perf_counter()
+            expected = brute_force(requests, coverage, specialties, rating, args.limit)
+            scan_timings.append((time.perf_counter() - start) * 1000)
+            if matches != expected:
+                mismatches += 1
+
+    timings.sort()
+    p95 = timings[max(0, math.ceil(len(timings) * 0.95) - 1)]
+    print(f'top_matches   p50 {statistics.median(timings):7.1f} ms   p95 {p95:7.1f} ms   max {timings[-1]:7.1f} ms')
+    if scan_timings:
+        print(f'full scan     p50 {statistics.median(scan_timings):7.1f} ms   ({len(scan_timings)} queries checked)')
+
+    if mismatches:
+        print(f'{mismatches} queries returned different matches than the full scan')
+        sys.exit(1)
+    if p95 > args.budget_ms:
+        print(f'p95 {p95:.1f} ms is over the {args.budget_ms:.0f} ms budget')
+        sys.exit(1)
+    print('Matches agree with the full scan and stay within budget')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""Drive the main marketplace flows and compare against a stored baseline.
+
+Generates a synthetic marketplace (see generate_data.py), then runs the
+matching, quoting, listing, messaging and rating flows through the Flask
+test client. For every step it reports p50/p95/p99 latency, throughput and
+SQL statements per request. Domain events a request emits are drained
+right after it, outside its timing, and reported as a `<step>.outbox` step.
+The run fails if a step issues more statements
+than the baseline, its p95 regresses beyond the tolerance, or a request
+returns an unexpected status.
+
+    python benchmarks/load_test.py                      # compare with benchmarks/baseline.json
+    python benchmarks/load_test.py --update-baseline    # record a new baseline
+    python benchmarks/load_test.py --url http://localhost:8000
+
+With --url the requests go to a running server instead. Point the server and
+BENCH_DATABASE_URL at the same database and give both the same
+JWT_SECRET_KEY; statement counts are not available in that mode.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from common import app, QueryCounter, auth_headers
+from extensions import db
+from models import User, FreightRequest, Conversation, Rating
+from events import drain_outbox
+from generate_data import generate, CITIES, FREIGHT_TYPES, PHRASES
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+class TestClientDriver:
+    """Runs requests in-process and counts the SQL statements each one issues."""
+
+    def __init__(self):
+        self.client = app.test_client()
+        self.counter = QueryCounter(db.engine)
+
+    def request(self, method, path, headers, body=None):
+        before = self.counter.count
+        response = self.client.open(path, method=method, headers=headers, json=body)
+        return response.status_code, response.get_json(silent=True), self.counter.count - before
+
+    def settle(self):
+        """Deliver the events the last request emitted. Returns (events handled, statements)."""
+        before = self.counter.count
+        return drain_outbox(), self.counter.count - before
+
+class HTTPDriver:
+    """Sends requests to a running server over HTTP."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, headers, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers=dict(headers, **{'Content-Type': 'application/json'}))
+        try:
+            with urllib.request.urlopen(req) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        try:
+            return status, json.loads(payload), None
+        except ValueError:
+            return status, None, None
+
+    def settle(self):
+        # The server's own outbox workers deliver its events
+        return 0, None
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+class Recorder:
+    """Times each step and keeps latency, statement counts and unexpected statuses."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.recording = True
+        self.steps = {}
+        self.errors = []
+
+    def call(self, step, method, path, user_id, body=None, expect=(200,)):
+        headers = auth_headers(user_id)
+        start = time.perf_counter()
+        status, payload, queries = self.driver.request(method, path, headers, body)
+        elapsed = (time.perf_counter() - start) * 1000
+        if status not in expect:
+            self.errors.append(f'{step}: {method} {path} -> {status} {payload}')
+        self.record(step, elapsed, queries)
+
+        start = time.perf_counter()
+        handled, queries = self.driver.settle()
+        if handled:
+            self.record(f'{step}.outbox', (time.perf_counter() - start) * 1000, queries)
+        return payload or {}
+
+    def record(self, step, elapsed, queries):
+        if self.recording:
+            samples = self.steps.setdefault(step, {'ms': [], 'queries': []})
+            samples['ms'].append(elapsed)
+            if queries is not None:
+                samples['queries'].append(queries)
+
+    def summary(self):
+        results = {}
+        for step, samples in self.steps.items():
+            timings = sorted(samples['ms'])
+            queries = sorted(samples['queries'])
+            results[step] = {
+                'requests': len(timings),
+                'p50': round(percentile(timings, 50), 2),
+                'p95': round(percentile(timings, 95), 2),
+                'p99': round(percentile(timings, 99), 2),
+                'rps': round(len(timings) / (sum(timings) / 1000), 1) if sum(timings) else 0.0,
+                'queries': percentile(queries, 50) if queries else None
+            }
+        return results
+
+class Marketplace:
+    """Ids the flows pick from, loaded once from the generated data."""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.shippers = db.session.scalars(select(User.id).where(User.user_type == 'shipper')).all()
+        self.providers = db.session.scalars(select(User.id).where(User.user_type == 'provider')).all()
+        self.requests = db.session.execute(select(FreightRequest.id, FreightRequest.user_id)).all()
+        self.conversations = db.session.execute(
+            select(Conversation.id, Conversation.shipper_id, Conversation.provider_id)
+        ).all()
+        rated = select(Rating.freight_request_id)
+        self.unrated = db.session.execute(
+            select(FreightRequest.id, FreightRequest.user_id)
+            .where(FreightRequest.status == 'completed', FreightRequest.id.not_in(rated))
+        ).all()
+        self.rng.shuffle(self.unrated)
+        db.session.remove()
+
+def flow_matching(rec, market):
+    provider_id = market.rng.choice(market.providers)
+    rec.call('matching.available', 'GET', '/api/matching/available-requests?limit=20', provider_id)
+    rec.call('matching.inbox', 'GET', '/api/matching/inbox?per_page=20', provider_id)
+
+def flow_quoting(rec, market):
+    rng = market.rng
+    shipper_id = rng.choice(market.shippers)
+    created = rec.call('quoting.create_request', 'POST', '/api/freight-requests', shipper_id, {
+        'freight_type': rng.choice(FREIGHT_TYPES),
+        'origin': rng.choice(CITIES[:10]),
+        'destination': rng.choice(CITIES),
+        'cargo_details': 'Load test cargo',
+        'weight': round(rng.uniform(100, 20000), 1)
+    }, expect=(201,))
+    request_id = created.get('freight_request', {}).get('id')
+    if not request_id:
+        return
+
+    quote_ids = []
+    delivery = (datetime.utcnow() + timedelta(days=7)).isoformat()
+    for provider_id in rng.sample(market.providers, min(3, len(market.providers))):
+        quote = rec.call('quoting.submit_quote', 'POST', f'/api/quotes/{request_id}', provider_id, {
+            'price': round(rng.uniform(300, 15000), 2),
+            'estimated_delivery_date': delivery
+        }, expect=(201,))
+        if quote.get('quote_id'):
+            quote_ids.append(quote['quote_id'])
+
+    rec.call('quoting.list_quotes', 'GET', f'/api/quotes/{request_id}', shipper_id)
+    if quote_ids:
+        rec.call('quoting.accept_quote', 'POST', f'/api/quotes/{quote_ids[0]}/accept', shipper_id)
+
+def flow_listing(rec, market):
+    request_id, shipper_id = market.rng.choice(market.requests)
+    rec.call('listing.page', 'GET', '/api/freight-requests?per_page=20', shipper_id)
+    rec.call('listing.cursor', 'GET', '/api/freight-requests?cursor=&per_page=20', shipper_id)
+    rec.call('listing.detail', 'GET', f'/api/freight-requests/{request_id}', shipper_id)
+
+def flow_messaging(rec, market):
+    conversation_id, shipper_id, provider_id = market.rng.choice(market.conversations)
+    rec.call('messaging.conversations', 'GET', '/api/conversations?per_page=20', shipper_id)
+    rec.call('messaging.messages', 'GET', f'/api/conversations/{conversation_id}/messages?per_page=20', shipper_id)
+    rec.call('messaging.send', 'POST', f'/api/conversations/{conversation_id}/messages', provider_id,
+             {'content': market.rng.choice(PHRASES)}, expect=(201,))
+
+def flow_rating(rec, market):
+    if not market.unrated:
+        return
+    request_id, shipper_id = market.unrated.pop()
+    rec.call('rating.submit', 'POST', f'/api/ratings/{request_id}', shipper_id,
+             {'rating': market.rng.choice([3, 4, 4, 5, 5]), 'review': 'Load test'}, expect=(201,))
+    provider_id = market.rng.choice(market.providers)
+    rec.call('rating.stats', 'GET', f'/api/ratings/stats/provider/{provider_id}', shipper_id)
+    rec.call('rating.list', 'GET', f'/api/ratings/provider/{provider_id}?per_page=10', shipper_id)
+
+FLOWS = {
+    'matching': flow_matching,
+    'quoting': flow_quoting,
+    'listing': flow_listing,
+    'messaging': flow_messaging,
+    'rating': flow_rating,
+}
+
+def compare(results, baseline, tolerance, slack_ms):
+    """Return the regressions of results against a baseline."""
+    failures = []
+    for step, base in baseline['steps'].items():
+        current = results.get(step)
+        if current is None:
+            failures.append(f'{step}: missing from this run')
+            continue
+        if base.get('queries') is not None and current['queries'] is not None \
+                and current['queries'] > base['queries']:
+            failures.append(f"{step}: {current['queries']} statements per request, baseline {base['queries']}")
+        limit = base['p95'] * (1 + tolerance) + slack_ms
+        if current['p95'] > limit:
+            failures.append(f"{step}: p95 {current['p95']}ms, baseline {base['p95']}ms (limit {limit:.2f}ms)")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=float, default=0.002, help='data volume, see generate_data.py')
+    parser.add_argument('--iterations', type=int, default=50, help='runs of each flow')
+    parser.add_argument('--warmup', type=int, default=5, help='unrecorded runs of each flow first')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--flows', default=','.join(FLOWS))
+    parser.add_argument('--url', help='drive a running server instead of the test client')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative p95 regression')
+    parser.add_argument('--slack-ms', type=float, default=2.0, help='absolute p95 allowance for noisy fast steps')
+    args = parser.parse_args()
+
+    flows = [FLOWS[name] for name in args.flows.split(',')]
+    with app.app_context():
+        print(f'Generating data at scale {args.scale}...')
+        written = generate(args.scale, args.seed)
+        print('  ' + ', '.join(f'{table}: {count}' for table, count in written.items()))
+        market = Marketplace(args.seed)
+        recorder = Recorder(HTTPDriver(args.url) if args.url else TestClientDriver())
+
+        recorder.recording = False
+        for _ in range(args.warmup):
+            for flow in flows:
+                flow(recorder, market)
+        recorder.recording = True
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            for flow in flows:
+                flow(recorder, market)
+        elapsed = time.perf_counter() - start
+
+    results = recorder.summary()
+    total = sum(step['requests'] for step in results.values())
+    print(f"\n{'step':<26} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8}")
+    for step, r in results.items():
+        queries = '-' if r['queries'] is None else r['queries']
+        print(f"{step:<26} {r['requests']:>5} {r['p50']:>8} {r['p95']:>8} {r['p99']:>8} {r['rps']:>8} {queries:>8}")
+    print(f'\n{total} requests in {elapsed:.2f}s, {total / elapsed:.1f} req/s overall')
+
+    if recorder.errors:
+        print(f'\n{len(recorder.errors)} unexpected responses, first ones:')
+        for error in recorder.errors[:10]:
+            print(f'  {error}')
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'scale': args.scale, 'iterations': args.iterations, 'steps': results}, f, indent=2)
+            f.write('\n')
+        print(f'Baseline written to {args.baseline}')
+        sys.exit(1 if recorder.errors else 0)
+
+    failures = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline.get('scale'), baseline.get('iterations')) != (args.scale, args.iterations):
+            print(f"\nNote: baseline was recorded at scale {baseline.get('scale')} "
+                  f"with {baseline.get('iterations')} iterations")
+        failures = compare(results, baseline, args.tolerance, args.slack_ms)
+        print('\nRegressions against baseline:' if failures else '\nNo regressions against baseline')
+        for failure in failures:
+            print(f'  {failure}')
+    else:
+        print(f'\nNo baseline at {args.baseline}; run with --update-baseline to record one')
+
+    sys.exit(1 if failures or recorder.errors else 0)
+
+if __name__ == '__main__':
+    main()
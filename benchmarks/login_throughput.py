@@ -0,0 +1,133 @@
+"""Login throughput and CPU cost per login, inline and on the hashing pool.
+
+Each scenario runs --logins successful logins from --concurrency client
+threads against a pool of N hashing processes (0 hashes on the request
+thread). It reports logins/s, logins per CPU-second (the per-core
+throughput, counting the server and the pool processes), and the p95 of
+/api/health requests made alongside, which shows how much the hashes hold
+up the rest of the worker. A last run floods one account from one address
+with rate limiting on and reports how many attempts reached bcrypt.
+
+    python benchmarks/login_throughput.py --rounds 12 --workers 0,1,4
+"""
+import argparse
+import math
+import os
+import resource
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import app, reset_database
+from extensions import db
+from models import User
+from passwords import PasswordHasher
+
+PASSWORD = 'correct horse battery staple'
+
+def cpu_seconds(hasher):
+    """CPU time of this process and of the pool processes, which the forkserver owns (Linux /proc)."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    total = usage.ru_utime + usage.ru_stime
+    executor = hasher._executor
+    for pid in (executor._processes if executor else {}):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime are fields 14 and 15 of stat(5), counted after the command name
+        total += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return total
+
+def seed(users, rounds):
+    reset_database()
+    hashed = PasswordHasher(rounds, 0, 1).hash(PASSWORD)
+    db.session.add_all([
+        User(email=f'user{i}@bench', password=hashed, company_name=f'Company {i}', user_type='shipper')
+        for i in range(users)
+    ])
+    db.session.commit()
+
+def p95(timings):
+    timings = sorted(timings)
+    return timings[max(0, math.ceil(len(timings) * 0.95) - 1)] if timings else 0.0
+
+def run(workers, args):
+    hasher = PasswordHasher(args.rounds, workers, args.concurrency)
+    app.extensions['password_hasher'] = hasher
+    client = app.test_client()
+    if workers:
+        hasher.check(hasher.hash('warm'), 'warm')  # start the pool outside the measurement
+
+    done = threading.Event()
+    probes = []
+
+    def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            client.get('/api/health')
+            probes.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.005)
+
+    def login(i):
+        email = f'user{i % args.users}@bench'
+        return app.test_client().post('/api/auth/login', json={'email': email, 'password': PASSWORD}).status_code
+
+    prober = threading.Thread(target=probe)
+    cpu_before, started = cpu_seconds(hasher), time.perf_counter()
+    prober.start()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        statuses = list(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    prober.join()
+    cpu = cpu_seconds(hasher) - cpu_before
+    hasher.shutdown()
+
+    failed = sum(status != 200 for status in statuses)
+    label = f'{workers} process' + ('es' if workers != 1 else '') if workers else 'inline'
+    print(f'{label:12} {args.logins / elapsed:8.1f} logins/s  {args.logins / cpu:8.1f} per CPU-second  '
+          f'health p50 {statistics.median(probes):6.1f} ms  p95 {p95(probes):6.1f} ms'
+          + (f'  {failed} failed' if failed else ''))
+    return failed
+
+def flood(args):
+    app.extensions['password_hasher'] = PasswordHasher(args.rounds, 0, 1)
+    app.extensions['rate_limiter'].clear()
+    client = app.test_client()
+    started = time.perf_counter()
+    statuses = [
+        client.post('/api/auth/login', json={'email': 'user0@bench', 'password': 'wrong'}).status_code
+        for _ in range(args.flood)
+    ]
+    elapsed = time.perf_counter() - started
+    print(f'flood        {args.flood} attempts on one account in {elapsed:.2f}s: '
+          f'{statuses.count(401)} checked with bcrypt, {statuses.count(429)} rejected with 429')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rounds', type=int, default=app.config['BCRYPT_LOG_ROUNDS'])
+    parser.add_argument('--workers', default=f'0,1,{os.cpu_count() or 1}', help='comma-separated pool sizes')
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--flood', type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.users, args.rounds)
+        print(f'bcrypt cost {args.rounds}, {os.cpu_count()} CPUs, {args.concurrency} client threads')
+
+        limits = {key: app.config[key] for key in app.config if key.startswith('LOGIN_RATE_')}
+        app.config.update({key: 0 for key in limits})
+        failed = sum(run(workers, args) for workers in sorted({int(w) for w in args.workers.split(',')}))
+        app.config.update(limits)
+
+        flood(args)
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
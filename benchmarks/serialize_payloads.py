@@ -0,0 +1,141 @@
+"""Benchmark encoding freight request and message listings.
+
+Builds N unsaved FreightRequest and Message rows and times turning them
+into a response body through `app.json.response`, as jsonify does, four
+ways: the hand-written dicts with isoformat() on the stdlib encoder the
+routes used before, the compiled schemas on the stdlib encoder, the
+schemas on orjson (skipped if it is not installed), and the schemas
+narrowed by a ?fields= selection. The full-payload variants must decode to
+the same JSON, and the orjson variant must actually reach orjson, or the
+run fails.
+
+    python benchmarks/serialize_payloads.py --rows 5000
+"""
+import argparse
+import json
+from unittest import mock
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from common import app
+from models import FreightRequest, Message, User
+import serialization
+from serialization import FREIGHT_REQUEST_LIST, MESSAGE, orjson
+
+def freight_request_dict(fr):
+    return {
+        'id': fr.id,
+        'freight_type': fr.freight_type,
+        'origin': fr.origin,
+        'destination': fr.destination,
+        'cargo_details': fr.cargo_details,
+        'weight': fr.weight,
+        'dimensions': fr.dimensions,
+        'deadline': fr.deadline.isoformat() if fr.deadline else None,
+        'status': fr.status,
+        'created_at': fr.created_at.isoformat(),
+        'urgency': fr.urgency,
+        'budget_range': fr.budget_range,
+        'quotes_count': fr.quote_count
+    }
+
+def message_dict(msg):
+    return {
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'sender_name': msg.sender.company_name if not msg.system_message else 'System',
+        'content': msg.content,
+        'created_at': msg.created_at.isoformat(),
+        'read_at': msg.read_at.isoformat() if msg.read_at else None,
+        'message_type': msg.message_type,
+        'attachment_url': msg.attachment_url,
+        'system_message': msg.system_message
+    }
+
+def build_rows(rng, count):
+    now = datetime.utcnow()
+    sender = User(id=1, email='shipper@bench', company_name='Shipper Co', user_type='shipper')
+    freight_requests = [FreightRequest(
+        id=i, freight_type=rng.choice(['road', 'air', 'sea', 'rail']), origin='Rotterdam',
+        destination='Milan', cargo_details='Palletised machine parts, ' * rng.randint(1, 4),
+        weight=rng.uniform(100, 20000), dimensions='120x80x150',
+        deadline=now + timedelta(days=rng.randint(1, 30)) if rng.random() < 0.8 else None,
+        status='pending', created_at=now - timedelta(minutes=i), urgency='normal',
+        budget_range='1000-2000', quote_count=rng.randint(0, 12)
+    ) for i in range(1, count + 1)]
+    messages = [Message(
+        id=i, sender_id=1, sender=sender, content='Can you confirm the pickup window? ' * rng.randint(1, 3),
+        created_at=now - timedelta(seconds=i), read_at=now if rng.random() < 0.5 else None,
+        message_type='text', attachment_url=None, system_message=rng.random() < 0.05
+    ) for i in range(1, count + 1)]
+    return freight_requests, messages
+
+def respond(payload, use_orjson):
+    """The body jsonify would send for payload with the given encoder."""
+    app.json.use_orjson = use_orjson
+    return app.json.response(payload).get_data(as_text=True)
+
+def measure(encode, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), body
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    with app.app_context():
+        freight_requests, messages = build_rows(random.Random(args.seed), args.rows)
+        fr_fields = FREIGHT_REQUEST_LIST.select(['id', 'origin', 'destination', 'status'])
+        msg_fields = MESSAGE.select(['id', 'sender_name', 'created_at'])
+
+        listings = [
+            ('freight requests', freight_requests, freight_request_dict, FREIGHT_REQUEST_LIST, fr_fields),
+            ('messages', messages, message_dict, MESSAGE, msg_fields),
+        ]
+        failed = False
+        print(f'{args.rows} rows per listing, median of {args.repeat} runs, orjson '
+              + ('installed' if orjson is not None else 'not installed'))
+        for label, rows, by_hand, schema, fields in listings:
+            variants = [
+                ('hand-written + stdlib', lambda: respond([by_hand(row) for row in rows], False)),
+                ('schema + stdlib', lambda: respond(schema.dump_many(rows), False)),
+            ]
+            if orjson is not None:
+                variants.append(('schema + orjson', lambda: respond(schema.dump_many(rows), True)))
+            variants.append((f'?fields={",".join(fields)}',
+                             lambda: respond(schema.dump_many(rows, fields=fields), orjson is not None)))
+
+            print(label)
+            reference = None
+            for name, encode in variants:
+                elapsed, body = measure(encode, args.repeat)
+                print(f'  {name:40} {elapsed:8.2f} ms  {len(body) / 1024:8.1f} KiB')
+                if name.startswith('?fields='):
+                    continue
+                decoded = json.loads(body)
+                if reference is None:
+                    reference = decoded
+                elif decoded != reference:
+                    print(f'  {name} does not match the hand-written payload')
+                    failed = True
+
+            if orjson is not None:
+                with mock.patch.object(serialization, 'dumps', wraps=serialization.dumps) as spy:
+                    respond(schema.dump_many(rows[:1]), True)
+                if not spy.called:
+                    print('  responses did not go through orjson')
+                    failed = True
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
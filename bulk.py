@@ -0,0 +1,80 @@
+"""Helpers shared by the batch endpoints.
+
+Batch endpoints validate every item up front, insert the valid ones with a
+single executemany per chunk and answer with one result per item, in input
+order. They reply 201 when every item was created, 207 when only some were,
+and 400 when none were.
+"""
+import csv
+import io
+import json
+from itertools import islice
+from flask import jsonify, request
+
+class BulkError(ValueError):
+    """A whole-batch problem, such as an unreadable body or too many items."""
+
+def chunked(iterable, size):
+    """Yield lists of up to size items without materializing the iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def read_bulk_items(key, max_items):
+    """Yield (item, error) pairs from a JSON, NDJSON or CSV request body.
+
+    JSON bodies are either an array or an object holding the array under key.
+    NDJSON and CSV (Content-Type application/x-ndjson or text/csv) are read
+    from the stream line by line, so large uploads are never held in memory.
+    A line that cannot be parsed yields an error for that item only. Raises
+    BulkError, before yielding anything, for a malformed or oversized JSON body.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonlines'):
+        items = _ndjson_items()
+    elif request.mimetype == 'text/csv':
+        items = _csv_items()
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get(key)
+        if not isinstance(data, list):
+            raise BulkError(f'Expected a JSON array or an object with a "{key}" array')
+        if len(data) > max_items:
+            raise BulkError(f'At most {max_items} items per JSON request; stream larger uploads as NDJSON or CSV')
+        items = ((item, None) if isinstance(item, dict) else (None, 'Item must be an object')
+                 for item in data)
+
+    yield from items
+
+def _ndjson_items():
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8')
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield None, 'Invalid JSON'
+            continue
+        yield (item, None) if isinstance(item, dict) else (None, 'Item must be an object')
+
+def _csv_items():
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    for row in csv.DictReader(stream):
+        # Empty cells mean "not given", like a missing JSON key
+        yield {field: value for field, value in row.items() if field and value not in (None, '')}, None
+
+def bulk_response(results):
+    created = sum(1 for result in results if result['status'] == 'created')
+    failed = len(results) - created
+    if not failed:
+        status_code = 201
+    elif created:
+        status_code = 207
+    else:
+        status_code = 400
+    return jsonify({'created': created, 'failed': failed, 'results': results}), status_code
@@ -0,0 +1,249 @@
+"""Response caching for read-heavy endpoints, with targeted invalidation.
+
+Cached views store their 200 responses under a namespace such as
+`provider_ratings:42`. Each namespace has a generation that is part of
+every key, so a write path invalidates everything cached for an entity
+with one `invalidate(namespace)` call after it commits. A namespace never
+gets a generation it had before, so stale entries are never read again and
+simply age out. Responses carry an ETag, and a matching If-None-Match gets
+a 304 without a body.
+
+The default 'database' backend keeps entries in an in-process LRU with a
+TTL and generations in the cache_generation table. An invalidation in any
+worker is then seen by the next read in all of them, at the cost of one
+primary key lookup per cached read. 'memory' keeps generations in the
+process too: like rate_limit.py's buckets, other workers keep serving, and
+answering 304 for, what they cached for up to CACHE_DEFAULT_TTL after a
+write, so use it with a single worker. 'shared' is `LocalSharedBackend`, a
+stand-in with the same semantics a Redis or memcached client would have.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, current_app, jsonify, request
+from flask_jwt_extended import get_jwt_identity, jwt_required
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from extensions import db
+from models import CacheGeneration
+
+class CacheBackend:
+    """Storage interface used by ResponseCache. Values must be picklable."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def incr(self, key):
+        """Atomically give key a generation it has never had."""
+        raise NotImplementedError
+
+    def incr_many(self, keys):
+        """incr each key; backends can do it in one round trip."""
+        for key in keys:
+            self.incr(key)
+
+    def get_counter(self, key):
+        """The generation of key; a new one if it has none or it was evicted."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+class LRUBackend(CacheBackend):
+    """Bounded in-process cache evicting the least recently used entry."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = OrderedDict()  # Bounded like the entries
+        self._sequence = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _new_generation(self, key):
+        self._sequence += 1
+        self._generations[key] = self._sequence
+        self._generations.move_to_end(key)
+        while len(self._generations) > self.max_entries:
+            self._generations.popitem(last=False)
+        return self._sequence
+
+    def incr(self, key):
+        with self._lock:
+            return self._new_generation(key)
+
+    def get_counter(self, key):
+        with self._lock:
+            generation = self._generations.get(key)
+            if generation is None:
+                return self._new_generation(key)
+            self._generations.move_to_end(key)
+            return generation
+
+    def clear(self):
+        with self._lock:
+            # The sequence carries on, so no key from before is ever built again
+            self._entries.clear()
+            self._generations.clear()
+
+class LocalSharedBackend(LRUBackend):
+    """Stand-in for a shared cache server: one store for every app in the process."""
+
+    _store = None
+    _store_lock = threading.Lock()
+
+    def __new__(cls, max_entries):
+        with cls._store_lock:
+            if cls._store is None:
+                cls._store = LRUBackend(max_entries)
+        return cls._store
+
+class DatabaseBackend(LRUBackend):
+    """Entries in this process, generations in the database for every worker to see.
+
+    Generation rows are kept, so a namespace's generation only ever grows;
+    one that was never invalidated is at 0.
+    """
+
+    def incr(self, key):
+        self.incr_many([key])
+
+    def incr_many(self, keys):
+        keys = sorted(set(keys))
+        if not keys:
+            return
+        dialect = db.engine.dialect.name
+        insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+        statement = insert(CacheGeneration).on_conflict_do_update(
+            index_elements=[CacheGeneration.key],
+            set_={'generation': CacheGeneration.generation + 1}
+        )
+        # Own transaction: invalidations run after the write has committed
+        with db.engine.begin() as connection:
+            connection.execute(statement, [{'key': key, 'generation': 1} for key in keys])
+
+    def get_counter(self, key):
+        generation = db.session.execute(
+            select(CacheGeneration.generation).where(CacheGeneration.key == key)
+        ).scalar()
+        return generation or 0
+
+class ResponseCache:
+    def __init__(self, backend, default_ttl):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def key(self, namespace, variant):
+        generation = self.backend.get_counter(f'gen:{namespace}')
+        return f'{namespace}:{generation}:{variant}'
+
+    def invalidate(self, *namespaces):
+        self.backend.incr_many([f'gen:{namespace}' for namespace in namespaces])
+        for namespace in namespaces:
+            self.record(namespace, 'invalidations')
+
+    def record(self, namespace, outcome):
+        # Metrics are kept per entity type, e.g. 'provider_ratings'
+        group = namespace.split(':', 1)[0]
+        with self._stats_lock:
+            counters = self._stats.setdefault(group, {'hits': 0, 'misses': 0, 'not_modified': 0, 'invalidations': 0})
+            counters[outcome] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {group: dict(counters) for group, counters in self._stats.items()}
+
+def init_cache(app):
+    backend_name = app.config['CACHE_BACKEND']
+    if backend_name == 'database':
+        backend = DatabaseBackend(app.config['CACHE_MAX_ENTRIES'])
+    elif backend_name == 'shared':
+        backend = LocalSharedBackend(app.config['CACHE_MAX_ENTRIES'])
+    else:
+        backend = LRUBackend(app.config['CACHE_MAX_ENTRIES'])
+    app.extensions['response_cache'] = ResponseCache(backend, app.config['CACHE_DEFAULT_TTL'])
+
+    @app.route('/api/cache/stats', methods=['GET'])
+    @jwt_required()
+    def get_cache_stats():
+        return jsonify({'cache': app.extensions['response_cache'].stats()}), 200
+
+def invalidate(*namespaces):
+    """Drop everything cached under the given namespaces. Call after the write commits."""
+    cache = current_app.extensions.get('response_cache')
+    if cache:
+        cache.invalidate(*namespaces)
+
+def _etag_response(cache, namespace, body, etag, mimetype):
+    if etag in request.if_none_match:
+        cache.record(namespace, 'not_modified')
+        response = Response(status=304)
+    else:
+        response = Response(body, status=200, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def cached(namespace_for, vary_user=False, ttl=None):
+    """Cache a JSON view's 200 responses under the namespace built from its URL arguments.
+
+    Apply below @jwt_required so authentication still runs on cache hits.
+    Set vary_user when the payload depends on who is asking.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None or current_app.config['CACHE_BACKEND'] == 'none':
+                return view(*args, **kwargs)
+
+            namespace = namespace_for(**kwargs)
+            variant = request.full_path
+            if vary_user:
+                variant = f'{get_jwt_identity()}|{variant}'
+            # The key is fixed before reading, so data read before an invalidation
+            # can only land under the old generation
+            key = cache.key(namespace, variant)
+
+            entry = cache.backend.get(key)
+            if entry is not None:
+                cache.record(namespace, 'hits')
+                return _etag_response(cache, namespace, *entry)
+
+            cache.record(namespace, 'misses')
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+            body = response.get_data()
+            entry = (body, hashlib.sha1(body).hexdigest(), response.mimetype)
+            cache.backend.set(key, entry, ttl or cache.default_ttl)
+            return _etag_response(cache, namespace, *entry)
+        return wrapper
+    return decorator
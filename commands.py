@@ -0,0 +1,63 @@
+import click
+from migrations import run_migrations
+import time
+from quotes import reconcile_quote_counts, expire_quotes
+from messaging import reconcile_unread_counts
+from ratings import reconcile_provider_ratings
+from search import rebuild_search_indexes
+from events import drain_outbox, retry_failed_events
+
+def init_commands(app):
+    @app.cli.command('migrate-db')
+    def migrate_db():
+        """Apply schema and data migrations to an existing database."""
+        for name, result in run_migrations():
+            click.echo(f'{name}: {result}')
+
+    @app.cli.command('reconcile-quote-counts')
+    def reconcile_quote_counts_command():
+        """Recount quotes per freight request and repair drifted counters."""
+        click.echo(f'{reconcile_quote_counts()} freight requests repaired')
+
+    @app.cli.command('expire-quotes')
+    @click.option('--batch-size', type=int, default=None, help='Quotes per UPDATE (QUOTE_SWEEP_BATCH_SIZE).')
+    def expire_quotes_command(batch_size):
+        """Mark pending quotes past their validity as expired."""
+        started = time.perf_counter()
+        expired = expire_quotes(batch_size)
+        click.echo(f'{expired} quotes expired in {time.perf_counter() - started:.2f}s')
+
+    @app.cli.command('reconcile-unread-counts')
+    def reconcile_unread_counts_command():
+        """Recount unread messages per user and conversation and repair drift."""
+        click.echo(f'{reconcile_unread_counts()} unread counters repaired')
+
+    @app.cli.command('reconcile-rating-stats')
+    def reconcile_rating_stats_command():
+        """Rebuild provider rating aggregates from the ratings table."""
+        click.echo(f'{reconcile_provider_ratings()} provider rating aggregates rebuilt')
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Re-index all freight requests and messages for full-text search (SQLite)."""
+        if not rebuild_search_indexes():
+            click.echo('Postgres search indexes are always current; nothing to rebuild')
+            return
+        click.echo('Search indexes rebuilt')
+
+    @app.cli.command('drain-outbox')
+    @click.option('--batch-size', type=int, default=None, help='Events per transaction (OUTBOX_BATCH_SIZE).')
+    @click.option('--follow', is_flag=True, help='Keep draining every OUTBOX_POLL_SECONDS.')
+    @click.option('--retry-failed', is_flag=True, help='First make events that ran out of attempts due again.')
+    def drain_outbox_command(batch_size, follow, retry_failed):
+        """Deliver pending domain events to their handlers."""
+        if retry_failed:
+            click.echo(f'{retry_failed_events()} failed events queued again')
+        while True:
+            started = time.perf_counter()
+            handled = drain_outbox(batch_size)
+            if handled or not follow:
+                click.echo(f'{handled} events handled in {time.perf_counter() - started:.2f}s')
+            if not follow:
+                return
+            time.sleep(app.config['OUTBOX_POLL_SECONDS'])
@@ -0,0 +1,61 @@
+"""Helpers for write paths that race with other requests.
+
+State transitions on freight requests are compare-and-set UPDATEs: the
+WHERE clause repeats the expected status, and a rowcount of zero means a
+concurrent request got there first. The UPDATE takes the row lock, so on
+Postgres a second writer waits and then re-checks the condition; on SQLite
+writers are serialized by the database lock. What is left are transient
+lock conflicts (SQLite "database is locked", Postgres serialization
+failures and deadlocks), which `run_with_retry` retries with jittered
+exponential backoff.
+"""
+import random
+import time
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from extensions import db
+
+# serialization_failure, deadlock_detected, lock_not_available
+RETRYABLE_PGCODES = {'40001', '40P01', '55P03'}
+RETRY_BASE_DELAY = 0.005
+
+def is_transient_conflict(error):
+    orig = getattr(error, 'orig', None)
+    if getattr(orig, 'pgcode', None) in RETRYABLE_PGCODES:
+        return True
+    return 'database is locked' in str(orig) or 'database table is locked' in str(orig)
+
+def run_with_retry(func, *args, **kwargs):
+    """Run a transaction function, retrying it after transient lock conflicts.
+
+    func must do all of its work, including the commit, so a retry starts
+    from a clean session.
+    """
+    attempts = current_app.config['DB_CONFLICT_RETRIES']
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except DBAPIError as e:
+            db.session.rollback()
+            if attempt == attempts or not is_transient_conflict(e):
+                raise
+            time.sleep(random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt))
+
+def init_concurrency(app):
+    """Put SQLite in WAL mode with a busy timeout, so readers never block writers.
+
+    Must run inside an application context.
+    """
+    if db.engine.dialect.name != 'sqlite' or not app.config['SQLITE_WAL']:
+        return
+
+    @event.listens_for(db.engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cursor.close()
+
+    # Connections opened before the listener was registered
+    db.engine.dispose()
@@ -0,0 +1,224 @@
+"""Domain events delivered through a transactional outbox.
+
+Write paths record what happened with `emit()` in the same transaction as
+the change itself and leave the side effects, such as notifications,
+counters and matching fan-out, to handlers registered with `@handles`. A
+committed change always gets its event, and a rolled-back one never does.
+
+Each app process drains the outbox on OUTBOX_WORKERS threads. They wake
+right after a commit that emitted events, and otherwise poll every
+OUTBOX_POLL_SECONDS for events from other processes or retries. With
+OUTBOX_WORKERS=0 nothing is drained in-process. In that case run
+`flask --app app drain-outbox --follow` as a separate service.
+
+A drain claims up to OUTBOX_BATCH_SIZE events and handles them in one
+transaction. On Postgres, concurrent drainers skip each other's rows; on
+SQLite the write lock serializes them. Each handler runs in a savepoint,
+and a note that it ran commits together with its effects. Fully handled
+events are deleted in the same commit.
+
+If a handler fails, only its savepoint is rolled back. The event is
+retried with exponential backoff, skipping the handlers that already
+succeeded. After OUTBOX_MAX_ATTEMPTS it is kept with `failed_at` and the
+error for inspection.
+
+Delivery is at least once: a batch whose commit fails is handled again, so
+handlers must be idempotent. Handlers must not commit. Work that has to
+wait for the commit, such as cache invalidation and realtime pushes, is
+deferred with `on_commit`.
+"""
+import json
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app, g
+from sqlalchemy import event, select, update
+from extensions import db
+from models import OutboxEvent
+from serialization import dumps
+
+# event type -> [(handler name, handler)], in registration order
+HANDLERS = defaultdict(list)
+
+# Longest wait between retries of a failing event
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+def handles(event_type):
+    """Register the decorated function(payload) as a handler of event_type."""
+    def decorator(handler):
+        HANDLERS[event_type].append((f'{handler.__module__}.{handler.__name__}', handler))
+        return handler
+    return decorator
+
+def emit(event_type, **payload):
+    """Record an event in the current transaction; its handlers run after the commit."""
+    db.session.add(OutboxEvent(event_type=event_type, payload=dumps(payload)))
+    db.session.info['outbox_emitted'] = True
+
+def on_commit(func, *args):
+    """From a handler, run func(*args) once the drain has committed; outside a drain, run it now."""
+    pending = g.get('outbox_on_commit')
+    if pending is None:
+        func(*args)
+    else:
+        pending.append((func, args))
+
+class Outbox:
+    """Drain statistics and the worker threads of this process."""
+
+    def __init__(self, app, workers, poll_seconds):
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self.batches = 0
+        self.handled = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._loop, name=f'outbox-{i}', daemon=True)
+                         for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self):
+        """Wake the workers after a commit that emitted events."""
+        self._wake.set()
+
+    def count(self, handled, failures):
+        with self._lock:
+            self.batches += 1
+            self.handled += handled
+            self.failures += failures
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    drain_outbox()
+                except Exception:
+                    self.app.logger.exception('Draining the outbox failed')
+
+def _claim(batch_size):
+    now = datetime.utcnow()
+    pending = (OutboxEvent.failed_at.is_(None), OutboxEvent.available_at <= now)
+    oldest = select(OutboxEvent.id).where(*pending)\
+        .order_by(OutboxEvent.available_at, OutboxEvent.id).limit(batch_size)\
+        .with_for_update(skip_locked=True)
+    # Writing first takes SQLite's lock and opens the transaction the savepoints need
+    ids = db.session.scalars(
+        update(OutboxEvent).where(OutboxEvent.id.in_(oldest), *pending)
+        .values(attempts=OutboxEvent.attempts + 1)
+        .returning(OutboxEvent.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not ids:
+        return []
+    return OutboxEvent.query.filter(OutboxEvent.id.in_(ids))\
+        .order_by(OutboxEvent.available_at, OutboxEvent.id).all()
+
+def _handle(outbox_event, after_commit):
+    """Run the handlers outbox_event still needs. Returns the error of the first one that fails, or None."""
+    payload = json.loads(outbox_event.payload)
+    handled = outbox_event.handled.split()
+    for name, handler in HANDLERS.get(outbox_event.event_type, ()):
+        if name in handled:
+            continue
+        g.outbox_on_commit = deferred = []
+        try:
+            with db.session.begin_nested():
+                handler(payload)
+                handled.append(name)
+                outbox_event.handled = ' '.join(handled)
+        except Exception as e:
+            current_app.logger.exception('Outbox handler %s failed for event %s', name, outbox_event.id)
+            return f'{name}: {e}'
+        finally:
+            g.pop('outbox_on_commit', None)
+        after_commit.extend(deferred)
+    return None
+
+def drain_batch(batch_size=None):
+    """Claim and handle one batch of due events. Returns (events claimed, handler failures)."""
+    config = current_app.config
+    after_commit = []
+    failures = 0
+    try:
+        events = _claim(batch_size or config['OUTBOX_BATCH_SIZE'])
+        if not events:
+            db.session.rollback()
+            return 0, 0
+
+        now = datetime.utcnow()
+        for outbox_event in events:
+            error = _handle(outbox_event, after_commit)
+            if error is None:
+                db.session.delete(outbox_event)
+                continue
+            failures += 1
+            outbox_event.last_error = error
+            if outbox_event.attempts >= config['OUTBOX_MAX_ATTEMPTS']:
+                outbox_event.failed_at = now
+            else:
+                delay = timedelta(seconds=config['OUTBOX_RETRY_SECONDS'] * 2 ** (outbox_event.attempts - 1))
+                outbox_event.available_at = now + min(delay, MAX_RETRY_DELAY)
+        db.session.commit()
+    except Exception:
+        # Nothing of the batch is kept; every event is claimed again later
+        db.session.rollback()
+        raise
+
+    for func, args in after_commit:
+        try:
+            func(*args)
+        except Exception:
+            current_app.logger.exception('Outbox post-commit step %s failed', func.__name__)
+
+    outbox = current_app.extensions.get('outbox')
+    if outbox is not None:
+        outbox.count(len(events) - failures, failures)
+    return len(events), failures
+
+def drain_outbox(batch_size=None):
+    """Handle due events until a batch comes back short. Returns the number of events handled."""
+    batch_size = batch_size or current_app.config['OUTBOX_BATCH_SIZE']
+    handled = 0
+    while True:
+        claimed, failures = drain_batch(batch_size)
+        handled += claimed - failures
+        if claimed < batch_size:
+            return handled
+
+def retry_failed_events():
+    """Make events that ran out of attempts due again. Returns how many."""
+    retried = OutboxEvent.query.filter(OutboxEvent.failed_at.isnot(None)).update({
+        OutboxEvent.failed_at: None,
+        OutboxEvent.attempts: 0,
+        OutboxEvent.available_at: datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    return retried
+
+def _after_commit(session):
+    if session.info.pop('outbox_emitted', False):
+        outbox = current_app.extensions.get('outbox')
+        if outbox is not None:
+            outbox.notify()
+
+def _after_rollback(session):
+    session.info.pop('outbox_emitted', None)
+
+def init_events(app):
+    """Start the outbox workers. Call after the tables exist."""
+    if not event.contains(db.session, 'after_commit', _after_commit):
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
+    outbox = app.extensions['outbox'] = Outbox(app, app.config['OUTBOX_WORKERS'], app.config['OUTBOX_POLL_SECONDS'])
+    outbox.start()
@@ -0,0 +1,157 @@
+"""Streaming exports of freight history and conversation logs.
+
+The paginated endpoints are built for screens: every page is another query
+and, with page numbers, another COUNT. An export runs one query and streams
+every row from a generator as NDJSON (the default) or CSV (`format=csv`).
+Rows are fetched EXPORT_BATCH_SIZE at a time with `yield_per`, which uses a
+server-side cursor on Postgres, and related rows are loaded once per batch,
+so memory stays flat however long the history is.
+
+Rows come oldest first by (created_at, id) and each one carries a `cursor`.
+If a download is cut off, request it again with `cursor` set to that of the
+last complete row to continue after it. CSV flattens nested objects into
+dotted columns (`rating.review`) and leaves out nested lists, such as the
+quotes of a freight request.
+"""
+import csv
+import io
+from datetime import date, datetime
+from flask import Response, current_app, jsonify, request, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import selectinload
+from models import Conversation, FreightRequest, Message, Quote
+from identity import roles_required
+from pagination import InvalidCursor, encode_cursor, keyset_after
+from serialization import FREIGHT_HISTORY, MESSAGE, dumps
+
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def _csv_columns(schema, prefix=''):
+    columns = []
+    for name, field in schema.fields.items():
+        if field.many:
+            continue
+        if field.schema is not None:
+            columns.extend(_csv_columns(field.schema, f'{prefix}{name}.'))
+        else:
+            columns.append(prefix + name)
+    return columns
+
+def _csv_cells(schema, record, cells):
+    """Append record's values to cells in _csv_columns order; a missing nested object gives empty cells."""
+    for name, field in schema.fields.items():
+        if field.many:
+            continue
+        value = None if record is None else record[name]
+        if field.schema is not None:
+            _csv_cells(field.schema, value, cells)
+        elif isinstance(value, (datetime, date)):
+            cells.append(value.isoformat())
+        else:
+            cells.append(value)  # None is written as an empty cell
+    return cells
+
+def created_between(query, column):
+    """Filter on the created_from and created_to query arguments. Raises ValueError."""
+    created_from = request.args.get('created_from')
+    if created_from:
+        query = query.filter(column >= datetime.fromisoformat(created_from))
+    created_to = request.args.get('created_to')
+    if created_to:
+        query = query.filter(column < datetime.fromisoformat(created_to))
+    return query
+
+def export_response(query, schema, sort_column, id_column, export_format, filename):
+    """Stream every row of query, ordered by keyset_after on the same columns, as an attachment."""
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    if export_format == 'csv':
+        dump = schema.dumper(schema.select([name for name, field in schema.fields.items() if not field.many]))
+    else:
+        dump = schema.dumper()
+
+    def rows():
+        buffer = io.StringIO()
+        writer = None
+        if export_format == 'csv':
+            writer = csv.writer(buffer)
+            writer.writerow(_csv_columns(schema) + ['cursor'])
+        pending = 0
+        for row in query.yield_per(batch_size):
+            record = dump(row, None)
+            cursor = encode_cursor(getattr(row, sort_column.key), getattr(row, id_column.key))
+            if writer is not None:
+                writer.writerow(_csv_cells(schema, record, []) + [cursor])
+            else:
+                record['cursor'] = cursor
+                buffer.write(dumps(record))
+                buffer.write('\n')
+            pending += 1
+            if pending == batch_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    # The session must outlive the view, so the generator keeps the request context
+    return Response(stream_with_context(rows()), mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename="{filename}.{export_format}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
+def init_export_routes(app):
+    @app.route('/api/exports/freight-history', methods=['GET'])
+    @jwt_required()
+    @roles_required('shipper', message='Only shippers can export freight history')
+    def export_freight_history():
+        current_user_id = get_jwt_identity()
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+        # Quotes with their providers, and ratings, are loaded once per batch
+        query = FreightRequest.query.options(
+            selectinload(FreightRequest.quotes).selectinload(Quote.provider),
+            selectinload(FreightRequest.ratings)
+        ).filter(FreightRequest.user_id == current_user_id)
+        try:
+            query = created_between(query, FreightRequest.created_at)
+            query = keyset_after(query, FreightRequest.created_at, FreightRequest.id, request.args.get('cursor'))
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+        except ValueError:
+            return jsonify({'error': 'created_from and created_to must be ISO 8601 dates'}), 400
+
+        return export_response(query, FREIGHT_HISTORY, FreightRequest.created_at, FreightRequest.id,
+                               export_format, 'freight-history')
+
+    @app.route('/api/exports/conversations/<int:conversation_id>/messages', methods=['GET'])
+    @jwt_required()
+    def export_conversation_messages(conversation_id):
+        current_user_id = get_jwt_identity()
+
+        conversation = Conversation.query.get(conversation_id)
+        if not conversation:
+            return jsonify({'error': 'Conversation not found'}), 404
+
+        if current_user_id not in [conversation.shipper_id, conversation.provider_id]:
+            return jsonify({'error': 'Not authorized to view these messages'}), 403
+
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+        query = Message.query.options(selectinload(Message.sender))\
+                             .filter(Message.conversation_id == conversation_id)
+        try:
+            query = created_between(query, Message.created_at)
+            query = keyset_after(query, Message.created_at, Message.id, request.args.get('cursor'))
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+        except ValueError:
+            return jsonify({'error': 'created_from and created_to must be ISO 8601 dates'}), 400
+
+        return export_response(query, MESSAGE, Message.created_at, Message.id,
+                               export_format, f'conversation-{conversation_id}')
@@ -1,75 +1,160 @@
-from flask import jsonify, request
+from flask import current_app, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from extensions import db
-from models import FreightRequest, User
+from models import FreightRequest, Quote
+from matching_engine import matching_index
+from events import emit
+from cache import cached
+from serialization import (InvalidFields, requested_fields, FREIGHT_REQUEST_LIST, FREIGHT_REQUEST_DETAIL,
+                           FREIGHT_REQUEST_SUMMARY)
+from identity import roles_required, current_role
+from geo import geocode
+from bulk import BulkError, chunked, read_bulk_items, bulk_response
+from pagination import InvalidCursor, wants_keyset, keyset_paginate, keyset_request_args, keyset_meta
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
 from datetime import datetime
+from types import SimpleNamespace
+
+REQUIRED_FIELDS = ['freight_type', 'origin', 'destination', 'cargo_details']
+
+def freight_request_values(data):
+    """Validate a freight request payload and return its column values. Raises ValueError."""
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            raise ValueError(f'{field} is required')
+    
+    weight = data.get('weight')
+    try:
+        weight = float(weight) if weight is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('weight must be a number')
+    try:
+        deadline = datetime.fromisoformat(data['deadline']) if data.get('deadline') else None
+    except (TypeError, ValueError):
+        raise ValueError('deadline must be an ISO 8601 date')
+    
+    origin_latitude, origin_longitude = geocode(data['origin'])
+    destination_latitude, destination_longitude = geocode(data['destination'])
+    
+    return {
+        'freight_type': data['freight_type'],
+        'origin': data['origin'],
+        'destination': data['destination'],
+        'origin_latitude': origin_latitude,
+        'origin_longitude': origin_longitude,
+        'destination_latitude': destination_latitude,
+        'destination_longitude': destination_longitude,
+        'cargo_details': data['cargo_details'],
+        'weight': weight,
+        'dimensions': data.get('dimensions'),
+        'deadline': deadline,
+        'status': 'pending',
+        'urgency': data.get('urgency', 'normal'),
+        'budget_range': data.get('budget_range')
+    }
 
 def init_freight_routes(app):
     @app.route('/api/freight-requests', methods=['POST'])
     @jwt_required()
+    @roles_required('shipper', message='Only shippers can create freight requests')
     def create_freight_request():
         current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
-        
-        if not user or user.user_type != 'shipper':
-            return jsonify({'error': 'Only shippers can create freight requests'}), 403
-        
         data = request.get_json()
         
         # Validate required fields
-        required_fields = ['freight_type', 'origin', 'destination', 'cargo_details']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'{field} is required'}), 400
+        try:
+            values = freight_request_values(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         try:
-            new_request = FreightRequest(
-                user_id=current_user_id,
-                freight_type=data['freight_type'],
-                origin=data['origin'],
-                destination=data['destination'],
-                cargo_details=data['cargo_details'],
-                weight=data.get('weight'),
-                dimensions=data.get('dimensions'),
-                deadline=datetime.fromisoformat(data['deadline']) if 'deadline' in data else None,
-                status='pending',
-                urgency=data.get('urgency', 'normal'),
-                budget_range=data.get('budget_range')
-            )
+            new_request = FreightRequest(user_id=current_user_id, **values)
             
             db.session.add(new_request)
+            db.session.flush()
+            # Matching providers get it in their inboxes once the outbox delivers this
+            emit('freight_request.created', ids=[new_request.id])
             db.session.commit()
             
+            matching_index.add(new_request)
+            
             return jsonify({
                 'message': 'Freight request created successfully',
-                'freight_request': {
-                    'id': new_request.id,
-                    'freight_type': new_request.freight_type,
-                    'origin': new_request.origin,
-                    'destination': new_request.destination,
-                    'status': new_request.status
-                }
+                'freight_request': FREIGHT_REQUEST_SUMMARY.dump(new_request)
             }), 201
             
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': 'Failed to create freight request', 'details': str(e)}), 500
 
+    @app.route('/api/freight-requests/bulk', methods=['POST'])
+    @jwt_required()
+    @roles_required('shipper', message='Only shippers can create freight requests')
+    def import_freight_requests():
+        current_user_id = get_jwt_identity()
+        
+        results = []
+        created = []
+        try:
+            items = read_bulk_items('freight_requests', current_app.config['BULK_MAX_ITEMS'])
+            # Each chunk is validated, inserted with one executemany and committed
+            for chunk in chunked(enumerate(items), current_app.config['BULK_CHUNK_SIZE']):
+                rows, positions = [], []
+                for index, (data, error) in chunk:
+                    if error is None:
+                        try:
+                            rows.append(dict(freight_request_values(data), user_id=current_user_id,
+                                             created_at=datetime.utcnow()))
+                            positions.append(len(results))
+                        except ValueError as e:
+                            error = str(e)
+                    results.append({'index': index, 'status': 'error', 'error': error} if error
+                                   else {'index': index, 'status': 'created'})
+                
+                if rows:
+                    ids = db.session.scalars(
+                        insert(FreightRequest).returning(FreightRequest.id, sort_by_parameter_order=True),
+                        rows
+                    ).all()
+                    emit('freight_request.created', ids=ids)
+                    db.session.commit()
+                    for position, request_id, row in zip(positions, ids, rows):
+                        results[position]['id'] = request_id
+                        created.append(SimpleNamespace(id=request_id, **row))
+        
+        except BulkError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            db.session.rollback()
+            if not created:
+                return jsonify({'error': 'Failed to import freight requests', 'details': str(e)}), 500
+            # Earlier chunks are committed; report them and fail the rest
+            for result in results:
+                if result['status'] == 'created' and 'id' not in result:
+                    result.update(status='error', error='Failed to import freight request')
+        
+        for freight_request in created:
+            matching_index.add(freight_request)
+        
+        return bulk_response(results)
+
     @app.route('/api/freight-requests', methods=['GET'])
     @jwt_required()
     def get_freight_requests():
         current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        role = current_role()
         
-        if not user:
+        if not role:
             return jsonify({'error': 'User not found'}), 404
         
         try:
             page = request.args.get('page', 1, type=int)
             per_page = request.args.get('per_page', 10, type=int)
+            fields = requested_fields(FREIGHT_REQUEST_LIST)
             
             # Filter based on user type
-            if user.user_type == 'shipper':
+            if role == 'shipper':
                 # Shippers see their own requests
                 query = FreightRequest.query.filter_by(user_id=current_user_id)
             else:
@@ -85,27 +170,25 @@ def init_freight_routes(app):
             if freight_type:
                 query = query.filter_by(freight_type=freight_type)
             
-            # Order by creation date, newest first
-            query = query.order_by(FreightRequest.created_at.desc())
-            
-            # Paginate results
-            pagination = query.paginate(page=page, per_page=per_page)
-            
-            freight_requests = [{
-                'id': fr.id,
-                'freight_type': fr.freight_type,
-                'origin': fr.origin,
-                'destination': fr.destination,
-                'cargo_details': fr.cargo_details,
-                'weight': fr.weight,
-                'dimensions': fr.dimensions,
-                'deadline': fr.deadline.isoformat() if fr.deadline else None,
-                'status': fr.status,
-                'created_at': fr.created_at.isoformat(),
-                'urgency': fr.urgency,
-                'budget_range': fr.budget_range,
-                'quotes_count': len(fr.quotes)
-            } for fr in pagination.items]
+            if wants_keyset():
+                # Cursor mode: newest first by (created_at, id), no OFFSET
+                cursor, include_total = keyset_request_args()
+                pagination = keyset_paginate(query, FreightRequest.created_at, FreightRequest.id,
+                                             cursor, per_page, include_total)
+            else:
+                # Order by creation date, newest first
+                query = query.order_by(FreightRequest.created_at.desc())
+                
+                # Paginate results
+                pagination = query.paginate(page=page, per_page=per_page)
+            
+            freight_requests = FREIGHT_REQUEST_LIST.dump_many(pagination.items, fields=fields)
+            
+            if wants_keyset():
+                return jsonify({
+                    'freight_requests': freight_requests,
+                    'pagination': keyset_meta(pagination, per_page)
+                }), 200
             
             return jsonify({
                 'freight_requests': freight_requests,
@@ -114,56 +197,45 @@ def init_freight_routes(app):
                 'current_page': page
             }), 200
             
+        except (InvalidCursor, InvalidFields) as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': 'Failed to fetch freight requests', 'details': str(e)}), 500
 
     @app.route('/api/freight-requests/<int:request_id>', methods=['GET'])
     @jwt_required()
+    @cached(lambda request_id: f'freight_request:{request_id}', vary_user=True)
     def get_freight_request(request_id):
         current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        role = current_role()
         
-        if not user:
+        if not role:
             return jsonify({'error': 'User not found'}), 404
         
         try:
-            freight_request = FreightRequest.query.get(request_id)
+            fields = requested_fields(FREIGHT_REQUEST_DETAIL)
+            freight_request = FreightRequest.query.options(joinedload(FreightRequest.user)).get(request_id)
             
             if not freight_request:
                 return jsonify({'error': 'Freight request not found'}), 404
             
             # Check if user has permission to view this request
-            if user.user_type == 'shipper' and freight_request.user_id != current_user_id:
+            if role == 'shipper' and freight_request.user_id != current_user_id:
                 return jsonify({'error': 'Not authorized to view this request'}), 403
             
-            response = {
-                'id': freight_request.id,
-                'freight_type': freight_request.freight_type,
-                'origin': freight_request.origin,
-                'destination': freight_request.destination,
-                'cargo_details': freight_request.cargo_details,
-                'weight': freight_request.weight,
-                'dimensions': freight_request.dimensions,
-                'deadline': freight_request.deadline.isoformat() if freight_request.deadline else None,
-                'status': freight_request.status,
-                'created_at': freight_request.created_at.isoformat(),
-                'urgency': freight_request.urgency,
-                'budget_range': freight_request.budget_range,
-                'shipper': {
-                    'id': freight_request.user.id,
-                    'company_name': freight_request.user.company_name
-                },
-                'quotes': [{
-                    'id': quote.id,
-                    'provider_id': quote.provider_id,
-                    'provider_name': quote.provider.company_name,
-                    'price': quote.price,
-                    'status': quote.status,
-                    'created_at': quote.created_at.isoformat()
-                } for quote in freight_request.quotes] if user.user_type == 'shipper' or freight_request.user_id == current_user_id else []
-            }
-            
-            return jsonify(response), 200
+            include_expired = request.args.get('include_expired', 'false').lower() == 'true'
+            
+            # Only the owner sees quotes; load them with their providers in one query
+            quotes = []
+            if (role == 'shipper' or freight_request.user_id == current_user_id) and \
+                    (fields is None or 'quotes' in fields):
+                quotes = Quote.query.filter_by(freight_request_id=request_id)\
+                    .options(joinedload(Quote.provider)).all()
+            
+            quotes = [quote for quote in quotes if include_expired or quote.status != 'expired']
+            return jsonify(FREIGHT_REQUEST_DETAIL.dump(freight_request, quotes, fields=fields)), 200
             
+        except InvalidFields as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': 'Failed to fetch freight request', 'details': str(e)}), 500
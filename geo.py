@@ -0,0 +1,191 @@
+"""Offline geocoding and a grid index for radius queries.
+
+Place names are resolved against a gazetteer CSV shipped with the app
+(GAZETTEER_PATH), so "Hamburg", "Hamburg, DE" and "hamburg germany" all
+resolve to the same coordinates without calling an external service. Names
+are compared after case folding, accent stripping and punctuation removal.
+
+`GeoGrid` buckets points into fixed lat/lon cells. A radius query only
+visits the cells overlapping the circle's bounding box and computes the
+exact distance once per distinct point, which is cheap because most loads
+are geocoded to the same few city coordinates.
+"""
+import csv
+import math
+import re
+import unicodedata
+from collections import defaultdict, namedtuple
+from flask import current_app
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.195
+
+Place = namedtuple('Place', 'name country_code latitude longitude')
+
+# Letters NFKD does not decompose into a base letter
+_TRANSLITERATE = str.maketrans({'ł': 'l', 'ø': 'o', 'æ': 'ae', 'ß': 'ss', 'đ': 'd', 'ı': 'i'})
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+def normalize_place(name):
+    """Lower-case, strip accents and punctuation: 'Düsseldorf, DE' -> 'dusseldorf de'."""
+    name = unicodedata.normalize('NFKD', (name or '').casefold().translate(_TRANSLITERATE))
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    return _NON_ALNUM.sub(' ', name).strip()
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class Gazetteer:
+    """Place name lookup over a CSV of name, country_code, country, latitude, longitude, aliases.
+
+    `country` and `aliases` hold |-separated alternatives. Every name and
+    alias is also indexed with each country code and name appended, which
+    is how qualified inputs like "Antwerp, Belgium" resolve.
+    """
+
+    def __init__(self, places=()):
+        self._names = {}
+        for place, aliases, countries in places:
+            self.add(place, aliases, countries)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            return cls(
+                (Place(row['name'], row['country_code'], float(row['latitude']), float(row['longitude'])),
+                 [alias for alias in (row.get('aliases') or '').split('|') if alias],
+                 [row['country_code']] + [c for c in (row.get('country') or '').split('|') if c])
+                for row in csv.DictReader(f)
+            )
+
+    def add(self, place, aliases=(), countries=()):
+        for name in [place.name, *aliases]:
+            key = normalize_place(name)
+            # The first entry wins an unqualified name; qualified keys disambiguate
+            self._names.setdefault(key, place)
+            for country in countries:
+                self._names.setdefault(f'{key} {normalize_place(country)}', place)
+
+    def lookup(self, name):
+        """Return the Place for a name, or None if the gazetteer does not know it."""
+        return self._names.get(normalize_place(name))
+
+    def __len__(self):
+        return len(self._names)
+
+def geocode(name):
+    """Resolve a place name with the app's gazetteer; returns (latitude, longitude) or (None, None)."""
+    place = current_app.extensions['gazetteer'].lookup(name) if isinstance(name, str) else None
+    return (place.latitude, place.longitude) if place else (None, None)
+
+def service_area_values(area):
+    """Turn a service area given as a name or a dict into column values. Raises ValueError.
+
+    A dict may set `radius_km`, and `latitude`/`longitude` for a place the
+    gazetteer does not know. Unknown names are kept without coordinates and
+    only match freight requests naming the same place.
+    """
+    if isinstance(area, str):
+        area = {'area': area}
+    if not isinstance(area, dict) or not isinstance(area.get('area'), str) or not area['area'].strip():
+        raise ValueError('Each service area needs a name')
+    try:
+        radius_km = float(area.get('radius_km') or current_app.config['SERVICE_AREA_DEFAULT_RADIUS_KM'])
+        latitude = float(area['latitude']) if area.get('latitude') is not None else None
+        longitude = float(area['longitude']) if area.get('longitude') is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('radius_km, latitude and longitude must be numbers')
+    if not 0 < radius_km <= current_app.config['SERVICE_AREA_MAX_RADIUS_KM']:
+        raise ValueError(f"radius_km must be between 0 and {current_app.config['SERVICE_AREA_MAX_RADIUS_KM']}")
+    if (latitude is None) != (longitude is None) or \
+            (latitude is not None and not (-90 <= latitude <= 90 and -180 <= longitude <= 180)):
+        raise ValueError('latitude and longitude must be given together and be valid coordinates')
+    if latitude is None:
+        latitude, longitude = geocode(area['area'])
+    return {'area': area['area'], 'latitude': latitude, 'longitude': longitude, 'radius_km': radius_km}
+
+def unit_vector(latitude, longitude):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+class GeoGrid:
+    """Points bucketed into cells of `cell_degrees`; not thread-safe, callers lock.
+
+    Each distinct point keeps its unit vector, so the distance test in a
+    radius query is a dot product against the cosine of the angular radius.
+    """
+
+    def __init__(self, cell_degrees=1.0):
+        self.cell_degrees = cell_degrees
+        self._columns = int(math.ceil(360 / cell_degrees))
+        self._cells = defaultdict(dict)  # (row, column) -> {(lat, lon): (ids, x, y, z)}
+        self._points = {}  # id -> (lat, lon)
+
+    def _cell(self, latitude, longitude):
+        return (int((latitude + 90) // self.cell_degrees),
+                int((longitude + 180) // self.cell_degrees) % self._columns)
+
+    def add(self, item_id, latitude, longitude):
+        self.remove(item_id)
+        point = (latitude, longitude)
+        self._points[item_id] = point
+        cell = self._cells[self._cell(*point)]
+        if point not in cell:
+            cell[point] = (set(), *unit_vector(*point))
+        cell[point][0].add(item_id)
+
+    def remove(self, item_id):
+        point = self._points.pop(item_id, None)
+        if point is None:
+            return
+        cell = self._cells[self._cell(*point)]
+        ids = cell[point][0]
+        ids.discard(item_id)
+        if not ids:
+            del cell[point]
+            if not cell:
+                del self._cells[self._cell(*point)]
+
+    def clear(self):
+        self._cells.clear()
+        self._points.clear()
+
+    def within(self, latitude, longitude, radius_km):
+        """Yield (distance_km, ids) for every distinct point within radius_km."""
+        lat_span = radius_km / KM_PER_DEGREE
+        south, north = max(latitude - lat_span, -90.0), min(latitude + lat_span, 90.0)
+        # Longitude degrees shrink towards the poles; size the box at the poleward edge
+        widest = math.cos(math.radians(max(abs(south), abs(north))))
+        lon_span = radius_km / (KM_PER_DEGREE * widest) if widest > 1e-6 else 180.0
+
+        first_row, last_row = self._cell(south, 0)[0], self._cell(north, 0)[0]
+        if lon_span >= 180:
+            columns = range(self._columns)
+        else:
+            first_column = int((longitude - lon_span + 180) // self.cell_degrees)
+            last_column = int((longitude + lon_span + 180) // self.cell_degrees)
+            columns = {column % self._columns for column in range(first_column, last_column + 1)}
+
+        cx, cy, cz = unit_vector(latitude, longitude)
+        min_dot = math.cos(min(radius_km / EARTH_RADIUS_KM, math.pi))
+        acos = math.acos
+        for row in range(first_row, last_row + 1):
+            for column in columns:
+                cell = self._cells.get((row, column))
+                if not cell:
+                    continue
+                for ids, x, y, z in cell.values():
+                    dot = x * cx + y * cy + z * cz
+                    if dot >= min_dot:
+                        yield EARTH_RADIUS_KM * acos(min(dot, 1.0)), ids
+
+    def __len__(self):
+        return len(self._points)
+
+def init_geo(app):
+    """Load the gazetteer named by GAZETTEER_PATH."""
+    app.extensions['gazetteer'] = Gazetteer.load(app.config['GAZETTEER_PATH'])
@@ -0,0 +1,32 @@
+"""Production server settings, read by `gunicorn app:app` from this directory.
+
+Workers are gevent workers. An open `/api/conversations/stream` connection
+is then a greenlet waiting on its queue rather than a blocked worker, so
+each process holds up to WORKER_CONNECTIONS idle streams next to ordinary
+requests. gunicorn monkey-patches the worker before importing the app, so
+the in-process broker's queues and the outbox and periodic task threads
+yield to the event loop.
+
+Database drivers are C code that the monkey-patching does not reach.
+psycopg2 waits through gevent only once psycogreen has patched it, which
+`post_fork` does for a Postgres DATABASE_URL. sqlite3 never yields: under
+gevent every SQLite query blocks the whole worker, streams included, so
+run SQLite for development only.
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+# Open connections per worker, streams included
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 5000))
+# Streams stay open; only a worker that stops heartbeating is restarted
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 10))
+keepalive = 5
+
+def post_fork(server, worker):
+    # Let psycopg2 wait for the database through gevent instead of blocking the worker
+    if os.environ.get('DATABASE_URL', '').startswith('postgres'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
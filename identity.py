@@ -0,0 +1,143 @@
+"""Who is calling, answered from the access token instead of the database.
+
+Access tokens carry the user's `user_type` and `company_name` as claims, so
+endpoints that only need the caller's role use `roles_required` or
+`current_role()` and never load the User row. Tokens issued before the
+claims existed still work; their role is looked up once per request.
+
+Endpoints that need more of the row, such as the matching profile, use
+`current_user_snapshot()`. With IDENTITY_CACHE_TTL set, it serves a
+read-only copy from the response cache under the `user:<id>` namespace,
+so every write that invalidates that namespace also drops the copy.
+
+Revoked tokens (`POST /api/auth/logout`) are kept in the `revoked_token`
+table until they would have expired anyway, and expired rows are pruned
+on each revocation. Each process holds the
+unexpired jtis in memory and reloads them every
+TOKEN_DENYLIST_REFRESH_SECONDS, so the check costs no query per request.
+A revocation takes effect at once in the process that made it and within
+one refresh interval everywhere else.
+"""
+import threading
+from collections import namedtuple
+from datetime import datetime
+from functools import wraps
+from flask import current_app, jsonify
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity
+from sqlalchemy.orm import selectinload
+from extensions import db, jwt
+from models import User, RevokedToken
+from tasks import schedule
+
+ServiceAreaSnapshot = namedtuple('ServiceAreaSnapshot', 'area latitude longitude radius_km')
+UserSnapshot = namedtuple('UserSnapshot', 'id email company_name user_type rating total_ratings '
+                                          'service_area_links specialty_list')
+
+def create_user_token(user):
+    """Access token for user with the claims the role checks read."""
+    return create_access_token(identity=user.id, additional_claims={
+        'user_type': user.user_type,
+        'company_name': user.company_name
+    })
+
+def current_role():
+    """The caller's user_type from the token; None if the user no longer exists."""
+    role = get_jwt().get('user_type')
+    if role is None:
+        # Token issued before roles were embedded
+        user = User.query.get(get_jwt_identity())
+        role = user.user_type if user else None
+    return role
+
+def roles_required(*roles, message='Not authorized'):
+    """Answer 403 with message unless the caller's role is one of roles. Apply below @jwt_required."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if current_role() not in roles:
+                return jsonify({'error': message}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _snapshot(user):
+    return UserSnapshot(
+        user.id, user.email, user.company_name, user.user_type, user.rating, user.total_ratings,
+        tuple(ServiceAreaSnapshot(link.area, link.latitude, link.longitude, link.radius_km)
+              for link in user.service_area_links),
+        tuple(user.specialty_list)
+    )
+
+def current_user_snapshot():
+    """Read-only copy of the caller's User row with service areas and specialties, or None.
+
+    Load the User itself to change it.
+    """
+    user_id = get_jwt_identity()
+    cache = current_app.extensions.get('response_cache')
+    ttl = current_app.config['IDENTITY_CACHE_TTL']
+    key = None
+    if ttl and cache is not None and current_app.config['CACHE_BACKEND'] != 'none':
+        key = cache.key(f'user:{user_id}', 'identity')
+        snapshot = cache.backend.get(key)
+        if snapshot is not None:
+            return snapshot
+
+    user = User.query.options(selectinload(User.service_area_links), selectinload(User.specialty_links))\
+        .filter_by(id=user_id).first()
+    if user is None:
+        return None
+    snapshot = _snapshot(user)
+    if key is not None:
+        cache.backend.set(key, snapshot, ttl)
+    return snapshot
+
+class TokenDenylist:
+    """jti -> expiry of revoked tokens that have not expired yet."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expires = {}
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._expires[jti] = expires_at
+
+    def replace(self, expires):
+        with self._lock:
+            self._expires = dict(expires)
+
+    def __contains__(self, jti):
+        with self._lock:
+            return jti in self._expires
+
+    def __len__(self):
+        with self._lock:
+            return len(self._expires)
+
+def refresh_token_denylist():
+    """Reload the unexpired revoked jtis into this process."""
+    rows = db.session.query(RevokedToken.jti, RevokedToken.expires_at)\
+        .filter(RevokedToken.expires_at > datetime.utcnow()).all()
+    db.session.rollback()
+    current_app.extensions['token_denylist'].replace(rows)
+
+def revoke_token(claims):
+    """Deny the token with these claims until it expires."""
+    expires_at = datetime.utcfromtimestamp(claims['exp'])
+    db.session.merge(RevokedToken(jti=claims['jti'], expires_at=expires_at))
+    # Revocations are rare, so this is where the table is kept compact
+    RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+    current_app.extensions['token_denylist'].add(claims['jti'], expires_at)
+
+def init_identity(app):
+    """Register the denylist check. Call after the tables exist."""
+    app.extensions['token_denylist'] = TokenDenylist()
+
+    @jwt.token_in_blocklist_loader
+    def is_token_revoked(jwt_header, jwt_payload):
+        return jwt_payload['jti'] in current_app.extensions['token_denylist']
+
+    refresh_token_denylist()
+    schedule(app, 'token-denylist', refresh_token_denylist, app.config['TOKEN_DENYLIST_REFRESH_SECONDS'])
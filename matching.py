@@ -1,42 +1,208 @@
-from flask import jsonify, request
+import heapq
+from collections import defaultdict
+from flask import jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import app, db, FreightRequest, User, Quote
-from datetime import datetime
-import json
+from sqlalchemy import and_, exists, insert
+from extensions import db
+from models import FreightRequest, User, Quote, ProviderServiceArea, ProviderSpecialty, ProviderInbox
+from tasks import enqueue
+from events import handles
+from cache import invalidate
+from identity import roles_required, current_user_snapshot
+from serialization import InvalidFields, requested_fields, FREIGHT_REQUEST_MATCH
+from geo import GeoGrid, KM_PER_DEGREE
+from matching_engine import (matching_index, rating_score, proximity_score, Coverage, OPEN_STATUSES,
+                             ORIGIN_SCORE, DESTINATION_SCORE, SPECIALTY_SCORE, GRID_CELL_DEGREES)
 
-def calculate_match_score(request, provider):
+def load_provider_profile(provider):
+    """Return a provider's service area Coverage and specialties."""
+    return Coverage(provider.service_area_links), set(provider.specialty_list)
+
+def find_providers(area=None, freight_type=None):
+    """Query providers serving an area and/or specialising in a freight type.
+
+    Both filters are answered from the indexed association tables, e.g.
+    find_providers('Rotterdam', 'sea') for sea freight out of Rotterdam.
+    """
+    query = User.query.filter(User.user_type == 'provider')
+    if area:
+        query = query.join(ProviderServiceArea, ProviderServiceArea.user_id == User.id)\
+                     .filter(ProviderServiceArea.area == area)
+    if freight_type:
+        query = query.join(ProviderSpecialty, ProviderSpecialty.user_id == User.id)\
+                     .filter(ProviderSpecialty.freight_type == freight_type)
+    return query
+
+def calculate_match_score(request, provider, profile=None):
     """Calculate a match score between a freight request and a provider."""
     score = 0
     
-    # Convert provider's service areas and specialties from JSON string to list
-    service_areas = json.loads(provider.service_areas or '[]')
-    specialties = json.loads(provider.specialties or '[]')
+    # Pass a decoded profile when scoring many requests for the same provider
+    coverage, specialties = profile or load_provider_profile(provider)
     
-    # Check if provider serves the origin/destination areas
-    if request.origin in service_areas:
-        score += 30
-    if request.destination in service_areas:
-        score += 30
+    # Check if provider serves the origin/destination, by name or within a service radius
+    score += coverage.score(request.origin, request.origin_latitude, request.origin_longitude,
+                            ORIGIN_SCORE)
+    score += coverage.score(request.destination, request.destination_latitude,
+                            request.destination_longitude, DESTINATION_SCORE)
         
     # Check if provider specializes in the freight type
     if request.freight_type in specialties:
-        score += 20
+        score += SPECIALTY_SCORE
         
     # Consider provider's rating
-    score += min(provider.rating * 4, 20)  # Max 20 points for rating
+    score += rating_score(provider.rating)  # Max 20 points for rating
     
     return score
 
+def _service_areas_near(freight_requests):
+    """Grid of geocoded service areas whose circle can reach any of the requests' places."""
+    max_radius = current_app.config['SERVICE_AREA_MAX_RADIUS_KM']
+    points = [(lat, lon) for r in freight_requests
+              for lat, lon in ((r.origin_latitude, r.origin_longitude),
+                               (r.destination_latitude, r.destination_longitude))
+              if lat is not None]
+    grid = GeoGrid(GRID_CELL_DEGREES)
+    circles = {}
+    if not points:
+        return grid, circles
+    
+    # Latitude band of the batch grown by the largest radius, answered from the location index
+    lat_margin = max_radius / KM_PER_DEGREE
+    south = min(lat for lat, _ in points) - lat_margin
+    north = max(lat for lat, _ in points) + lat_margin
+    query = db.session.query(ProviderServiceArea.user_id, ProviderServiceArea.latitude,
+                             ProviderServiceArea.longitude, ProviderServiceArea.radius_km)\
+        .filter(ProviderServiceArea.latitude.between(south, north), ProviderServiceArea.radius_km.isnot(None))
+    for key, (provider_id, latitude, longitude, radius_km) in enumerate(query):
+        circles[key] = (provider_id, radius_km)
+        grid.add(key, latitude, longitude)
+    return grid, circles
+
+def _area_scores(place, latitude, longitude, max_score, providers_by_area, area_grid, circles):
+    """Best area points per provider for one place: by name, or by distance to a service area."""
+    scores = dict.fromkeys(providers_by_area[place], max_score)
+    if latitude is not None:
+        max_radius = current_app.config['SERVICE_AREA_MAX_RADIUS_KM']
+        for distance, keys in area_grid.within(latitude, longitude, max_radius):
+            for key in keys:
+                provider_id, radius_km = circles[key]
+                if distance <= radius_km:
+                    score = proximity_score(max_score, distance, radius_km)
+                    if score > scores.get(provider_id, 0):
+                        scores[provider_id] = score
+    return scores
+
+def fan_out_freight_requests(freight_request_ids):
+    """Push new freight requests to their top N providers' inboxes, loading candidates once for the batch.
+
+    Does not commit. Pairs already in an inbox, from a redelivered event or a
+    concurrent rebuild_provider_inbox, are left alone.
+    """
+    freight_requests = FreightRequest.query.filter(FreightRequest.id.in_(freight_request_ids),
+                                                   FreightRequest.status.in_(OPEN_STATUSES)).all()
+    if not freight_requests:
+        return 0
+    
+    # Providers naming an area or sharing the specialty, straight from the association indexes
+    areas = {r.origin for r in freight_requests} | {r.destination for r in freight_requests}
+    providers_by_area = defaultdict(list)
+    for provider_id, area in db.session.query(ProviderServiceArea.user_id, ProviderServiceArea.area)\
+            .filter(ProviderServiceArea.area.in_(areas)):
+        providers_by_area[area].append(provider_id)
+    
+    providers_by_type = defaultdict(list)
+    for provider_id, freight_type in db.session.query(ProviderSpecialty.user_id, ProviderSpecialty.freight_type)\
+            .filter(ProviderSpecialty.freight_type.in_({r.freight_type for r in freight_requests})):
+        providers_by_type[freight_type].append(provider_id)
+    
+    # Providers whose service radius covers an origin or destination
+    area_grid, circles = _service_areas_near(freight_requests)
+    
+    candidates = set().union(*providers_by_area.values(), *providers_by_type.values(),
+                             (provider_id for provider_id, _ in circles.values()))
+    if not candidates:
+        return 0
+    ratings = dict(db.session.query(User.id, User.rating)
+                   .filter(User.id.in_(candidates), User.user_type == 'provider'))
+    
+    top_n = current_app.config['MATCHING_FANOUT_TOP_N']
+    rows = []
+    for freight_request in freight_requests:
+        scores = defaultdict(int)
+        for provider_id, score in _area_scores(freight_request.origin, freight_request.origin_latitude,
+                                               freight_request.origin_longitude, ORIGIN_SCORE,
+                                               providers_by_area, area_grid, circles).items():
+            scores[provider_id] += score
+        for provider_id, score in _area_scores(freight_request.destination, freight_request.destination_latitude,
+                                               freight_request.destination_longitude, DESTINATION_SCORE,
+                                               providers_by_area, area_grid, circles).items():
+            scores[provider_id] += score
+        for provider_id in providers_by_type[freight_request.freight_type]:
+            scores[provider_id] += SPECIALTY_SCORE
+        
+        ranked = heapq.nlargest(top_n, ((score + rating_score(ratings[provider_id]), provider_id)
+                                        for provider_id, score in scores.items() if provider_id in ratings))
+        rows.extend({
+            'provider_id': provider_id,
+            'freight_request_id': freight_request.id,
+            'match_score': score,
+            'created_at': freight_request.created_at
+        } for score, provider_id in ranked)
+    
+    if rows:
+        existing = set(db.session.query(ProviderInbox.provider_id, ProviderInbox.freight_request_id).filter(
+            ProviderInbox.provider_id.in_({row['provider_id'] for row in rows}),
+            ProviderInbox.freight_request_id.in_(freight_request_ids)
+        ))
+        rows = [row for row in rows if (row['provider_id'], row['freight_request_id']) not in existing]
+    if rows:
+        db.session.execute(insert(ProviderInbox), rows)
+    
+    return len(rows)
+
+@handles('freight_request.created')
+def fan_out_created_requests(payload):
+    fan_out_freight_requests(payload['ids'])
+
+def rebuild_provider_inbox(provider_id):
+    """Recompute a provider's inbox from the matching index after its profile changed."""
+    provider = db.session.get(User, provider_id)
+    if not provider:
+        return 0
+    
+    coverage, specialties = load_provider_profile(provider)
+    matching_index.sync()
+    # A zero rating keeps rating-only filler out; the bonus is added below
+    matches = matching_index.top_matches(
+        coverage, specialties, 0, current_app.config['MATCHING_FANOUT_TOP_N']
+    )
+    created_at = dict(db.session.query(FreightRequest.id, FreightRequest.created_at)
+                      .filter(FreightRequest.id.in_([request_id for _, request_id in matches])))
+    
+    ProviderInbox.query.filter_by(provider_id=provider_id).delete()
+    if matches:
+        db.session.execute(insert(ProviderInbox), [{
+            'provider_id': provider_id,
+            'freight_request_id': request_id,
+            'match_score': score + rating_score(provider.rating),
+            'created_at': created_at.get(request_id)
+        } for score, request_id in matches])
+    db.session.commit()
+    
+    return len(matches)
+
 def init_matching_routes(app):
     @app.route('/api/matching/available-requests', methods=['GET'])
     @jwt_required()
+    @roles_required('provider', message='Only service providers can access matching')
     def get_available_requests():
         current_user_id = get_jwt_identity()
         
-        # Verify user is a provider
-        provider = User.query.get(current_user_id)
-        if not provider or provider.user_type != 'provider':
-            return jsonify({'error': 'Only service providers can access matching'}), 403
+        # Profile and rating only; a cached copy will do
+        provider = current_user_snapshot()
+        if not provider:
+            return jsonify({'error': 'User not found'}), 404
             
         try:
             # Get query parameters for filtering
@@ -44,86 +210,148 @@ def init_matching_routes(app):
             min_weight = request.args.get('min_weight', type=float)
             max_weight = request.args.get('max_weight', type=float)
             
-            # Base query for open freight requests
-            query = FreightRequest.query.filter(
-                FreightRequest.status.in_(['pending', 'quoted'])
-            )
-            
-            # Apply filters
-            if freight_type:
-                query = query.filter_by(freight_type=freight_type)
-            if min_weight:
-                query = query.filter(FreightRequest.weight >= min_weight)
-            if max_weight:
-                query = query.filter(FreightRequest.weight <= max_weight)
+            # Pagination over the ranked matches
+            page = max(request.args.get('page', 1, type=int), 1)
+            limit = request.args.get('limit', current_app.config['MATCHING_TOP_K'], type=int)
+            limit = min(max(limit, 1), current_app.config['MATCHING_MAX_LIMIT'])
+            dump_request = FREIGHT_REQUEST_MATCH.dumper(requested_fields(FREIGHT_REQUEST_MATCH))
+            
+            coverage, specialties = load_provider_profile(provider)
+            
+            # Open requests this provider has already quoted, fetched in one query; closed ones are not indexed
+            quoted_ids = {request_id for (request_id,) in db.session.query(Quote.freight_request_id)
+                          .join(FreightRequest, FreightRequest.id == Quote.freight_request_id)
+                          .filter(Quote.provider_id == current_user_id,
+                                  FreightRequest.status.in_(OPEN_STATUSES)).all()}
+            
+            # Pick up requests created since the last call (possibly by other workers)
+            matching_index.sync()
+            
+            # Score only the indexed candidates; one extra match tells us if there is a next page
+            while True:
+                matches = matching_index.top_matches(
+                    coverage, specialties, provider.rating, page * limit + 1,
+                    freight_type=freight_type,
+                    min_weight=min_weight,
+                    max_weight=max_weight,
+                    exclude=quoted_ids
+                )
+                has_more = len(matches) > page * limit
+                matches = matches[(page - 1) * limit:page * limit]
+                
+                requests = {req.id: req for req in FreightRequest.query.filter(
+                    FreightRequest.id.in_([request_id for _, request_id in matches]),
+                    FreightRequest.status.in_(OPEN_STATUSES)
+                ).all()}
                 
-            # Get all matching requests
-            requests = query.all()
-            
-            # Calculate match scores and sort
-            matched_requests = []
-            for req in requests:
-                # Skip requests where provider has already quoted
-                if Quote.query.filter_by(freight_request_id=req.id, provider_id=current_user_id).first():
-                    continue
-                    
-                score = calculate_match_score(req, provider)
-                if score > 0:  # Only include if there's some match
-                    matched_requests.append({
-                        'request': {
-                            'id': req.id,
-                            'freight_type': req.freight_type,
-                            'origin': req.origin,
-                            'destination': req.destination,
-                            'cargo_details': req.cargo_details,
-                            'weight': req.weight,
-                            'dimensions': req.dimensions,
-                            'deadline': req.deadline.isoformat() if req.deadline else None,
-                            'status': req.status,
-                            'created_at': req.created_at.isoformat(),
-                            'urgency': req.urgency,
-                            'budget_range': req.budget_range
-                        },
-                        'match_score': score
-                    })
-            
-            # Sort by match score (highest first)
-            matched_requests.sort(key=lambda x: x['match_score'], reverse=True)
+                # Evict requests closed since they were indexed and rank again
+                stale_ids = [request_id for _, request_id in matches if request_id not in requests]
+                if not stale_ids:
+                    break
+                for request_id in stale_ids:
+                    matching_index.remove(request_id)
+            
+            matched_requests = [
+                {'request': dump_request(requests[request_id], None), 'match_score': score}
+                for score, request_id in matches
+            ]
             
             return jsonify({
-                'matched_requests': matched_requests
+                'matched_requests': matched_requests,
+                'pagination': {
+                    'current_page': page,
+                    'limit': limit,
+                    'has_more': has_more
+                }
             }), 200
             
+        except InvalidFields as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': 'Failed to fetch matching requests', 'details': str(e)}), 500
 
+    @app.route('/api/matching/inbox', methods=['GET'])
+    @jwt_required()
+    @roles_required('provider', message='Only service providers can access matching')
+    def get_matching_inbox():
+        current_user_id = get_jwt_identity()
+        
+        try:
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 20, type=int)
+            dump_request = FREIGHT_REQUEST_MATCH.dumper(requested_fields(FREIGHT_REQUEST_MATCH))
+            
+            # Precomputed matches that are still open and not yet quoted by this provider
+            already_quoted = exists().where(and_(
+                Quote.freight_request_id == ProviderInbox.freight_request_id,
+                Quote.provider_id == current_user_id
+            ))
+            query = db.session.query(ProviderInbox, FreightRequest)\
+                .join(FreightRequest, FreightRequest.id == ProviderInbox.freight_request_id)\
+                .filter(ProviderInbox.provider_id == current_user_id)\
+                .filter(FreightRequest.status.in_(OPEN_STATUSES))\
+                .filter(~already_quoted)\
+                .order_by(ProviderInbox.match_score.desc(), ProviderInbox.created_at.desc())
+            
+            pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+            
+            return jsonify({
+                'matched_requests': [
+                    {'request': dump_request(req, None), 'match_score': entry.match_score}
+                    for entry, req in pagination.items
+                ],
+                'pagination': {
+                    'total_items': pagination.total,
+                    'total_pages': pagination.pages,
+                    'current_page': page,
+                    'per_page': per_page
+                }
+            }), 200
+            
+        except InvalidFields as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': 'Failed to fetch matching inbox', 'details': str(e)}), 500
+
     @app.route('/api/matching/provider-profile', methods=['PUT'])
     @jwt_required()
+    @roles_required('provider', message='Only service providers can update matching profile')
     def update_provider_profile():
         current_user_id = get_jwt_identity()
-        
-        # Verify user is a provider
         provider = User.query.get(current_user_id)
-        if not provider or provider.user_type != 'provider':
-            return jsonify({'error': 'Only service providers can update matching profile'}), 403
+        if not provider:
+            return jsonify({'error': 'User not found'}), 404
             
         data = request.get_json()
         
         try:
             # Update service areas and specialties
             if 'service_areas' in data:
-                provider.service_areas = json.dumps(data['service_areas'])
+                provider.set_service_areas(data['service_areas'])
             if 'specialties' in data:
-                provider.specialties = json.dumps(data['specialties'])
+                provider.set_specialties(data['specialties'])
                 
             db.session.commit()
+            invalidate(f'user:{provider.id}')
+            
+            # Re-match the open backlog against the new profile off the request path
+            enqueue(rebuild_provider_inbox, provider.id)
             
             return jsonify({
                 'message': 'Provider profile updated successfully',
-                'service_areas': json.loads(provider.service_areas),
-                'specialties': json.loads(provider.specialties)
+                'service_areas': provider.service_area_list,
+                'coverage': [{
+                    'area': link.area,
+                    'latitude': link.latitude,
+                    'longitude': link.longitude,
+                    'radius_km': link.radius_km
+                } for link in provider.service_area_links],
+                'specialties': provider.specialty_list
             }), 200
             
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': 'Failed to update provider profile', 'details': str(e)}), 500
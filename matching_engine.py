@@ -0,0 +1,294 @@
+import heapq
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from flask import current_app
+from extensions import db
+from models import FreightRequest
+from geo import GeoGrid, haversine_km
+
+# Statuses in which a freight request can still receive quotes
+OPEN_STATUSES = ('pending', 'quoted')
+
+# Match score weights
+ORIGIN_SCORE = 30
+DESTINATION_SCORE = 30
+SPECIALTY_SCORE = 20
+MAX_RATING_SCORE = 20
+
+# A load at the edge of a service area still earns this share of the area points
+EDGE_SCORE_SHARE = 0.5
+GRID_CELL_DEGREES = 1.0
+
+def rating_score(rating):
+    """Points awarded for a provider's average rating (max 20)."""
+    return min((rating or 0.0) * 4, MAX_RATING_SCORE)
+
+def proximity_score(max_score, distance_km, radius_km):
+    """Area points for a place distance_km from the centre of a service area, falling linearly to the edge."""
+    return round(max_score * (1 - (1 - EDGE_SCORE_SHARE) * min(distance_km / radius_km, 1.0)), 2)
+
+class Coverage:
+    """A provider's service areas: exact names, plus circles around the geocoded ones."""
+
+    def __init__(self, areas):
+        areas = list(areas)
+        self.names = {area.area for area in areas}
+        self.circles = [(area.latitude, area.longitude, area.radius_km) for area in areas
+                        if area.latitude is not None and area.radius_km]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def score(self, place, latitude, longitude, max_score):
+        """Best area points for a place: full for a named area, else by distance to the nearest circle."""
+        if place in self.names:
+            return max_score
+        best = 0
+        if latitude is not None:
+            for center_lat, center_lon, radius_km in self.circles:
+                distance = haversine_km(center_lat, center_lon, latitude, longitude)
+                if distance <= radius_km:
+                    best = max(best, proximity_score(max_score, distance, radius_km))
+        return best
+
+class MatchingIndex:
+    """In-memory inverted and spatial indexes over open freight requests.
+
+    Open requests are grouped into lanes: requests with the same origin,
+    destination, freight type and coordinates score the same for any
+    provider. Origin, destination and freight type map to lanes, and the
+    geocoded ends of each lane sit in grids, so a provider's candidates are
+    found with set operations and radius queries, and scoring is per lane
+    rather than per request. Since places are geocoded through the
+    gazetteer, a backlog of 100k+ requests spans a few thousand lanes.
+
+    The index is per process: requests created by other workers are picked
+    up by `sync`, and requests closed elsewhere are evicted by callers once
+    they see the row is no longer open.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._synced_until = None  # newest created_at read by sync
+        self._entries = {}  # request id -> (lane, weight)
+        self.lanes = {}  # (origin, destination, freight_type, origin point, destination point) -> request ids
+        self.by_origin = defaultdict(set)
+        self.by_destination = defaultdict(set)
+        self.by_freight_type = defaultdict(set)
+        self.origin_grid = GeoGrid(GRID_CELL_DEGREES)
+        self.destination_grid = GeoGrid(GRID_CELL_DEGREES)
+
+    def add(self, freight_request):
+        """Index an open freight request."""
+        if freight_request.status not in OPEN_STATUSES:
+            return
+        with self._lock:
+            self._add(freight_request.id, freight_request.origin, freight_request.destination,
+                      freight_request.freight_type, freight_request.weight,
+                      freight_request.origin_latitude, freight_request.origin_longitude,
+                      freight_request.destination_latitude, freight_request.destination_longitude)
+
+    def remove(self, request_id):
+        """Drop a freight request from the index."""
+        with self._lock:
+            entry = self._entries.pop(request_id, None)
+            if not entry:
+                return
+            lane = entry[0]
+            request_ids = self.lanes[lane]
+            request_ids.discard(request_id)
+            if not request_ids:
+                del self.lanes[lane]
+                origin, destination, freight_type, _, _ = lane
+                self._discard(self.by_origin, origin, lane)
+                self._discard(self.by_destination, destination, lane)
+                self._discard(self.by_freight_type, freight_type, lane)
+                self.origin_grid.remove(lane)
+                self.destination_grid.remove(lane)
+
+    def update_status(self, freight_request):
+        """Keep the index current after a freight request changes status."""
+        if freight_request.status in OPEN_STATUSES:
+            self.add(freight_request)
+        else:
+            self.remove(freight_request.id)
+
+    def sync(self):
+        """Load the index on first use, then pick up requests created since the last sync.
+
+        New requests are found by created_at, not id. Ids are handed out at
+        insert, so a request committed late by another worker can have a
+        lower id than one already indexed here. Each sync reads again the
+        last MATCHING_SYNC_OVERLAP_SECONDS before the newest request it has
+        seen and skips those already indexed.
+        """
+        with self._lock:
+            query = db.session.query(
+                FreightRequest.created_at,
+                FreightRequest.status,
+                FreightRequest.id,
+                FreightRequest.origin,
+                FreightRequest.destination,
+                FreightRequest.freight_type,
+                FreightRequest.weight,
+                FreightRequest.origin_latitude,
+                FreightRequest.origin_longitude,
+                FreightRequest.destination_latitude,
+                FreightRequest.destination_longitude
+            )
+
+            if self._loaded and self._synced_until is not None:
+                # A range on the created_at index; the few closed rows in it are skipped below
+                overlap = timedelta(seconds=current_app.config['MATCHING_SYNC_OVERLAP_SECONDS'])
+                query = query.filter(FreightRequest.created_at >= self._synced_until - overlap)\
+                    .order_by(FreightRequest.created_at, FreightRequest.id)
+            else:
+                query = query.filter(FreightRequest.status.in_(OPEN_STATUSES)).order_by(FreightRequest.id)
+
+            for created_at, status, *row in query.all():
+                if status in OPEN_STATUSES and row[0] not in self._entries:
+                    self._add(*row)
+                if created_at and (self._synced_until is None or created_at > self._synced_until):
+                    self._synced_until = created_at
+            self._loaded = True
+
+    def reset(self):
+        """Forget everything; the next sync reloads from the database."""
+        with self._lock:
+            self._loaded = False
+            self._synced_until = None
+            self._entries.clear()
+            self.lanes.clear()
+            self.by_origin.clear()
+            self.by_destination.clear()
+            self.by_freight_type.clear()
+            self.origin_grid.clear()
+            self.destination_grid.clear()
+
+    def top_matches(self, coverage, specialties, rating, k, freight_type=None,
+                    min_weight=None, max_weight=None, exclude=None):
+        """Return up to k (score, request_id) pairs, best match first.
+
+        Only lanes in or near the provider's service areas, or of one of its
+        specialties, are scored. Every other open request scores just the
+        rating bonus, so those are used (newest first) to fill any
+        remaining slots.
+        """
+        exclude = exclude or set()
+        base_score = rating_score(rating)
+
+        with self._lock:
+            origin_scores = self._area_scores(self.by_origin, self.origin_grid, coverage, ORIGIN_SCORE)
+            destination_scores = self._area_scores(self.by_destination, self.destination_grid,
+                                                   coverage, DESTINATION_SCORE)
+            area_lanes = origin_scores.keys() | destination_scores.keys()
+            specialty_lanes = self._union(self.by_freight_type, specialties)
+
+            if freight_type:
+                area_lanes &= self.by_freight_type.get(freight_type, set())
+                specialty_lanes &= self.by_freight_type.get(freight_type, set())
+            candidates = area_lanes | specialty_lanes
+
+            def accepts(request_id):
+                if request_id in exclude:
+                    return False
+                weight = self._entries[request_id][1]
+                if min_weight and (weight is None or weight < min_weight):
+                    return False
+                if max_weight and (weight is None or weight > max_weight):
+                    return False
+                return True
+
+            # Lanes near the provider are scored one by one; specialty-only lanes all score
+            # the same and enter the heap as a single group (lane None)
+            heap = [(-(origin_scores.get(lane, 0) +
+                       destination_scores.get(lane, 0) +
+                       SPECIALTY_SCORE * (lane in specialty_lanes) +
+                       base_score), position, lane)
+                    for position, lane in enumerate(area_lanes)]
+            if specialty_lanes - area_lanes:
+                heap.append((-(SPECIALTY_SCORE + base_score), -1, None))
+            heapq.heapify(heap)
+
+            # Pop lanes best first; requests tied on score come out newest first
+            matches = []
+            while heap and len(matches) < k:
+                score = heap[0][0]
+                request_ids = []
+                while heap and heap[0][0] == score:
+                    _, _, lane = heapq.heappop(heap)
+                    for group in ([lane] if lane is not None else specialty_lanes - area_lanes):
+                        request_ids.extend(self.lanes[group])
+                for request_id in sorted(request_ids, reverse=True):
+                    if len(matches) >= k:
+                        break
+                    if accepts(request_id):
+                        matches.append((-score, request_id))
+
+            # Requests outside the candidate lanes only score if the provider has a rating
+            if len(matches) < k and base_score > 0:
+                for request_id in reversed(self._entries):
+                    if len(matches) >= k:
+                        break
+                    lane = self._entries[request_id][0]
+                    if lane in candidates:
+                        continue
+                    if freight_type and lane[2] != freight_type:
+                        continue
+                    if accepts(request_id):
+                        matches.append((base_score, request_id))
+
+            return matches
+
+    def _add(self, request_id, origin, destination, freight_type, weight,
+             origin_latitude=None, origin_longitude=None, destination_latitude=None, destination_longitude=None):
+        origin_point = (origin_latitude, origin_longitude) if origin_latitude is not None else None
+        destination_point = (destination_latitude, destination_longitude) \
+            if destination_latitude is not None else None
+        lane = (origin, destination, freight_type, origin_point, destination_point)
+        self._entries[request_id] = (lane, weight)
+        if lane not in self.lanes:
+            self.lanes[lane] = set()
+            self.by_origin[origin].add(lane)
+            self.by_destination[destination].add(lane)
+            self.by_freight_type[freight_type].add(lane)
+            if origin_point:
+                self.origin_grid.add(lane, *origin_point)
+            if destination_point:
+                self.destination_grid.add(lane, *destination_point)
+        self.lanes[lane].add(request_id)
+
+    @classmethod
+    def _area_scores(cls, index, grid, coverage, max_score):
+        """Best area points per lane, from exact names and from the circles."""
+        scores = dict.fromkeys(cls._union(index, coverage.names), max_score)
+        for latitude, longitude, radius_km in coverage.circles:
+            for distance, lanes in grid.within(latitude, longitude, radius_km):
+                score = proximity_score(max_score, distance, radius_km)
+                for lane in lanes:
+                    if score > scores.get(lane, 0):
+                        scores[lane] = score
+        return scores
+
+    @staticmethod
+    def _discard(index, key, value):
+        values = index.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del index[key]
+
+    @staticmethod
+    def _union(index, keys):
+        result = set()
+        for key in keys:
+            result |= index.get(key, set())
+        return result
+
+# Process-wide index shared by the matching routes and the write paths
+matching_index = MatchingIndex()
@@ -1,8 +1,16 @@
 from flask import jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import app, db, Message, Conversation, User, FreightRequest
+from extensions import db
+from models import Message, Conversation, User, FreightRequest
 from datetime import datetime
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, func, select
+from sqlalchemy.orm import joinedload, selectinload
+from realtime import publish_to_user
+from cache import invalidate
+from events import emit, handles, on_commit
+from identity import current_role
+from serialization import InvalidFields, requested_fields, MESSAGE, CONVERSATION
+from pagination import InvalidCursor, wants_keyset, keyset_paginate, keyset_request_args, keyset_meta
 
 def create_system_message(conversation_id, freight_request_id, content, recipient_id):
     """Create a system-generated message."""
@@ -19,16 +27,113 @@ def create_system_message(conversation_id, freight_request_id, content, recipien
     db.session.add(message)
     return message
 
-def update_unread_count(user_id):
-    """Update user's unread message count."""
-    unread_count = Message.query.filter_by(
-        recipient_id=user_id,
-        read_at=None
-    ).count()
+def publish_new_message(recipient_id, conversation_id, payload, unread_delta):
+    """Push a committed message and the change to the unread count to the recipient's open streams."""
+    publish_to_user(recipient_id, 'message', dict(payload, conversation_id=conversation_id))
+    publish_unread(recipient_id, conversation_id, unread_delta)
+
+def publish_unread(user_id, conversation_id, delta):
+    if delta:
+        publish_to_user(user_id, 'unread', {'conversation_id': conversation_id, 'delta': delta})
+
+def adjust_unread_counts(conversation, recipient_id, delta):
+    """Atomically adjust the recipient's unread counters within the current transaction."""
+    User.query.filter_by(id=recipient_id).update(
+        {User.unread_messages: func.coalesce(User.unread_messages, 0) + delta},
+        synchronize_session=False
+    )
+    
+    if recipient_id == conversation.shipper_id:
+        conversation.shipper_unread = Conversation.shipper_unread + delta
+    else:
+        conversation.provider_unread = Conversation.provider_unread + delta
+
+def sync_unread_counts(conversation_id, recipient_id):
+    """Set the recipient's unread counter on a conversation to its unread messages. Returns the change.
+
+    Their total moves by the same amount. Sent and read events recount rather
+    than add or subtract, so they give the same result in any order.
+    """
+    # The row lock serializes handlers of the same conversation
+    conversation = Conversation.query.filter_by(id=conversation_id)\
+        .populate_existing().with_for_update().first()
+    if conversation is None:
+        return 0
+    unread = db.session.scalar(select(func.count(Message.id)).where(
+        Message.recipient_id == recipient_id, Message.conversation_id == conversation_id,
+        Message.read_at.is_(None)
+    ))
+    counted = conversation.shipper_unread if recipient_id == conversation.shipper_id else conversation.provider_unread
+    delta = unread - (counted or 0)
+    if delta:
+        adjust_unread_counts(conversation, recipient_id, delta)
+    return delta
+
+@handles('conversation.started')
+def post_conversation_started(payload):
+    """Open the conversation with a system message, unread for the other side."""
+    conversation = db.session.get(Conversation, payload['conversation_id'])
+    if conversation is None or Message.query.filter_by(conversation_id=conversation.id,
+                                                       system_message=True).first() is not None:
+        return
+    recipient_id = payload['recipient_id']
+    system_message = create_system_message(
+        conversation.id,
+        conversation.freight_request_id,
+        f"Conversation started regarding freight request #{conversation.freight_request_id}",
+        recipient_id
+    )
+    db.session.flush()
+    delta = sync_unread_counts(conversation.id, recipient_id)
+    on_commit(invalidate, f'user:{recipient_id}')
+    on_commit(publish_new_message, recipient_id, conversation.id, MESSAGE.dump(system_message), delta)
+
+@handles('message.sent')
+def count_unread_message(payload):
+    """Count a new message as unread for its recipient and push it to their streams."""
+    recipient_id = payload['recipient_id']
+    delta = sync_unread_counts(payload['conversation_id'], recipient_id)
+    on_commit(invalidate, f'user:{recipient_id}')
+    on_commit(publish_new_message, recipient_id, payload['conversation_id'], payload['message'], delta)
+
+@handles('messages.read')
+def uncount_read_messages(payload):
+    """Take messages the reader has seen off their unread counts."""
+    reader_id = payload['reader_id']
+    delta = sync_unread_counts(payload['conversation_id'], reader_id)
+    if delta:
+        on_commit(invalidate, f'user:{reader_id}')
+        # Lets the reader's other open streams update their badges
+        on_commit(publish_unread, reader_id, payload['conversation_id'], delta)
+
+def reconcile_unread_counts():
+    """Recount unread messages and repair drifted counters. Returns the number of rows fixed."""
+    def unread_for(recipient_column, conversation_column=None):
+        query = select(func.count(Message.id))\
+            .where(Message.recipient_id == recipient_column, Message.read_at.is_(None))
+        if conversation_column is not None:
+            query = query.where(Message.conversation_id == conversation_column)
+        return query.scalar_subquery()
+    
+    repaired = 0
+    user_unread = unread_for(User.id)
+    repaired += db.session.execute(
+        User.__table__.update()
+        .where(func.coalesce(User.unread_messages, -1) != user_unread)
+        .values(unread_messages=user_unread)
+    ).rowcount
+    
+    shipper_unread = unread_for(Conversation.shipper_id, Conversation.id)
+    provider_unread = unread_for(Conversation.provider_id, Conversation.id)
+    repaired += db.session.execute(
+        Conversation.__table__.update()
+        .where(or_(Conversation.shipper_unread != shipper_unread,
+                   Conversation.provider_unread != provider_unread))
+        .values(shipper_unread=shipper_unread, provider_unread=provider_unread)
+    ).rowcount
     
-    user = User.query.get(user_id)
-    user.unread_messages = unread_count
     db.session.commit()
+    return repaired
 
 def init_messaging_routes(app):
     @app.route('/api/conversations', methods=['GET'])
@@ -40,9 +145,13 @@ def init_messaging_routes(app):
             # Get query parameters
             page = request.args.get('page', 1, type=int)
             per_page = request.args.get('per_page', 10, type=int)
+            fields = requested_fields(CONVERSATION)
             
-            # Get conversations where user is either shipper or provider
-            query = Conversation.query.filter(
+            # Get conversations where user is either shipper or provider, with both parties in the same query
+            query = Conversation.query.options(
+                joinedload(Conversation.shipper),
+                joinedload(Conversation.provider)
+            ).filter(
                 or_(
                     Conversation.shipper_id == current_user_id,
                     Conversation.provider_id == current_user_id
@@ -63,37 +172,30 @@ def init_messaging_routes(app):
                 )
             )
             
-            # Order by last message time
-            conversations = query.order_by(Conversation.last_message_at.desc())\
-                               .paginate(page=page, per_page=per_page, error_out=False)
-            
-            return jsonify({
-                'conversations': [{
-                    'id': conv.id,
-                    'freight_request_id': conv.freight_request_id,
-                    'shipper': {
-                        'id': conv.shipper_id,
-                        'company_name': User.query.get(conv.shipper_id).company_name
-                    },
-                    'provider': {
-                        'id': conv.provider_id,
-                        'company_name': User.query.get(conv.provider_id).company_name
-                    },
-                    'last_message_at': conv.last_message_at.isoformat(),
-                    'unread_count': Message.query.filter_by(
-                        conversation_id=conv.id,
-                        recipient_id=current_user_id,
-                        read_at=None
-                    ).count()
-                } for conv in conversations.items],
-                'pagination': {
+            if wants_keyset():
+                # Cursor mode: most recent first by (last_message_at, id)
+                cursor, include_total = keyset_request_args()
+                conversations = keyset_paginate(query, Conversation.last_message_at, Conversation.id,
+                                                cursor, per_page, include_total)
+                pagination_info = keyset_meta(conversations, per_page)
+            else:
+                # Order by last message time
+                conversations = query.order_by(Conversation.last_message_at.desc())\
+                                   .paginate(page=page, per_page=per_page, error_out=False)
+                pagination_info = {
                     'total_items': conversations.total,
                     'total_pages': conversations.pages,
                     'current_page': page,
                     'per_page': per_page
                 }
+            
+            return jsonify({
+                'conversations': CONVERSATION.dump_many(conversations.items, current_user_id, fields=fields),
+                'pagination': pagination_info
             }), 200
             
+        except (InvalidCursor, InvalidFields) as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': 'Failed to fetch conversations', 'details': str(e)}), 500
 
@@ -108,8 +210,7 @@ def init_messaging_routes(app):
             return jsonify({'error': 'Freight request not found'}), 404
         
         # Determine shipper and provider IDs
-        current_user = User.query.get(current_user_id)
-        if current_user.user_type == 'shipper':
+        if current_role() == 'shipper':
             shipper_id = current_user_id
             provider_id = request.json.get('provider_id')
         else:
@@ -138,21 +239,17 @@ def init_messaging_routes(app):
             )
             
             db.session.add(conversation)
-            db.session.commit()
-            
-            # Create initial system message
-            create_system_message(
-                conversation.id,
-                freight_request_id,
-                f"Conversation started regarding freight request #{freight_request_id}",
-                shipper_id if current_user_id != shipper_id else provider_id
-            )
+            db.session.flush()
             
+            # The system message follows from the outbox
+            recipient_id = shipper_id if current_user_id != shipper_id else provider_id
+            conversation_id = conversation.id
+            emit('conversation.started', conversation_id=conversation_id, recipient_id=recipient_id)
             db.session.commit()
             
             return jsonify({
                 'message': 'Conversation created successfully',
-                'conversation_id': conversation.id
+                'conversation_id': conversation_id
             }), 201
             
         except Exception as e:
@@ -177,44 +274,52 @@ def init_messaging_routes(app):
             # Get query parameters
             page = request.args.get('page', 1, type=int)
             per_page = request.args.get('per_page', 50, type=int)
+            fields = requested_fields(MESSAGE)
             
-            # Get messages
-            messages = Message.query.filter_by(conversation_id=conversation_id)\
-                                  .order_by(Message.created_at.desc())\
-                                  .paginate(page=page, per_page=per_page, error_out=False)
+            # Get messages, loading all senders on the page in one extra query
+            query = Message.query.options(selectinload(Message.sender))\
+                                 .filter_by(conversation_id=conversation_id)
+            if wants_keyset():
+                # Cursor mode: newest first by (created_at, id)
+                cursor, include_total = keyset_request_args()
+                messages = keyset_paginate(query, Message.created_at, Message.id,
+                                           cursor, per_page, include_total)
+                pagination_info = keyset_meta(messages, per_page)
+            else:
+                messages = query.order_by(Message.created_at.desc())\
+                                .paginate(page=page, per_page=per_page, error_out=False)
+                pagination_info = {
+                    'total_items': messages.total,
+                    'total_pages': messages.pages,
+                    'current_page': page,
+                    'per_page': per_page
+                }
             
             # Mark unread messages as read
-            Message.query.filter_by(
+            marked_read = Message.query.filter_by(
                 conversation_id=conversation_id,
                 recipient_id=current_user_id,
                 read_at=None
             ).update({'read_at': datetime.utcnow()})
             
-            db.session.commit()
+            # The unread counts follow from the outbox, after the messages were counted
+            if marked_read:
+                emit('messages.read', conversation_id=conversation_id, reader_id=current_user_id)
             
-            # Update user's unread count
-            update_unread_count(current_user_id)
+            # Serialize before committing; the update above already set read_at on the loaded
+            # messages, and the commit would otherwise expire and reload each of them
+            response = {
+                'messages': MESSAGE.dump_many(messages.items, fields=fields),
+                'pagination': pagination_info
+            }
             
-            return jsonify({
-                'messages': [{
-                    'id': msg.id,
-                    'sender_id': msg.sender_id,
-                    'sender_name': User.query.get(msg.sender_id).company_name if not msg.system_message else 'System',
-                    'content': msg.content,
-                    'created_at': msg.created_at.isoformat(),
-                    'read_at': msg.read_at.isoformat() if msg.read_at else None,
-                    'message_type': msg.message_type,
-                    'attachment_url': msg.attachment_url,
-                    'system_message': msg.system_message
-                } for msg in messages.items],
-                'pagination': {
-                    'total_items': messages.total,
-                    'total_pages': messages.pages,
-                    'current_page': page,
-                    'per_page': per_page
-                }
-            }), 200
+            db.session.commit()
+            
+            return jsonify(response), 200
             
+        except (InvalidCursor, InvalidFields) as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': 'Failed to fetch messages', 'details': str(e)}), 500
@@ -261,16 +366,19 @@ def init_messaging_routes(app):
                 conversation.shipper_archived = False
             
             db.session.add(message)
-            db.session.commit()
-            
-            # Update recipient's unread count
-            update_unread_count(message.recipient_id)
-            
-            return jsonify({
+            db.session.flush()
+            response = {
                 'message': 'Message sent successfully',
                 'message_id': message.id,
-                'sent_at': message.created_at.isoformat()
-            }), 201
+                'sent_at': message.created_at
+            }
+            sender = conversation.shipper if current_user_id == conversation.shipper_id else conversation.provider
+            # The unread count and the push to the recipient's streams follow from the outbox
+            emit('message.sent', conversation_id=conversation_id, recipient_id=message.recipient_id,
+                 message=MESSAGE.dump(message, sender.company_name))
+            db.session.commit()
+            
+            return jsonify(response), 201
             
         except Exception as e:
             db.session.rollback()
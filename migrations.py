@@ -0,0 +1,142 @@
+"""Schema and data migrations for existing databases.
+
+`db.create_all()` creates missing tables but never alters existing ones.
+Every step here is idempotent; `flask --app app migrate-db` runs them in order.
+"""
+import json
+from flask import current_app
+from extensions import db
+from models import User, FreightRequest, ProviderServiceArea
+from geo import geocode
+from quotes import reconcile_quote_counts
+from messaging import reconcile_unread_counts
+from ratings import reconcile_provider_ratings
+from search import create_search_indexes as create_search_index_tables
+
+BATCH_SIZE = 500
+
+def add_missing_columns():
+    """Add columns declared on the models that an older database lacks."""
+    added = 0
+    inspector = db.inspect(db.engine)
+    ddl = db.engine.dialect.ddl_compiler(db.engine.dialect, None)
+    for table in db.metadata.tables.values():
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                db.session.execute(db.text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {ddl.get_column_specification(column)}'
+                ))
+                added += 1
+    db.session.commit()
+    return f'{added} columns added'
+
+def migrate_provider_profiles():
+    """Copy legacy JSON service areas and specialties into the association tables."""
+    migrated = 0
+    last_id = 0
+    while True:
+        users = User.query.filter(User.id > last_id)\
+                          .filter((User.service_areas.isnot(None)) | (User.specialties.isnot(None)))\
+                          .order_by(User.id)\
+                          .limit(BATCH_SIZE)\
+                          .all()
+        if not users:
+            break
+
+        for user in users:
+            try:
+                if user.service_areas and not user.service_area_links:
+                    user.set_service_areas(json.loads(user.service_areas))
+                if user.specialties and not user.specialty_links:
+                    user.set_specialties(json.loads(user.specialties))
+                migrated += 1
+            except (TypeError, ValueError):
+                # Leave malformed legacy values for manual cleanup
+                continue
+
+        last_id = users[-1].id
+        db.session.commit()
+
+    return f'{migrated} provider profiles migrated'
+
+def geocode_locations():
+    """Geocode freight request origins/destinations and provider service areas through the gazetteer."""
+    geocoded = 0
+    last_id = 0
+    while True:
+        freight_requests = FreightRequest.query.filter(FreightRequest.id > last_id)\
+            .filter(FreightRequest.origin_latitude.is_(None) | FreightRequest.destination_latitude.is_(None))\
+            .order_by(FreightRequest.id)\
+            .limit(BATCH_SIZE)\
+            .all()
+        if not freight_requests:
+            break
+        
+        for freight_request in freight_requests:
+            freight_request.origin_latitude, freight_request.origin_longitude = geocode(freight_request.origin)
+            freight_request.destination_latitude, freight_request.destination_longitude = \
+                geocode(freight_request.destination)
+            geocoded += freight_request.origin_latitude is not None or freight_request.destination_latitude is not None
+        
+        last_id = freight_requests[-1].id
+        db.session.commit()
+    
+    # Areas saved before radii existed get the default radius
+    areas = 0
+    for area in ProviderServiceArea.query.filter(ProviderServiceArea.radius_km.is_(None)):
+        area.latitude, area.longitude = geocode(area.area)
+        area.radius_km = current_app.config['SERVICE_AREA_DEFAULT_RADIUS_KM']
+        areas += 1
+    db.session.commit()
+    
+    return f'{geocoded} freight requests and {areas} service areas geocoded'
+
+def create_missing_indexes():
+    """Create indexes declared on the models that an older database lacks."""
+    created = 0
+    existing = {}
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.tables.values():
+        if table.name not in existing:
+            existing[table.name] = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing[table.name]:
+                index.create(bind=db.engine)
+                created += 1
+    return f'{created} indexes created'
+
+def backfill_quote_counts():
+    """Populate FreightRequest.quote_count from the quotes table."""
+    return f'{reconcile_quote_counts()} freight requests updated'
+
+def backfill_unread_counts():
+    """Populate the per-user and per-conversation unread counters."""
+    return f'{reconcile_unread_counts()} unread counters updated'
+
+def backfill_rating_stats():
+    """Build the per-provider rating aggregates from existing ratings."""
+    return f'{reconcile_provider_ratings()} provider rating aggregates rebuilt'
+
+def create_search_indexes():
+    """Create and fill the full-text search indexes for existing tables."""
+    return f'{create_search_index_tables()} search indexes created'
+
+MIGRATIONS = [
+    add_missing_columns,
+    migrate_provider_profiles,
+    create_missing_indexes,
+    geocode_locations,
+    backfill_quote_counts,
+    backfill_unread_counts,
+    backfill_rating_stats,
+    create_search_indexes,
+]
+
+def run_migrations():
+    """Create missing tables, then apply each migration in order."""
+    db.create_all()
+    for migration in MIGRATIONS:
+        yield migration.__name__, migration()
@@ -1,5 +1,6 @@
 from datetime import datetime
 from extensions import db
+from geo import service_area_values
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,12 +13,57 @@ class User(db.Model):
     quotes_submitted = db.relationship('Quote', backref='provider', lazy=True)
     rating = db.Column(db.Float, default=0.0)
     total_ratings = db.Column(db.Integer, default=0)
-    service_areas = db.Column(db.String(500))  # JSON string of service areas
-    specialties = db.Column(db.String(500))  # JSON string of freight specialties
+    service_areas = db.Column(db.String(500))  # Legacy JSON string, superseded by ProviderServiceArea
+    specialties = db.Column(db.String(500))  # Legacy JSON string, superseded by ProviderSpecialty
+    service_area_links = db.relationship('ProviderServiceArea', backref='provider', lazy=True,
+                                         cascade='all, delete-orphan')
+    specialty_links = db.relationship('ProviderSpecialty', backref='provider', lazy=True,
+                                      cascade='all, delete-orphan')
     messages_sent = db.relationship('Message', backref='sender', lazy=True, foreign_keys='Message.sender_id')
     messages_received = db.relationship('Message', backref='recipient', lazy=True, foreign_keys='Message.recipient_id')
     unread_messages = db.Column(db.Integer, default=0)
 
+    @property
+    def service_area_list(self):
+        return [link.area for link in self.service_area_links]
+
+    @property
+    def specialty_list(self):
+        return [link.freight_type for link in self.specialty_links]
+
+    def set_service_areas(self, areas):
+        """Replace the provider's service areas, given as names or dicts. Raises ValueError."""
+        values = {}
+        for area in areas:
+            area = service_area_values(area)
+            values.setdefault(area['area'], area)
+        self.service_area_links = [ProviderServiceArea(**area) for area in values.values()]
+
+    def set_specialties(self, freight_types):
+        """Replace the provider's freight specialties."""
+        self.specialty_links = [ProviderSpecialty(freight_type=freight_type)
+                                for freight_type in dict.fromkeys(freight_types)]
+
+class ProviderServiceArea(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    area = db.Column(db.String(200), primary_key=True)  # Matches FreightRequest.origin/destination
+    latitude = db.Column(db.Float)  # Centre of the area; None if the name could not be geocoded
+    longitude = db.Column(db.Float)
+    radius_km = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_provider_service_area_area_user', 'area', 'user_id'),
+        db.Index('ix_provider_service_area_location', 'latitude', 'longitude'),
+    )
+
+class ProviderSpecialty(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    freight_type = db.Column(db.String(50), primary_key=True)  # road, air, sea, rail
+
+    __table_args__ = (
+        db.Index('ix_provider_specialty_type_user', 'freight_type', 'user_id'),
+    )
+
 class FreightRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -30,11 +76,30 @@ class FreightRequest(db.Model):
     deadline = db.Column(db.DateTime)
     status = db.Column(db.String(20))  # pending, quoted, in_progress, completed, cancelled
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    quotes = db.relationship('Quote', backref='freight_request', lazy=True)
+    quotes = db.relationship('Quote', backref='freight_request', lazy=True,
+                             foreign_keys='Quote.freight_request_id')
     selected_quote_id = db.Column(db.Integer, db.ForeignKey('quote.id'), nullable=True)
     urgency = db.Column(db.String(20))  # normal, urgent, very_urgent
     budget_range = db.Column(db.String(50))  # Optional budget range
+    quote_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Maintained by submit_quote
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped on every status change
+    # Geocoded from origin/destination through the gazetteer; None if the place is unknown
+    origin_latitude = db.Column(db.Float)
+    origin_longitude = db.Column(db.Float)
+    destination_latitude = db.Column(db.Float)
+    destination_longitude = db.Column(db.Float)
     messages = db.relationship('Message', backref='freight_request', lazy=True)
+    ratings = db.relationship('Rating', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_freight_request_user_created', 'user_id', 'created_at'),
+        db.Index('ix_freight_request_created', 'created_at'),
+        db.Index('ix_freight_request_status_type_created', 'status', 'freight_type', 'created_at'),
+        # Open backlog scanned by the matching index
+        db.Index('ix_freight_request_open', 'id',
+                 sqlite_where=db.text("status IN ('pending', 'quoted')"),
+                 postgresql_where=db.text("status IN ('pending', 'quoted')")),
+    )
 
 class Quote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -51,6 +116,28 @@ class Quote(db.Model):
     requests_selected = db.relationship('FreightRequest', backref='selected_quote', lazy=True,
                                       foreign_keys=[FreightRequest.selected_quote_id])
 
+    __table_args__ = (
+        db.Index('ix_quote_request_provider', 'freight_request_id', 'provider_id'),
+        db.Index('ix_quote_provider_created', 'provider_id', 'created_at'),
+        # "My quotes" filtered by status, newest first
+        db.Index('ix_quote_provider_status_created', 'provider_id', 'status', 'created_at'),
+        # Pending quotes past valid_until, walked by the expiry sweeper
+        db.Index('ix_quote_status_valid_until', 'status', 'valid_until'),
+    )
+
+class ProviderInbox(db.Model):
+    """Freight requests pushed to a provider by the matching fan-out, with their precomputed score."""
+    id = db.Column(db.Integer, primary_key=True)
+    provider_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    freight_request_id = db.Column(db.Integer, db.ForeignKey('freight_request.id'), nullable=False)
+    match_score = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('provider_id', 'freight_request_id', name='uq_provider_inbox_request'),
+        db.Index('ix_provider_inbox_feed', 'provider_id', 'match_score', 'created_at'),
+    )
+
 class Rating(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     freight_request_id = db.Column(db.Integer, db.ForeignKey('freight_request.id'), nullable=False)
@@ -60,6 +147,26 @@ class Rating(db.Model):
     review = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_rating_provider_created', 'provider_id', 'created_at'),
+        db.Index('ix_rating_request_shipper', 'freight_request_id', 'shipper_id'),
+    )
+
+class ProviderRatingStats(db.Model):
+    """Running rating aggregates per provider, updated in the same transaction as each rating."""
+    provider_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    count_1 = db.Column(db.Integer, nullable=False, default=0)
+    count_2 = db.Column(db.Integer, nullable=False, default=0)
+    count_3 = db.Column(db.Integer, nullable=False, default=0)
+    count_4 = db.Column(db.Integer, nullable=False, default=0)
+    count_5 = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def distribution(self):
+        return {i: getattr(self, f'count_{i}') for i in range(1, 6)}
+
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     freight_request_id = db.Column(db.Integer, db.ForeignKey('freight_request.id'), nullable=False)
@@ -68,8 +175,18 @@ class Conversation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
     messages = db.relationship('Message', backref='conversation', lazy=True)
+    shipper = db.relationship('User', foreign_keys=[shipper_id])
+    provider = db.relationship('User', foreign_keys=[provider_id])
     shipper_archived = db.Column(db.Boolean, default=False)
     provider_archived = db.Column(db.Boolean, default=False)
+    shipper_unread = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Unread messages for the shipper
+    provider_unread = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Unread messages for the provider
+
+    __table_args__ = (
+        db.Index('ix_conversation_shipper_last_message', 'shipper_id', 'last_message_at'),
+        db.Index('ix_conversation_provider_last_message', 'provider_id', 'last_message_at'),
+        db.Index('ix_conversation_request_parties', 'freight_request_id', 'shipper_id', 'provider_id'),
+    )
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -83,3 +200,41 @@ class Message(db.Model):
     message_type = db.Column(db.String(20))  # 'text', 'quote_update', 'status_update', etc.
     attachment_url = db.Column(db.String(500))  # For file attachments
     system_message = db.Column(db.Boolean, default=False)  # For automated system messages
+
+    __table_args__ = (
+        db.Index('ix_message_conversation_created', 'conversation_id', 'created_at'),
+        db.Index('ix_message_conversation_recipient_read', 'conversation_id', 'recipient_id', 'read_at'),
+        # Unread messages per recipient, the only rows unread counters look at
+        db.Index('ix_message_unread_recipient', 'recipient_id', 'conversation_id',
+                 sqlite_where=db.text('read_at IS NULL'),
+                 postgresql_where=db.text('read_at IS NULL')),
+    )
+
+class OutboxEvent(db.Model):
+    """Domain events waiting for their handlers; see events.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Not claimed before this
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Claims so far
+    handled = db.Column(db.Text, nullable=False, default='', server_default='')  # Handlers that already succeeded
+    last_error = db.Column(db.Text)
+    failed_at = db.Column(db.DateTime)  # Set when OUTBOX_MAX_ATTEMPTS ran out
+
+    __table_args__ = (
+        # Due events, walked oldest first by the drainers
+        db.Index('ix_outbox_event_due', 'available_at', 'id',
+                 sqlite_where=db.text('failed_at IS NULL'),
+                 postgresql_where=db.text('failed_at IS NULL')),
+    )
+
+class CacheGeneration(db.Model):
+    """Current generation of a response cache namespace, shared by all workers; see cache.py."""
+    key = db.Column(db.String(255), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False)
+
+class RevokedToken(db.Model):
+    """Access tokens revoked before their expiry; rows are dropped once the token expires."""
+    jti = db.Column(db.String(36), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
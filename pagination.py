@@ -0,0 +1,88 @@
+"""Keyset (cursor) pagination, offered next to Flask-SQLAlchemy's page numbers.
+
+Page-number pagination issues an OFFSET query plus a COUNT(*), both of which
+get slower the deeper the page. Keyset pagination seeks straight to the rows
+after an opaque cursor encoding the (sort value, id) of the last row seen,
+and only counts the total when the client asks for it.
+"""
+import base64
+import json
+from datetime import datetime
+from flask import request
+from sqlalchemy import and_, or_
+
+class InvalidCursor(ValueError):
+    pass
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.has_more = next_cursor is not None
+        self.total = total
+
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, datetime):
+        sort_value = {'dt': sort_value.isoformat()}
+    payload = json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(payload)
+        if isinstance(sort_value, dict):
+            sort_value = datetime.fromisoformat(sort_value['dt'])
+        return sort_value, int(row_id)
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('Invalid pagination cursor')
+
+def wants_keyset():
+    """Cursor mode is selected by passing `cursor` (empty for the first page)."""
+    return 'cursor' in request.args
+
+def keyset_paginate(query, sort_column, id_column, cursor, per_page, include_total=False):
+    """Return the page after `cursor`, newest first by (sort_column, id_column)."""
+    total = query.order_by(None).count() if include_total else None
+
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            sort_column < sort_value,
+            and_(sort_column == sort_value, id_column < row_id)
+        ))
+
+    rows = query.order_by(sort_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    items = rows[:per_page]
+
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+
+    return KeysetPage(items, next_cursor, total)
+
+def keyset_after(query, sort_column, id_column, cursor):
+    """Order oldest first by (sort_column, id_column) and skip to the rows after `cursor`. Raises InvalidCursor."""
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            sort_column > sort_value,
+            and_(sort_column == sort_value, id_column > row_id)
+        ))
+    return query.order_by(sort_column.asc(), id_column.asc())
+
+def keyset_request_args():
+    """Read cursor and include_total from the query string."""
+    return request.args.get('cursor', ''), request.args.get('include_total', 'false').lower() == 'true'
+
+def keyset_meta(page, per_page):
+    """Pagination block for cursor-mode responses."""
+    meta = {
+        'next_cursor': page.next_cursor,
+        'has_more': page.has_more,
+        'per_page': per_page
+    }
+    if page.total is not None:
+        meta['total_items'] = page.total
+    return meta
@@ -0,0 +1,106 @@
+"""Password hashing off the request threads.
+
+bcrypt is slow on purpose, so a burst of logins used to keep every request
+thread of a worker busy hashing. Hashes and checks now run on a bounded pool
+of PASSWORD_HASH_WORKERS processes at cost BCRYPT_LOG_ROUNDS. The pool is
+started on first use, so each server worker gets its own after forking. At
+most PASSWORD_HASH_MAX_PENDING jobs may wait for a process; beyond that
+`HasherBusy` is raised and the client should retry. With
+PASSWORD_HASH_WORKERS=0 hashing runs on the calling thread. Pool processes
+import the main module, as with any spawned process, so scripts that
+create the app must keep their work under `if __name__ == '__main__'`.
+
+Hashes made at another cost still verify, and `needs_rehash` tells the
+login route to upgrade them.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from flask import current_app
+
+# Worker processes start from a clean interpreter, not a copy of a threaded server
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check(password, hashed):
+    try:
+        return bcrypt.checkpw(password, hashed)
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+def _encode(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+def hash_rounds(hashed):
+    """The cost factor a bcrypt hash was made with, or None if it is not one."""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+class PasswordHasher:
+    def __init__(self, rounds, workers, max_pending):
+        self.rounds = rounds
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _pool(self):
+        with self._lock:
+            # A pool inherited from the parent of a forked worker is unusable
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context(START_METHOD)
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return self._pool().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, _encode(password), self.rounds)
+
+    def check(self, hashed, password):
+        return self._run(_check, _encode(password), _encode(hashed))
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+def hash_password(password):
+    return current_app.extensions['password_hasher'].hash(password)
+
+def check_password(hashed, password):
+    return current_app.extensions['password_hasher'].check(hashed, password)
+
+def needs_rehash(hashed):
+    return current_app.extensions['password_hasher'].needs_rehash(hashed)
+
+def init_passwords(app):
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config['BCRYPT_LOG_ROUNDS'], app.config['PASSWORD_HASH_WORKERS'],
+        app.config['PASSWORD_HASH_MAX_PENDING']
+    )
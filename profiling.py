@@ -0,0 +1,253 @@
+"""Per-request profiling, SQL accounting and a Prometheus metrics endpoint.
+
+With PROFILING_ENABLED set, every request records its wall time, the number
+of SQL statements and the time spent in them, the ORM objects loaded and
+the time spent encoding JSON. Totals are kept per endpoint (the URL rule,
+not the raw path) and exposed at `GET /api/metrics` in Prometheus text
+format, alongside cache and connection gauges that are always available.
+
+Requests slower than SLOW_REQUEST_MS are logged with their slowest
+statements and the most repeated one, which is usually the N+1.
+"""
+import threading
+import time
+from collections import Counter
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from extensions import db
+from serialization import JSONProvider
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestMetrics:
+    """Thread-safe per-endpoint totals and a latency histogram."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = Counter()
+        self._endpoints = {}
+
+    def observe(self, endpoint, method, status, profile, wall_time):
+        with self._lock:
+            self._requests[(endpoint, method, status)] += 1
+            totals = self._endpoints.setdefault((endpoint, method), {
+                'buckets': [0] * len(DURATION_BUCKETS), 'count': 0, 'duration': 0.0,
+                'statements': 0, 'db_time': 0.0, 'rows': 0, 'serialize_time': 0.0
+            })
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if wall_time <= bound:
+                    totals['buckets'][i] += 1
+            totals['count'] += 1
+            totals['duration'] += wall_time
+            totals['statements'] += profile.statements
+            totals['db_time'] += profile.db_time
+            totals['rows'] += profile.rows
+            totals['serialize_time'] += profile.serialize_time
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._requests), {
+                key: dict(totals, buckets=list(totals['buckets']))
+                for key, totals in self._endpoints.items()
+            }
+
+class RequestProfile:
+    """What one request cost; lives on flask.g while the request runs."""
+
+    def __init__(self, max_statements):
+        self.started_at = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.serialize_time = 0.0
+        self.max_statements = max_statements
+        self.sql = []
+
+    def add_statement(self, statement, duration):
+        self.statements += 1
+        self.db_time += duration
+        if len(self.sql) < self.max_statements:
+            self.sql.append((statement, duration))
+
+def _current_profile():
+    if has_request_context():
+        return g.get('profile')
+    return None
+
+class TimedJSONProvider(JSONProvider):
+    """Adds the time spent encoding response bodies to the request profile."""
+
+    def dumps(self, obj, **kwargs):
+        profile = _current_profile()
+        if profile is None:
+            return super().dumps(obj, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            profile.serialize_time += time.perf_counter() - started
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile() is not None:
+        conn.info.setdefault('profile_started_at', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile()
+    started = conn.info.get('profile_started_at')
+    if profile is not None and started:
+        profile.add_statement(statement, time.perf_counter() - started.pop())
+
+def _on_load(target, context):
+    profile = _current_profile()
+    if profile is not None:
+        profile.rows += 1
+
+def _endpoint_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def _log_slow_request(app, profile, wall_time, status):
+    slowest = sorted(profile.sql, key=lambda item: item[1], reverse=True)[:5]
+    repeated, times = Counter(statement for statement, _ in profile.sql).most_common(1)[0] \
+        if profile.sql else ('', 0)
+    lines = [
+        f'Slow request {request.method} {request.full_path} -> {status} in {wall_time * 1000:.1f}ms: '
+        f'{profile.statements} statements, {profile.db_time * 1000:.1f}ms in SQL, '
+        f'{profile.rows} objects loaded, {profile.serialize_time * 1000:.1f}ms serializing'
+    ]
+    lines += [f'  {duration * 1000:8.2f}ms  {statement}' for statement, duration in slowest]
+    if times > 1:
+        lines.append(f'  repeated {times}x: {repeated}')
+    app.logger.warning('\n'.join(lines))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+def render_metrics(app):
+    """Prometheus text exposition of everything the app tracks."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+
+    metrics = app.extensions.get('request_metrics')
+    if metrics is not None:
+        requests, endpoints = metrics.snapshot()
+        metric('freightconnect_requests_total', 'counter', 'Requests handled.', [
+            (_labels(endpoint=endpoint, method=method, status=status), count)
+            for (endpoint, method, status), count in sorted(requests.items())
+        ])
+
+        lines.append('# HELP freightconnect_request_duration_seconds Wall time per request.')
+        lines.append('# TYPE freightconnect_request_duration_seconds histogram')
+        for (endpoint, method), totals in sorted(endpoints.items()):
+            labels = dict(endpoint=endpoint, method=method)
+            for bound, count in zip(DURATION_BUCKETS, totals['buckets']):
+                lines.append(f'freightconnect_request_duration_seconds_bucket{_labels(**labels, le=bound)} {count}')
+            lines.append(f'freightconnect_request_duration_seconds_bucket{_labels(**labels, le="+Inf")} {totals["count"]}')
+            lines.append(f'freightconnect_request_duration_seconds_sum{_labels(**labels)} {totals["duration"]}')
+            lines.append(f'freightconnect_request_duration_seconds_count{_labels(**labels)} {totals["count"]}')
+
+        for name, key, help_text in (
+            ('freightconnect_db_statements_total', 'statements', 'SQL statements executed.'),
+            ('freightconnect_db_duration_seconds_total', 'db_time', 'Time spent executing SQL.'),
+            ('freightconnect_orm_objects_loaded_total', 'rows', 'ORM objects materialized from result rows.'),
+            ('freightconnect_serialization_seconds_total', 'serialize_time', 'Time spent encoding JSON responses.'),
+        ):
+            metric(name, 'counter', help_text, [
+                (_labels(endpoint=endpoint, method=method), totals[key])
+                for (endpoint, method), totals in sorted(endpoints.items())
+            ])
+
+    cache = app.extensions.get('response_cache')
+    if cache is not None:
+        metric('freightconnect_cache_events_total', 'counter', 'Response cache lookups and invalidations.', [
+            (_labels(group=group, outcome=outcome), count)
+            for group, counters in sorted(cache.stats().items())
+            for outcome, count in sorted(counters.items())
+        ])
+
+    periodic = app.extensions.get('periodic_tasks')
+    if periodic:
+        tasks = sorted(periodic.items())
+        metric('freightconnect_periodic_task_runs_total', 'counter', 'Runs of in-process periodic tasks.', [
+            (_labels(task=name), task.runs) for name, task in tasks
+        ])
+        metric('freightconnect_periodic_task_failures_total', 'counter', 'Periodic task runs that raised.', [
+            (_labels(task=name), task.failures) for name, task in tasks
+        ])
+        metric('freightconnect_periodic_task_items_total', 'counter', 'Items processed, e.g. quotes expired.', [
+            (_labels(task=name), task.items) for name, task in tasks
+        ])
+        metric('freightconnect_periodic_task_last_items', 'gauge', 'Items processed by the last run.', [
+            (_labels(task=name), task.last_result) for name, task in tasks
+        ])
+        metric('freightconnect_periodic_task_last_duration_seconds', 'gauge', 'Duration of the last run.', [
+            (_labels(task=name), task.last_duration) for name, task in tasks
+        ])
+
+    outbox = app.extensions.get('outbox')
+    if outbox is not None:
+        metric('freightconnect_outbox_batches_total', 'counter', 'Outbox batches drained in this process.', [
+            ('', outbox.batches)
+        ])
+        metric('freightconnect_outbox_events_handled_total', 'counter', 'Outbox events fully handled.', [
+            ('', outbox.handled)
+        ])
+        metric('freightconnect_outbox_failures_total', 'counter', 'Outbox events whose handlers raised.', [
+            ('', outbox.failures)
+        ])
+
+    broker = app.extensions.get('realtime_broker')
+    if broker is not None and hasattr(broker, 'connection_count'):
+        metric('freightconnect_stream_connections', 'gauge', 'Open event streams in this process.', [
+            ('', broker.connection_count())
+        ])
+
+    return '\n'.join(lines) + '\n'
+
+def init_profiling(app):
+    """Register /api/metrics and, when PROFILING_ENABLED is set, the request hooks.
+
+    Must run inside an application context so the engine can be instrumented.
+    """
+    @app.route('/api/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(render_metrics(current_app), mimetype='text/plain; version=0.0.4')
+
+    if not app.config['PROFILING_ENABLED']:
+        return
+
+    app.extensions['request_metrics'] = RequestMetrics()
+    timed_json = TimedJSONProvider(app)
+    timed_json.use_orjson = app.json.use_orjson
+    app.json = timed_json
+    event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(db.Model, 'load', _on_load, propagate=True)
+
+    @app.before_request
+    def start_profile():
+        g.profile = RequestProfile(app.config['PROFILING_MAX_STATEMENTS'])
+
+    @app.after_request
+    def record_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        wall_time = time.perf_counter() - profile.started_at
+        app.extensions['request_metrics'].observe(
+            _endpoint_label(), request.method, response.status_code, profile, wall_time
+        )
+        slow_ms = app.config['SLOW_REQUEST_MS']
+        if slow_ms and wall_time * 1000 >= slow_ms:
+            _log_slow_request(app, profile, wall_time, response.status_code)
+        response.headers['Server-Timing'] = (
+            f'db;dur={profile.db_time * 1000:.1f}, serialize;dur={profile.serialize_time * 1000:.1f}, '
+            f'total;dur={wall_time * 1000:.1f}'
+        )
+        return response
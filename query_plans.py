@@ -0,0 +1,54 @@
+"""Query plan regression checks for the statements the endpoints actually send.
+
+Rather than copies of the endpoint queries, which drift, the check records
+the SQL the real code issues. `record_statements` collects every statement
+sent through the engine while an endpoint or background job runs, and
+`full_scans` runs EXPLAIN QUERY PLAN (SQLite) on each one. It returns those
+that read a whole table. tests/test_query_plans.py drives every endpoint and
+job this way over a small seeded database, so a missing or unusable index
+fails the test run.
+"""
+from contextlib import contextmanager
+from sqlalchemy import event
+
+# Statements with a plan worth checking; inserts have none
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+@contextmanager
+def record_statements(engine):
+    """Collect {statement: parameters} for the statements sent through engine inside the block."""
+    statements = {}
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(EXPLAINED):
+            statements.setdefault(statement, parameters)
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+
+def explain(connection, statement, parameters):
+    """Return the SQLite query plan lines for a statement and its parameters."""
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    return [row[-1] for row in rows]
+
+def is_full_scan(line):
+    """A plain 'SCAN <table>' reads every row.
+
+    'SCAN ... USING INDEX' walks an index in order, and FTS5 tables are searched through their own index.
+    """
+    return line.startswith('SCAN ') and 'USING' not in line and 'VIRTUAL TABLE' not in line
+
+def full_scans(engine, statements):
+    """[(statement, plan lines)] for each recorded statement whose plan scans a whole table."""
+    if engine.dialect.name != 'sqlite':
+        raise RuntimeError('Query plan checks only run against SQLite')
+    scans = []
+    with engine.connect() as connection:
+        for statement, parameters in statements.items():
+            plan = explain(connection, statement, parameters)
+            if any(is_full_scan(line) for line in plan):
+                scans.append((statement, plan))
+    return scans
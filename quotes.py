@@ -1,19 +1,118 @@
-from flask import jsonify, request
+from flask import current_app, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import app, db, Quote, FreightRequest, User
+from extensions import db
+from models import Quote, FreightRequest
+from matching_engine import matching_index, OPEN_STATUSES
+from concurrency import run_with_retry
+from tasks import schedule
+from cache import invalidate
+from events import emit, handles, on_commit
+from serialization import InvalidFields, requested_fields, QUOTE_MINE, QUOTE_COMPARISON
+from identity import roles_required
+from bulk import BulkError, chunked, read_bulk_items, bulk_response
+from pagination import InvalidCursor, wants_keyset, keyset_paginate, keyset_request_args, keyset_meta
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.orm import contains_eager, joinedload
 from datetime import datetime, timedelta
+from collections import Counter
+
+QUOTE_VALIDITY = timedelta(hours=48)
+
+def quote_values(data):
+    """Validate a quote payload and return its column values. Raises ValueError."""
+    if not all(field in data for field in ['price', 'estimated_delivery_date']):
+        raise ValueError('Missing required fields')
+    try:
+        price = float(data['price'])
+    except (TypeError, ValueError):
+        raise ValueError('price must be a number')
+    try:
+        estimated_delivery_date = datetime.fromisoformat(data['estimated_delivery_date'])
+    except (TypeError, ValueError):
+        raise ValueError('estimated_delivery_date must be an ISO 8601 date')
+    try:
+        insurance_coverage = float(data.get('insurance_coverage', 0.0))
+    except (TypeError, ValueError):
+        raise ValueError('insurance_coverage must be a number')
+    
+    return {
+        'price': price,
+        'estimated_delivery_date': estimated_delivery_date,
+        'description': data.get('description', ''),
+        'status': 'pending',
+        'valid_until': datetime.utcnow() + QUOTE_VALIDITY,
+        'terms_conditions': data.get('terms_conditions', ''),
+        'insurance_coverage': insurance_coverage
+    }
+
+def bulk_request_id(data):
+    """The freight_request_id of a bulk item as an int, or None. CSV cells arrive as strings."""
+    request_id = data.get('freight_request_id')
+    if isinstance(request_id, str) and request_id.strip().isdigit():
+        return int(request_id)
+    if isinstance(request_id, int) and not isinstance(request_id, bool):
+        return request_id
+    return None
+
+def reconcile_quote_counts():
+    """Repair FreightRequest.quote_count drift. Returns the number of rows fixed."""
+    actual = select(func.count(Quote.id))\
+        .where(Quote.freight_request_id == FreightRequest.id)\
+        .scalar_subquery()
+    result = db.session.execute(
+        FreightRequest.__table__.update()
+        .where(FreightRequest.quote_count != actual)
+        .values(quote_count=actual)
+    )
+    db.session.commit()
+    return result.rowcount
+
+def expire_quotes(batch_size=None, now=None):
+    """Mark pending quotes past valid_until as expired, in chunks. Returns the number expired.
+
+    Each chunk is one indexed range read on (status, valid_until) and one
+    UPDATE guarded on status, so a quote accepted meanwhile is left alone.
+    """
+    batch_size = batch_size or current_app.config['QUOTE_SWEEP_BATCH_SIZE']
+    now = now or datetime.utcnow()
+    expired = 0
+    while True:
+        rows = db.session.execute(
+            select(Quote.id, Quote.freight_request_id)
+            .where(Quote.status == 'pending', Quote.valid_until < now)
+            .order_by(Quote.valid_until)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        
+        expired += Quote.query.filter(Quote.id.in_([row.id for row in rows]), Quote.status == 'pending')\
+                              .update({Quote.status: 'expired'}, synchronize_session=False)
+        db.session.commit()
+        invalidate(*{f'freight_request:{row.freight_request_id}' for row in rows})
+        
+        if len(rows) < batch_size:
+            break
+    return expired
+
+@handles('quote.accepted')
+def reject_other_quotes(payload):
+    request_id = payload['freight_request_id']
+    Quote.query.filter(Quote.freight_request_id == request_id, Quote.id != payload['quote_id'],
+                       Quote.status == 'pending')\
+               .update({Quote.status: 'rejected'}, synchronize_session=False)
+    on_commit(invalidate, f'freight_request:{request_id}')
 
 def init_quote_routes(app):
+    schedule(app, 'expire_quotes', expire_quotes, app.config['QUOTE_SWEEP_INTERVAL_SECONDS'])
+    
+
     @app.route('/api/quotes/<int:request_id>', methods=['POST'])
     @jwt_required()
+    @roles_required('provider', message='Only service providers can submit quotes')
     def submit_quote(request_id):
         current_user_id = get_jwt_identity()
         
-        # Verify user is a provider
-        provider = User.query.get(current_user_id)
-        if not provider or provider.user_type != 'provider':
-            return jsonify({'error': 'Only service providers can submit quotes'}), 403
-        
         # Check if freight request exists and is still open
         freight_request = FreightRequest.query.get(request_id)
         if not freight_request:
@@ -23,46 +122,203 @@ def init_quote_routes(app):
             
         data = request.get_json()
         
-        # Validate required fields
-        required_fields = ['price', 'estimated_delivery_date']
-        if not all(field in data for field in required_fields):
-            return jsonify({'error': 'Missing required fields'}), 400
-            
+        # Validate required fields; quotes are valid for 48 hours
         try:
-            # Set quote validity period (default 48 hours)
-            valid_until = datetime.utcnow() + timedelta(hours=48)
+            values = quote_values(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        valid_until = values['valid_until']
             
-            # Create new quote
-            new_quote = Quote(
-                freight_request_id=request_id,
-                provider_id=current_user_id,
-                price=data['price'],
-                estimated_delivery_date=datetime.fromisoformat(data['estimated_delivery_date']),
-                description=data.get('description', ''),
-                status='pending',
-                valid_until=valid_until,
-                terms_conditions=data.get('terms_conditions', ''),
-                insurance_coverage=data.get('insurance_coverage', 0.0)
-            )
+        def submit():
+            # Count the quote, and flip pending -> quoted, only while the request is still open.
+            # The UPDATE locks the row, so an accept committed meanwhile is never overwritten.
+            still_open = FreightRequest.query.filter(
+                FreightRequest.id == request_id, FreightRequest.status.in_(OPEN_STATUSES)
+            ).update({
+                FreightRequest.quote_count: FreightRequest.quote_count + 1,
+                FreightRequest.version: FreightRequest.version + case((FreightRequest.status == 'pending', 1), else_=0),
+                FreightRequest.status: case((FreightRequest.status == 'pending', 'quoted'), else_=FreightRequest.status)
+            }, synchronize_session=False)
+            if not still_open:
+                db.session.rollback()
+                return None
             
+            # Create new quote
+            new_quote = Quote(freight_request_id=request_id, provider_id=current_user_id, **values)
             db.session.add(new_quote)
-            
-            # Update freight request status if this is the first quote
-            if freight_request.status == 'pending':
-                freight_request.status = 'quoted'
-                
+            db.session.flush()
+            new_quote_id = new_quote.id
             db.session.commit()
+            return new_quote_id
+        
+        try:
+            new_quote_id = run_with_retry(submit)
+            if new_quote_id is None:
+                return jsonify({'error': 'Freight request is no longer accepting quotes'}), 409
+            
+            invalidate(f'freight_request:{request_id}')
             
             return jsonify({
                 'message': 'Quote submitted successfully',
-                'quote_id': new_quote.id,
-                'valid_until': valid_until.isoformat()
+                'quote_id': new_quote_id,
+                'valid_until': valid_until
             }), 201
             
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': 'Failed to submit quote', 'details': str(e)}), 500
 
+    @app.route('/api/quotes/bulk', methods=['POST'])
+    @jwt_required()
+    @roles_required('provider', message='Only service providers can submit quotes')
+    def submit_quotes_bulk():
+        current_user_id = get_jwt_identity()
+        
+        results = []
+        quoted_request_ids = []
+        try:
+            items = read_bulk_items('quotes', current_app.config['BULK_MAX_ITEMS'])
+            for chunk in chunked(enumerate(items), current_app.config['BULK_CHUNK_SIZE']):
+                request_ids = {bulk_request_id(data) for _, (data, error) in chunk if error is None}
+                statuses = dict(db.session.query(FreightRequest.id, FreightRequest.status)
+                                .filter(FreightRequest.id.in_(request_ids - {None})))
+                
+                rows, positions = [], []
+                for index, (data, error) in chunk:
+                    request_id = bulk_request_id(data) if error is None else None
+                    if error is None:
+                        if request_id is None:
+                            error = 'freight_request_id must be an integer'
+                        elif request_id not in statuses:
+                            error = 'Freight request not found'
+                        elif statuses[request_id] not in OPEN_STATUSES:
+                            error = 'Freight request is no longer accepting quotes'
+                    if error is None:
+                        try:
+                            rows.append(dict(quote_values(data), freight_request_id=request_id,
+                                             provider_id=current_user_id, created_at=datetime.utcnow()))
+                            positions.append(len(results))
+                        except ValueError as e:
+                            error = str(e)
+                    result = {'index': index, 'freight_request_id': request_id}
+                    result.update({'status': 'error', 'error': error} if error else {'status': 'created'})
+                    results.append(result)
+                
+                if not rows:
+                    continue
+                
+                # The same guarded UPDATE as submit_quote: count the quotes, and flip pending -> quoted,
+                # only on requests still open. Quotes for requests accepted meanwhile are dropped.
+                per_request = Counter(row['freight_request_id'] for row in rows)
+                still_open = set(db.session.scalars(
+                    update(FreightRequest)
+                    .where(FreightRequest.id.in_(per_request), FreightRequest.status.in_(OPEN_STATUSES))
+                    .values({
+                        FreightRequest.quote_count: FreightRequest.quote_count + case(per_request, value=FreightRequest.id),
+                        FreightRequest.version: FreightRequest.version + case((FreightRequest.status == 'pending', 1), else_=0),
+                        FreightRequest.status: case((FreightRequest.status == 'pending', 'quoted'), else_=FreightRequest.status)
+                    })
+                    .returning(FreightRequest.id)
+                    .execution_options(synchronize_session=False)
+                ))
+                kept = []
+                for position, row in zip(positions, rows):
+                    if row['freight_request_id'] in still_open:
+                        kept.append((position, row))
+                    else:
+                        results[position].update(status='error', error='Freight request is no longer accepting quotes')
+                if not kept:
+                    db.session.rollback()
+                    continue
+                
+                quote_ids = db.session.scalars(
+                    insert(Quote).returning(Quote.id, sort_by_parameter_order=True), [row for _, row in kept]
+                ).all()
+                db.session.commit()
+                
+                for (position, row), quote_id in zip(kept, quote_ids):
+                    results[position].update(quote_id=quote_id, valid_until=row['valid_until'])
+                quoted_request_ids.extend(still_open)
+        
+        except BulkError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            db.session.rollback()
+            if not quoted_request_ids:
+                return jsonify({'error': 'Failed to submit quotes', 'details': str(e)}), 500
+            # Earlier chunks are committed; report them and fail the rest
+            for result in results:
+                if result['status'] == 'created' and 'quote_id' not in result:
+                    result.update(status='error', error='Failed to submit quote')
+        
+        if quoted_request_ids:
+            invalidate(*[f'freight_request:{request_id}' for request_id in quoted_request_ids])
+        
+        return bulk_response(results)
+
+    @app.route('/api/quotes/mine', methods=['GET'])
+    @jwt_required()
+    @roles_required('provider', message='Only service providers can list their quotes')
+    def get_my_quotes():
+        current_user_id = get_jwt_identity()
+        
+        try:
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 20, type=int)
+            fields = requested_fields(QUOTE_MINE)
+            
+            # Quote, request and shipper in one joined query, driven by the provider's index
+            query = Quote.query.join(Quote.freight_request).join(FreightRequest.user)\
+                .options(contains_eager(Quote.freight_request).contains_eager(FreightRequest.user))\
+                .filter(Quote.provider_id == current_user_id)
+            
+            status = request.args.get('status')
+            if status:
+                query = query.filter(Quote.status == status)
+            
+            freight_type = request.args.get('freight_type')
+            if freight_type:
+                query = query.filter(FreightRequest.freight_type == freight_type)
+            
+            # Date range on when the quote was submitted
+            try:
+                created_from = request.args.get('created_from')
+                if created_from:
+                    query = query.filter(Quote.created_at >= datetime.fromisoformat(created_from))
+                created_to = request.args.get('created_to')
+                if created_to:
+                    query = query.filter(Quote.created_at < datetime.fromisoformat(created_to))
+            except ValueError:
+                return jsonify({'error': 'created_from and created_to must be ISO 8601 dates'}), 400
+            
+            if wants_keyset():
+                cursor, include_total = keyset_request_args()
+                pagination = keyset_paginate(query, Quote.created_at, Quote.id,
+                                             cursor, per_page, include_total)
+            else:
+                pagination = query.order_by(Quote.created_at.desc(), Quote.id.desc())\
+                    .paginate(page=page, per_page=per_page, error_out=False)
+            
+            quotes = QUOTE_MINE.dump_many(pagination.items, fields=fields)
+            
+            if wants_keyset():
+                return jsonify({'quotes': quotes, 'pagination': keyset_meta(pagination, per_page)}), 200
+            
+            return jsonify({
+                'quotes': quotes,
+                'pagination': {
+                    'total_items': pagination.total,
+                    'total_pages': pagination.pages,
+                    'current_page': page,
+                    'per_page': per_page
+                }
+            }), 200
+            
+        except (InvalidCursor, InvalidFields) as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': 'Failed to fetch quotes', 'details': str(e)}), 500
+
     @app.route('/api/quotes/<int:request_id>', methods=['GET'])
     @jwt_required()
     def get_quotes(request_id):
@@ -72,30 +328,28 @@ def init_quote_routes(app):
         freight_request = FreightRequest.query.get(request_id)
         if not freight_request:
             return jsonify({'error': 'Freight request not found'}), 404
+        
+        # All quotes with their providers in one query; it also tells us whether
+        # the caller quoted this request, so there is no separate probe
+        quotes = Quote.query.filter_by(freight_request_id=request_id)\
+            .options(joinedload(Quote.provider)).all()
             
         # Verify user is either the shipper or a provider who submitted a quote
-        if (freight_request.user_id != current_user_id and 
-            not Quote.query.filter_by(freight_request_id=request_id, provider_id=current_user_id).first()):
+        if (freight_request.user_id != current_user_id and
+                not any(quote.provider_id == current_user_id for quote in quotes)):
             return jsonify({'error': 'Not authorized to view these quotes'}), 403
             
         try:
-            quotes = Quote.query.filter_by(freight_request_id=request_id).all()
+            fields = requested_fields(QUOTE_COMPARISON)
             
-            return jsonify({
-                'quotes': [{
-                    'id': quote.id,
-                    'provider_id': quote.provider_id,
-                    'provider_name': quote.provider.company_name,
-                    'provider_rating': quote.provider.rating,
-                    'price': quote.price,
-                    'estimated_delivery_date': quote.estimated_delivery_date.isoformat(),
-                    'description': quote.description,
-                    'status': quote.status,
-                    'valid_until': quote.valid_until.isoformat(),
-                    'insurance_coverage': quote.insurance_coverage
-                } for quote in quotes]
-            }), 200
+            # Expired quotes can no longer be accepted; hide them unless asked for
+            if request.args.get('include_expired', 'false').lower() != 'true':
+                quotes = [quote for quote in quotes if quote.status != 'expired']
             
+            return jsonify({'quotes': QUOTE_COMPARISON.dump_many(quotes, fields=fields)}), 200
+            
+        except InvalidFields as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': 'Failed to fetch quotes', 'details': str(e)}), 500
 
@@ -103,43 +357,71 @@ def init_quote_routes(app):
     @jwt_required()
     def accept_quote(quote_id):
         current_user_id = get_jwt_identity()
+        # Optional optimistic check against the version the shipper last saw
+        expected_version = (request.get_json(silent=True) or {}).get('expected_version')
+        if expected_version is not None and (not isinstance(expected_version, int) or isinstance(expected_version, bool)):
+            return jsonify({'error': 'expected_version must be an integer'}), 400
         
-        # Get the quote
-        quote = Quote.query.get(quote_id)
-        if not quote:
-            return jsonify({'error': 'Quote not found'}), 404
+        def accept():
+            # Get the quote
+            quote = db.session.get(Quote, quote_id)
+            if not quote:
+                return jsonify({'error': 'Quote not found'}), 404
+                
+            # Get the freight request
+            freight_request = db.session.get(FreightRequest, quote.freight_request_id)
+            request_id = freight_request.id
             
-        # Get the freight request
-        freight_request = FreightRequest.query.get(quote.freight_request_id)
-        
-        # Verify user is the shipper
-        if freight_request.user_id != current_user_id:
-            return jsonify({'error': 'Only the shipper can accept quotes'}), 403
+            # Verify user is the shipper
+            if freight_request.user_id != current_user_id:
+                return jsonify({'error': 'Only the shipper can accept quotes'}), 403
             
-        # Verify quote is still valid
-        if quote.valid_until < datetime.utcnow():
-            return jsonify({'error': 'Quote has expired'}), 400
+            if expected_version is not None and expected_version != freight_request.version:
+                return jsonify({'error': 'Freight request has changed', 'version': freight_request.version}), 409
+                
+            # Verify quote is still valid
+            if quote.valid_until < datetime.utcnow():
+                return jsonify({'error': 'Quote has expired'}), 400
             
-        try:
-            # Update quote status
-            quote.status = 'accepted'
+            # Compare-and-set: only one accept can move the request out of the open states,
+            # and only from the version the shipper saw if they sent one
+            expected = [FreightRequest.id == request_id, FreightRequest.status.in_(OPEN_STATUSES)]
+            if expected_version is not None:
+                expected.append(FreightRequest.version == expected_version)
+            claimed = FreightRequest.query.filter(*expected).update({
+                FreightRequest.status: 'in_progress',
+                FreightRequest.selected_quote_id: quote_id,
+                FreightRequest.version: FreightRequest.version + 1
+            }, synchronize_session=False)
+            if not claimed:
+                db.session.rollback()
+                # Still open means the version check is what failed
+                current = db.session.get(FreightRequest, request_id)
+                if current.status in OPEN_STATUSES:
+                    return jsonify({'error': 'Freight request has changed', 'version': current.version}), 409
+                return jsonify({'error': 'Freight request is no longer accepting quotes'}), 409
             
-            # Update freight request
-            freight_request.status = 'in_progress'
-            freight_request.selected_quote_id = quote.id
+            accepted = Quote.query.filter(Quote.id == quote_id, Quote.status == 'pending')\
+                                  .update({Quote.status: 'accepted'}, synchronize_session=False)
+            if not accepted:
+                db.session.rollback()
+                return jsonify({'error': 'Quote is no longer pending'}), 409
             
-            # Reject all other quotes
-            Quote.query.filter_by(freight_request_id=freight_request.id)\
-                      .filter(Quote.id != quote_id)\
-                      .update({'status': 'rejected'})
+            # The other open quotes are rejected from the outbox
+            emit('quote.accepted', freight_request_id=request_id, quote_id=quote_id)
             
             db.session.commit()
             
+            matching_index.remove(request_id)
+            invalidate(f'freight_request:{request_id}')
+            
             return jsonify({
                 'message': 'Quote accepted successfully',
                 'freight_request_status': 'in_progress'
             }), 200
-            
+        
+        try:
+            return run_with_retry(accept)
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': 'Failed to accept quote', 'details': str(e)}), 500
@@ -0,0 +1,60 @@
+"""Token buckets that turn away floods before any expensive work is done.
+
+Each key, such as a client IP or an e-mail address, gets a bucket of up to
+`burst` tokens that refills at `per_minute` tokens a minute. A request takes
+one token, or gets a 429 with a Retry-After header when the bucket is empty.
+Limits are configured in pairs, e.g. LOGIN_RATE_IP_BURST and
+LOGIN_RATE_IP_PER_MINUTE, and either one set to 0 disables that bucket.
+
+Buckets live in this process, like the memory cache backend, so with N
+workers a client can get up to N times the configured rate. The least
+recently used buckets are dropped beyond RATE_LIMIT_MAX_KEYS.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, jsonify
+
+class TokenBuckets:
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    def take(self, key, burst, per_minute):
+        """Take a token from key's bucket. Returns 0 if allowed, else seconds until the next token."""
+        if not burst or not per_minute:
+            return 0.0
+        rate = per_minute / 60.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+def throttle(*limits):
+    """Take a token for each (key, config prefix) pair; returns a 429 response if any bucket is empty, else None."""
+    buckets = current_app.extensions['rate_limiter']
+    for key, prefix in limits:
+        wait = buckets.take(
+            f'{prefix}:{key}', current_app.config[f'{prefix}_BURST'], current_app.config[f'{prefix}_PER_MINUTE']
+        )
+        if wait:
+            response = jsonify({'error': 'Too many attempts, try again later'})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(math.ceil(wait))
+            return response
+    return None
+
+def init_rate_limit(app):
+    app.extensions['rate_limiter'] = TokenBuckets(app.config['RATE_LIMIT_MAX_KEYS'])
@@ -1,30 +1,82 @@
 from flask import jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import app, db, Rating, FreightRequest, User, Quote
-from sqlalchemy import func
+from extensions import db
+from models import Rating, FreightRequest, User, Quote, ProviderRatingStats
+from sqlalchemy import func, case, insert, select
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
+from cache import cached, invalidate
+from events import emit, handles, on_commit
+from pagination import InvalidCursor, wants_keyset, keyset_paginate, keyset_request_args, keyset_meta
+from serialization import InvalidFields, requested_fields, RATING, RATING_DETAIL, FREIGHT_REQUEST_RATED
 
-def update_provider_rating(provider_id):
-    """Update the provider's average rating."""
-    try:
-        # Calculate new average rating
-        avg_rating = db.session.query(func.avg(Rating.rating))\
-            .filter(Rating.provider_id == provider_id)\
-            .scalar() or 0.0
-        
-        # Count total ratings
-        total_ratings = Rating.query.filter_by(provider_id=provider_id).count()
-        
-        # Update provider
-        provider = User.query.get(provider_id)
-        provider.rating = float(avg_rating)
-        provider.total_ratings = total_ratings
-        db.session.commit()
-        
-        return True
-    except Exception:
-        db.session.rollback()
-        return False
+def _sync_provider_averages(*criteria):
+    """Copy the aggregates onto User.rating/total_ratings with a single UPDATE."""
+    stats = ProviderRatingStats.__table__
+    rating_count = select(stats.c.rating_count)\
+        .where(stats.c.provider_id == User.id).scalar_subquery()
+    rating_sum = select(stats.c.rating_sum)\
+        .where(stats.c.provider_id == User.id).scalar_subquery()
+    db.session.execute(
+        User.__table__.update()
+        .where(*criteria)
+        .values(
+            total_ratings=func.coalesce(rating_count, 0),
+            rating=func.coalesce(rating_sum * 1.0 / func.nullif(rating_count, 0), 0.0)
+        )
+    )
+
+def update_provider_rating(provider_id, rating_value):
+    """Fold a new rating into the provider's aggregates within the current transaction."""
+    stats = ProviderRatingStats.__table__
+    bucket = stats.c[f'count_{rating_value}']
+    increment = {
+        stats.c.rating_sum: stats.c.rating_sum + rating_value,
+        stats.c.rating_count: stats.c.rating_count + 1,
+        bucket: bucket + 1
+    }
+    
+    updated = db.session.execute(
+        stats.update().where(stats.c.provider_id == provider_id).values(increment)
+    ).rowcount
+    
+    if not updated:
+        # First rating for this provider; a concurrent first rating may win the insert
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(stats).values(
+                    provider_id=provider_id, rating_sum=rating_value, rating_count=1,
+                    **{f'count_{i}': int(i == rating_value) for i in range(1, 6)}
+                ))
+        except IntegrityError:
+            db.session.execute(
+                stats.update().where(stats.c.provider_id == provider_id).values(increment)
+            )
+    
+    _sync_provider_averages(User.id == provider_id)
+
+@handles('rating.submitted')
+def fold_submitted_rating(payload):
+    provider_id = payload['provider_id']
+    update_provider_rating(provider_id, payload['rating'])
+    on_commit(invalidate, f'provider_ratings:{provider_id}', f'user:{provider_id}')
+
+def reconcile_provider_ratings():
+    """Rebuild every provider's aggregates from the ratings table. Returns providers rebuilt."""
+    stats = ProviderRatingStats.__table__
+    db.session.execute(stats.delete())
+    result = db.session.execute(insert(stats).from_select(
+        ['provider_id', 'rating_sum', 'rating_count', 'count_1', 'count_2', 'count_3', 'count_4', 'count_5'],
+        select(
+            Rating.provider_id,
+            func.sum(Rating.rating),
+            func.count(Rating.id),
+            *[func.sum(case((Rating.rating == i, 1), else_=0)) for i in range(1, 6)]
+        ).group_by(Rating.provider_id)
+    ))
+    _sync_provider_averages(User.user_type == 'provider')
+    db.session.commit()
+    return result.rowcount
 
 def init_rating_routes(app):
     @app.route('/api/ratings/<int:request_id>', methods=['POST'])
@@ -80,11 +132,13 @@ def init_rating_routes(app):
             )
             
             db.session.add(new_rating)
+            
+            # The provider's aggregates follow from the outbox
+            emit('rating.submitted', provider_id=provider_id, rating=rating_value)
+            
             db.session.commit()
             
-            # Update provider's average rating
-            if not update_provider_rating(provider_id):
-                return jsonify({'error': 'Failed to update provider rating'}), 500
+            invalidate(f'provider_ratings:{provider_id}', f'user:{provider_id}')
             
             return jsonify({
                 'message': 'Rating submitted successfully',
@@ -97,6 +151,7 @@ def init_rating_routes(app):
 
     @app.route('/api/ratings/provider/<int:provider_id>', methods=['GET'])
     @jwt_required()
+    @cached(lambda provider_id: f'provider_ratings:{provider_id}')
     def get_provider_ratings(provider_id):
         try:
             # Verify provider exists
@@ -108,6 +163,7 @@ def init_rating_routes(app):
             page = request.args.get('page', 1, type=int)
             per_page = request.args.get('per_page', 10, type=int)
             min_rating = request.args.get('min_rating', type=int)
+            fields = requested_fields(RATING)
             
             # Base query
             query = Rating.query.filter_by(provider_id=provider_id)
@@ -116,9 +172,22 @@ def init_rating_routes(app):
             if min_rating:
                 query = query.filter(Rating.rating >= min_rating)
             
-            # Get paginated results
-            ratings = query.order_by(Rating.created_at.desc())\
-                         .paginate(page=page, per_page=per_page, error_out=False)
+            if wants_keyset():
+                # Cursor mode: newest first by (created_at, id)
+                cursor, include_total = keyset_request_args()
+                ratings = keyset_paginate(query, Rating.created_at, Rating.id,
+                                          cursor, per_page, include_total)
+                pagination_info = keyset_meta(ratings, per_page)
+            else:
+                # Get paginated results
+                ratings = query.order_by(Rating.created_at.desc())\
+                             .paginate(page=page, per_page=per_page, error_out=False)
+                pagination_info = {
+                    'total_items': ratings.total,
+                    'total_pages': ratings.pages,
+                    'current_page': ratings.page,
+                    'per_page': per_page
+                }
             
             return jsonify({
                 'provider': {
@@ -127,25 +196,17 @@ def init_rating_routes(app):
                     'average_rating': provider.rating,
                     'total_ratings': provider.total_ratings
                 },
-                'ratings': [{
-                    'id': rating.id,
-                    'rating': rating.rating,
-                    'review': rating.review,
-                    'created_at': rating.created_at.isoformat(),
-                    'freight_request_id': rating.freight_request_id
-                } for rating in ratings.items],
-                'pagination': {
-                    'total_items': ratings.total,
-                    'total_pages': ratings.pages,
-                    'current_page': ratings.page,
-                    'per_page': per_page
-                }
+                'ratings': RATING.dump_many(ratings.items, fields=fields),
+                'pagination': pagination_info
             }), 200
             
+        except (InvalidCursor, InvalidFields) as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': 'Failed to fetch ratings', 'details': str(e)}), 500
 
     @app.route('/api/ratings/stats/provider/<int:provider_id>', methods=['GET'])
+    @cached(lambda provider_id: f'provider_ratings:{provider_id}')
     def get_provider_rating_stats(provider_id):
         try:
             # Verify provider exists
@@ -153,18 +214,9 @@ def init_rating_routes(app):
             if not provider or provider.user_type != 'provider':
                 return jsonify({'error': 'Provider not found'}), 404
             
-            # Get rating distribution
-            rating_distribution = db.session.query(
-                Rating.rating,
-                func.count(Rating.id).label('count')
-            ).filter_by(provider_id=provider_id)\
-             .group_by(Rating.rating)\
-             .all()
-            
-            # Convert to dictionary
-            distribution = {i: 0 for i in range(1, 6)}  # Initialize all ratings to 0
-            for rating, count in rating_distribution:
-                distribution[rating] = count
+            # Rating distribution from the stored histogram
+            stats = db.session.get(ProviderRatingStats, provider_id)
+            distribution = stats.distribution if stats else {i: 0 for i in range(1, 6)}
             
             # Calculate rating percentages
             total_ratings = sum(distribution.values())
@@ -199,19 +251,8 @@ def init_rating_routes(app):
             freight_request = FreightRequest.query.get(rating.freight_request_id)
             
             return jsonify({
-                'rating': {
-                    'id': rating.id,
-                    'rating': rating.rating,
-                    'review': rating.review,
-                    'created_at': rating.created_at.isoformat(),
-                },
-                'freight_request': {
-                    'id': freight_request.id,
-                    'freight_type': freight_request.freight_type,
-                    'origin': freight_request.origin,
-                    'destination': freight_request.destination,
-                    'completed_at': freight_request.created_at.isoformat()
-                },
+                'rating': RATING_DETAIL.dump(rating),
+                'freight_request': FREIGHT_REQUEST_RATED.dump(freight_request),
                 'provider': {
                     'id': rating.provider_id,
                     'company_name': User.query.get(rating.provider_id).company_name
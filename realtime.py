@@ -0,0 +1,126 @@
+"""Server-push delivery of messaging events over Server-Sent Events.
+
+Clients keep one `GET /api/conversations/stream` connection open instead of
+polling conversations. The messaging routes publish new messages and unread
+count deltas to the recipient's channel through a broker. The built-in
+broker is in-process; any object implementing `Broker` can be registered
+under `app.extensions['realtime_broker']` to fan out across workers.
+
+Each open stream waits on a queue for its next event. Under the gevent
+workers configured in gunicorn.conf.py that wait is a parked greenlet, so
+one process holds thousands of idle streams; the development server gives
+each stream a thread.
+"""
+import queue
+import threading
+from flask import Response, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from serialization import dumps
+
+class Broker:
+    """Pub/sub interface used by the messaging routes."""
+
+    def subscribe(self, channel):
+        """Return a Subscription receiving events published to channel."""
+        raise NotImplementedError
+
+    def publish(self, channel, event_type, data):
+        raise NotImplementedError
+
+class Subscription:
+    def __init__(self, broker, channel, max_size):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=max_size)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Slow consumer: drop the oldest event rather than block publishers
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(event)
+
+    def get(self, timeout):
+        """Next event, or None if nothing arrived within timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class InProcessBroker(Broker):
+    """Delivers events to subscribers connected to this process."""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, event_type, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put((event_type, data))
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+def publish_to_user(user_id, event_type, data):
+    """Push an event to every open stream of a user."""
+    current_app.extensions['realtime_broker'].publish(user_channel(user_id), event_type, data)
+
+def format_event(event_type, data):
+    return f'event: {event_type}\ndata: {dumps(data)}\n\n'
+
+def init_realtime_routes(app):
+    app.extensions.setdefault('realtime_broker', InProcessBroker(app.config['REALTIME_QUEUE_SIZE']))
+
+    @app.route('/api/conversations/stream', methods=['GET'])
+    @jwt_required(locations=['headers', 'query_string'])  # EventSource cannot set headers
+    def stream_events():
+        current_user_id = get_jwt_identity()
+        broker = current_app.extensions['realtime_broker']
+        heartbeat = current_app.config['REALTIME_HEARTBEAT_SECONDS']
+        subscription = broker.subscribe(user_channel(current_user_id))
+
+        def events():
+            try:
+                yield format_event('ready', {'user_id': current_user_id})
+                while True:
+                    event = subscription.get(timeout=heartbeat)
+                    if event is None:
+                        # Comment line keeps proxies from timing out and detects closed clients
+                        yield ': keep-alive\n\n'
+                    else:
+                        yield format_event(*event)
+            finally:
+                subscription.close()
+
+        return Response(events(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
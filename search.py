@@ -0,0 +1,219 @@
+"""Full-text search over freight requests and messages.
+
+On SQLite each searchable table gets an external-content FTS5 table
+(`freight_request_fts`, `message_fts`) kept in sync by triggers, so every
+insert, update and delete, including bulk inserts that bypass the ORM, is
+indexed in the same transaction. The update triggers only fire when a
+searched column changes, not on status or counter updates. On Postgres a
+GIN index over a weighted tsvector expression does the same job without
+extra tables.
+
+The DDL runs whenever `db.create_all()` creates the tables; existing
+databases get it from `flask --app app migrate-db`.
+"""
+import re
+from flask import current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import event, func, literal_column, or_, table, column
+from sqlalchemy.orm import selectinload
+from extensions import db
+from models import FreightRequest, Message, Conversation
+from serialization import InvalidFields, requested_fields, FREIGHT_REQUEST_SEARCH, MESSAGE_SEARCH
+from identity import current_role
+
+TEXT_SEARCH_CONFIG = 'english'
+MAX_TERMS = 16
+
+# Searched columns per table with their Postgres weight; A ranks above B
+SEARCH_COLUMNS = {
+    'freight_request': (('cargo_details', 'B'), ('origin', 'A'), ('destination', 'A')),
+    'message': (('content', 'B'),),
+}
+BM25_WEIGHTS = {'A': 2.0, 'B': 1.0}
+
+TERM = re.compile(r'[^\W_]+\*?')
+
+def search_terms(text):
+    """Split a query into words; a trailing * makes a word a prefix match."""
+    return TERM.findall(text or '')[:MAX_TERMS]
+
+def _tsvector_sql(table_name):
+    return ' || '.join(
+        f"setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce({name}, '')), '{weight}')"
+        for name, weight in SEARCH_COLUMNS[table_name]
+    )
+
+def _sqlite_ddl(table_name):
+    fts = f'{table_name}_fts'
+    names = [name for name, _ in SEARCH_COLUMNS[table_name]]
+    columns = ', '.join(names)
+    new_values = ', '.join(f'new.{name}' for name in names)
+    old_values = ', '.join(f'old.{name}' for name in names)
+    insert_new = f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values});'
+    delete_old = f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, "
+        f"content='{table_name}', content_rowid='id', tokenize='porter unicode61')",
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table_name} BEGIN {insert_new} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table_name} BEGIN {delete_old} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columns} ON {table_name} '
+        f'BEGIN {delete_old} {insert_new} END',
+    ]
+
+def create_search_index(connection, table_name):
+    """Create the search index for one table if missing. Returns True if it was created."""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        fts = f'{table_name}_fts'
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ).first()
+        for statement in _sqlite_ddl(table_name):
+            connection.exec_driver_sql(statement)
+        if not exists:
+            # Index the rows that were there before the FTS table
+            connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        return not exists
+    if dialect == 'postgresql':
+        index = f'ix_{table_name}_search'
+        exists = connection.exec_driver_sql(f"SELECT to_regclass('{index}')").scalar()
+        connection.exec_driver_sql(
+            f'CREATE INDEX IF NOT EXISTS {index} ON {table_name} USING gin (({_tsvector_sql(table_name)}))'
+        )
+        return exists is None
+    return False
+
+def create_search_indexes():
+    """Create missing search indexes on an existing database. Returns how many were created."""
+    with db.engine.begin() as connection:
+        return sum(create_search_index(connection, table_name) for table_name in SEARCH_COLUMNS)
+
+def rebuild_search_indexes():
+    """Re-index every row; only SQLite keeps a separate copy that can drift."""
+    if db.engine.dialect.name != 'sqlite':
+        return 0
+    with db.engine.begin() as connection:
+        for table_name in SEARCH_COLUMNS:
+            fts = f'{table_name}_fts'
+            connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    return len(SEARCH_COLUMNS)
+
+def _after_create(target, connection, **kw):
+    create_search_index(connection, target.name)
+
+def _before_drop(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql(f'DROP TABLE IF EXISTS {target.name}_fts')
+
+for _table in (FreightRequest.__table__, Message.__table__):
+    event.listen(_table, 'after_create', _after_create)
+    event.listen(_table, 'before_drop', _before_drop)
+
+def full_text_match(query, model, terms):
+    """Filter a query on `model` to rows matching every term; returns (query, rank order)."""
+    table_name = model.__table__.name
+    if db.engine.dialect.name == 'postgresql':
+        vector = literal_column(_tsvector_sql(table_name))
+        tsquery = func.to_tsquery(TEXT_SEARCH_CONFIG, ' & '.join(
+            term.rstrip('*') + (':*' if term.endswith('*') else '') for term in terms
+        ))
+        return query.filter(vector.op('@@')(tsquery)), func.ts_rank(vector, tsquery).desc()
+
+    fts = f'{table_name}_fts'
+    match = ' '.join(f'"{term.rstrip("*")}"' + ('*' if term.endswith('*') else '') for term in terms)
+    weights = ', '.join(str(BM25_WEIGHTS[weight]) for _, weight in SEARCH_COLUMNS[table_name])
+    query = query.join(table(fts, column('rowid')), literal_column(f'{fts}.rowid') == model.id)\
+                 .filter(literal_column(fts).match(match))
+    # bm25() is lower for better matches
+    return query, literal_column(f'bm25({fts}, {weights})')
+
+def _search_page_args():
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', 20, type=int)
+    return page, min(max(per_page, 1), current_app.config['SEARCH_MAX_PER_PAGE'])
+
+def _ranked_page(query, rank, tiebreak, page, per_page):
+    """Fetch one page in rank order; one extra row tells us if there is a next page."""
+    rows = query.order_by(rank, tiebreak).offset((page - 1) * per_page).limit(per_page + 1).all()
+    return rows[:per_page], {'current_page': page, 'per_page': per_page, 'has_more': len(rows) > per_page}
+
+def init_search_routes(app):
+    @app.route('/api/search/freight-requests', methods=['GET'])
+    @jwt_required()
+    def search_freight_requests():
+        current_user_id = get_jwt_identity()
+        role = current_role()
+
+        if not role:
+            return jsonify({'error': 'User not found'}), 404
+
+        terms = search_terms(request.args.get('q'))
+        if not terms:
+            return jsonify({'error': 'q is required'}), 400
+
+        try:
+            page, per_page = _search_page_args()
+            fields = requested_fields(FREIGHT_REQUEST_SEARCH)
+            query, rank = full_text_match(FreightRequest.query, FreightRequest, terms)
+
+            # Same visibility as the request details: shippers only find their own requests
+            if role == 'shipper':
+                query = query.filter(FreightRequest.user_id == current_user_id)
+
+            status = request.args.get('status')
+            if status:
+                query = query.filter(FreightRequest.status == status)
+
+            freight_type = request.args.get('freight_type')
+            if freight_type:
+                query = query.filter(FreightRequest.freight_type == freight_type)
+
+            freight_requests, pagination = _ranked_page(query, rank, FreightRequest.created_at.desc(),
+                                                        page, per_page)
+
+            return jsonify({
+                'freight_requests': FREIGHT_REQUEST_SEARCH.dump_many(freight_requests, fields=fields),
+                'pagination': pagination
+            }), 200
+
+        except InvalidFields as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': 'Failed to search freight requests', 'details': str(e)}), 500
+
+    @app.route('/api/search/messages', methods=['GET'])
+    @jwt_required()
+    def search_messages():
+        current_user_id = get_jwt_identity()
+
+        terms = search_terms(request.args.get('q'))
+        if not terms:
+            return jsonify({'error': 'q is required'}), 400
+
+        try:
+            page, per_page = _search_page_args()
+            fields = requested_fields(MESSAGE_SEARCH)
+            query, rank = full_text_match(
+                Message.query.options(selectinload(Message.sender)), Message, terms
+            )
+
+            # Same visibility as get_messages: only conversations the user is part of
+            query = query.join(Conversation, Conversation.id == Message.conversation_id)\
+                         .filter(or_(Conversation.shipper_id == current_user_id,
+                                     Conversation.provider_id == current_user_id))
+
+            conversation_id = request.args.get('conversation_id', type=int)
+            if conversation_id:
+                query = query.filter(Message.conversation_id == conversation_id)
+
+            messages, pagination = _ranked_page(query, rank, Message.created_at.desc(), page, per_page)
+
+            return jsonify({
+                'messages': MESSAGE_SEARCH.dump_many(messages, fields=fields),
+                'pagination': pagination
+            }), 200
+
+        except InvalidFields as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': 'Failed to search messages', 'details': str(e)}), 500
@@ -0,0 +1,243 @@
+"""Response schemas and the JSON encoder.
+
+Payloads are declared once per model as a `Schema` of fields. Each field
+reads an attribute, a dotted path or a function of (obj, ctx), and may
+nest another schema. A schema compiles into a plain function that builds
+the dict in one expression, as hand-written code would, so there is no
+per-field dispatch at run time. Endpoints that show fewer fields use
+`only()`, and clients can narrow any listing further with `?fields=a,b`.
+
+Datetimes are left for the encoder. With orjson installed (optional,
+JSON_ENCODER=auto or orjson) it encodes them natively. Otherwise the stdlib
+encoder calls `isoformat()`. Both produce the same ISO 8601 strings the API
+has always returned.
+"""
+import json
+from datetime import date, datetime
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder gives the same output
+    orjson = None
+
+# Distinct ?fields= selections compiled per schema before the cache is reset
+MAX_DUMPERS = 256
+
+class InvalidFields(ValueError):
+    pass
+
+class Field:
+    """One output key: `source` is an attribute path or a callable(obj, ctx), `schema` nests another schema."""
+
+    def __init__(self, name, source=None, schema=None, many=False):
+        source = name if source is None else source
+        if not callable(source) and not all(part.isidentifier() for part in source.split('.')):
+            raise ValueError(f'Invalid source {source!r} for field {name!r}')
+        self.name = name
+        self.source = source
+        self.schema = schema
+        self.many = many
+
+class Schema:
+    def __init__(self, *fields):
+        self.fields = {}
+        for field in fields:
+            field = Field(field) if isinstance(field, str) else field
+            self.fields[field.name] = field
+        self._dumpers = {}
+
+    def only(self, *names):
+        """A schema with just these fields, in this order."""
+        return Schema(*[self.fields[name] for name in names])
+
+    def extend(self, *fields):
+        return Schema(*self.fields.values(), *fields)
+
+    def select(self, names):
+        """Validate a field selection; returns the names in schema order. Raises InvalidFields."""
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise InvalidFields(f"Unknown fields: {', '.join(unknown)}. "
+                                f"Available: {', '.join(self.fields)}")
+        wanted = set(names)
+        return tuple(name for name in self.fields if name in wanted)
+
+    def dumper(self, fields=None):
+        """The compiled function(obj, ctx) for a selection from select(), or for every field."""
+        key = fields or None
+        dump = self._dumpers.get(key)
+        if dump is None:
+            if len(self._dumpers) >= MAX_DUMPERS:
+                self._dumpers.clear()
+            dump = self._dumpers[key] = self._compile(key or tuple(self.fields))
+        return dump
+
+    def _compile(self, names):
+        namespace, items = {}, []
+        for i, name in enumerate(names):
+            field = self.fields[name]
+            if callable(field.source):
+                namespace[f'_f{i}'] = field.source
+                value = f'_f{i}(obj, ctx)'
+            else:
+                value = f'obj.{field.source}'
+            if field.schema is not None:
+                namespace[f'_s{i}'] = field.schema.dumper()
+                if field.many:
+                    value = f'[_s{i}(item, ctx) for item in {value}]'
+                else:
+                    value = f'(None if (_v{i} := {value}) is None else _s{i}(_v{i}, ctx))'
+            items.append(f'{name!r}: {value}')
+        exec(f"def dump(obj, ctx):\n    return {{{', '.join(items)}}}\n", namespace)
+        return namespace['dump']
+
+    def dump(self, obj, ctx=None, fields=None):
+        return self.dumper(fields)(obj, ctx)
+
+    def dump_many(self, objs, ctx=None, fields=None):
+        dump = self.dumper(fields)
+        return [dump(obj, ctx) for obj in objs]
+
+def requested_fields(schema):
+    """The ?fields= selection validated against schema, or None for all fields. Raises InvalidFields."""
+    value = request.args.get('fields')
+    if not value:
+        return None
+    return schema.select([name.strip() for name in value.split(',') if name.strip()])
+
+COMPANY = Schema('id', 'company_name')
+
+FREIGHT_REQUEST = Schema(
+    'id', 'freight_type', 'origin', 'destination', 'cargo_details', 'weight', 'dimensions',
+    'deadline', 'status', 'version', 'created_at', 'urgency', 'budget_range',
+    Field('quotes_count', 'quote_count'),
+    Field('shipper', 'user', schema=COMPANY),
+    Field('completed_at', 'created_at'),
+)
+FREIGHT_REQUEST_LIST = FREIGHT_REQUEST.only(
+    'id', 'freight_type', 'origin', 'destination', 'cargo_details', 'weight', 'dimensions',
+    'deadline', 'status', 'created_at', 'urgency', 'budget_range', 'quotes_count'
+)
+# Matching results: the open request without counters
+FREIGHT_REQUEST_MATCH = FREIGHT_REQUEST.only(
+    'id', 'freight_type', 'origin', 'destination', 'cargo_details', 'weight', 'dimensions',
+    'deadline', 'status', 'created_at', 'urgency', 'budget_range'
+)
+FREIGHT_REQUEST_SEARCH = FREIGHT_REQUEST.only(
+    'id', 'freight_type', 'origin', 'destination', 'cargo_details', 'weight', 'deadline',
+    'status', 'created_at', 'urgency'
+)
+FREIGHT_REQUEST_SUMMARY = FREIGHT_REQUEST.only('id', 'freight_type', 'origin', 'destination', 'status')
+# The request a rating was left on
+FREIGHT_REQUEST_RATED = FREIGHT_REQUEST.only('id', 'freight_type', 'origin', 'destination', 'completed_at')
+
+QUOTE = Schema(
+    'id', 'freight_request_id', 'provider_id',
+    Field('provider_name', 'provider.company_name'),
+    Field('provider_rating', 'provider.rating'),
+    'price', 'estimated_delivery_date', 'description', 'status', 'created_at', 'valid_until',
+    'insurance_coverage',
+    Field('freight_request', schema=FREIGHT_REQUEST.only('id', 'freight_type', 'origin', 'destination',
+                                                         'deadline', 'status')),
+    Field('shipper', 'freight_request.user', schema=COMPANY),
+)
+# The calling provider's quotes with their request and shipper
+QUOTE_MINE = QUOTE.only('id', 'price', 'estimated_delivery_date', 'status', 'created_at', 'valid_until',
+                        'freight_request', 'shipper')
+# Quotes on one request, as its shipper compares them
+QUOTE_COMPARISON = QUOTE.only('id', 'provider_id', 'provider_name', 'provider_rating', 'price',
+                              'estimated_delivery_date', 'description', 'status', 'valid_until',
+                              'insurance_coverage')
+QUOTE_SUMMARY = QUOTE.only('id', 'provider_id', 'provider_name', 'price', 'status', 'created_at')
+
+FREIGHT_REQUEST_DETAIL = FREIGHT_REQUEST.only(
+    'id', 'freight_type', 'origin', 'destination', 'cargo_details', 'weight', 'dimensions',
+    'deadline', 'status', 'version', 'created_at', 'urgency', 'budget_range', 'shipper'
+).extend(
+    # The route decides which quotes the caller may see
+    Field('quotes', lambda freight_request, quotes: quotes, schema=QUOTE_SUMMARY, many=True)
+)
+
+def _sender_name(message, sender_name):
+    # Callers that know the sender pass its name as ctx instead of loading it
+    if message.system_message:
+        return 'System'
+    return sender_name or message.sender.company_name
+
+MESSAGE = Schema(
+    'id', 'sender_id', Field('sender_name', _sender_name), 'content', 'created_at', 'read_at',
+    'message_type', 'attachment_url', 'system_message',
+)
+MESSAGE_SEARCH = MESSAGE.extend('conversation_id')
+
+def _unread_count(conversation, user_id):
+    return conversation.shipper_unread if conversation.shipper_id == user_id else conversation.provider_unread
+
+CONVERSATION = Schema(
+    'id', 'freight_request_id',
+    Field('shipper', schema=COMPANY),
+    Field('provider', schema=COMPANY),
+    'last_message_at',
+    Field('unread_count', _unread_count),  # ctx is the caller's user id
+)
+
+RATING = Schema('id', 'rating', 'review', 'created_at', 'freight_request_id')
+RATING_DETAIL = RATING.only('id', 'rating', 'review', 'created_at')
+
+def _selected_quote(freight_request, ctx):
+    # Picked from the loaded quotes rather than lazy-loading selected_quote
+    for quote in freight_request.quotes:
+        if quote.id == freight_request.selected_quote_id:
+            return quote
+    return None
+
+def _rating(freight_request, ctx):
+    return freight_request.ratings[0] if freight_request.ratings else None
+
+QUOTE_EXPORT = QUOTE.only('id', 'provider_id', 'provider_name', 'price', 'estimated_delivery_date', 'status',
+                          'created_at', 'valid_until', 'insurance_coverage')
+# A shipper's request with every quote and the rating, one per export row
+FREIGHT_HISTORY = FREIGHT_REQUEST_LIST.extend(
+    Field('selected_quote', _selected_quote, schema=QUOTE_EXPORT),
+    Field('rating', _rating, schema=RATING_DETAIL),
+    Field('quotes', schema=QUOTE_EXPORT, many=True),
+)
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return DefaultJSONProvider.default(value)
+
+COMPACT = (',', ':')
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS  # stdlib turns int keys into strings too
+
+def dumps(obj, sort_keys=False, use_orjson=True):
+    """Encode obj to a JSON string, with datetimes as ISO 8601."""
+    if orjson is not None and use_orjson:
+        option = _ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, separators=COMPACT)
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider using orjson when available, with datetimes as ISO 8601."""
+
+    default = staticmethod(_default)
+    use_orjson = orjson is not None
+
+    def dumps(self, obj, **kwargs):
+        # response() asks for compact separators, which is what orjson writes;
+        # pretty printing (debug responses) and other options take the stdlib path
+        if self.use_orjson and kwargs.keys() <= {'separators'} and kwargs.get('separators', COMPACT) == COMPACT:
+            return dumps(obj, sort_keys=self.sort_keys)
+        return super().dumps(obj, **kwargs)
+
+def init_serialization(app):
+    encoder = app.config['JSON_ENCODER']
+    if encoder == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_ENCODER=orjson but orjson is not installed')
+    app.json = JSONProvider(app)
+    app.json.use_orjson = orjson is not None and encoder != 'stdlib'
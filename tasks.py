@@ -0,0 +1,116 @@
+"""Background task queue for work that should not run on the request path.
+
+Tasks are plain functions run inside an application context. The default
+backend is an in-process thread pool; set TASK_QUEUE_BACKEND to 'eager' to
+run tasks inline (handy for scripts and debugging), or register any object
+with an `enqueue(func, args, kwargs)` method under
+`app.extensions['task_queue_backend']` to hand tasks to an external worker.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+class ThreadBackend:
+    """Runs tasks on a bounded pool of daemon threads in this process."""
+
+    def __init__(self, app, max_workers):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='task')
+
+    def enqueue(self, func, args, kwargs):
+        return self.executor.submit(self._run, func, args, kwargs)
+
+    def _run(self, func, args, kwargs):
+        with self.app.app_context():
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                self.app.logger.exception('Background task %s failed', func.__name__)
+                raise
+
+class EagerBackend(ThreadBackend):
+    """Runs tasks immediately in the calling thread."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def enqueue(self, func, args, kwargs):
+        try:
+            return self._run(func, args, kwargs)
+        except Exception:
+            # Already logged; callers must not fail because a side task did
+            return None
+
+def init_task_queue(app):
+    if 'task_queue_backend' in app.extensions:
+        return
+    if app.config['TASK_QUEUE_BACKEND'] == 'eager':
+        app.extensions['task_queue_backend'] = EagerBackend(app)
+    else:
+        app.extensions['task_queue_backend'] = ThreadBackend(app, app.config['TASK_QUEUE_WORKERS'])
+
+class PeriodicTask:
+    """Runs func in an application context every interval seconds on a daemon thread.
+
+    Keeps run statistics for /api/metrics; a numeric return value is counted
+    as items processed.
+    """
+
+    def __init__(self, app, name, func, interval):
+        self.app = app
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.runs = 0
+        self.failures = 0
+        self.items = 0
+        self.last_result = 0
+        self.last_duration = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name=f'periodic-{name}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        with self.app.app_context():
+            started = time.perf_counter()
+            try:
+                result = self.func()
+            except Exception:
+                self.failures += 1
+                self.app.logger.exception('Periodic task %s failed', self.name)
+                return None
+            finally:
+                self.runs += 1
+                self.last_duration = time.perf_counter() - started
+        if isinstance(result, int):
+            self.last_result = result
+            self.items += result
+        return result
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+def schedule(app, name, func, interval):
+    """Run func every interval seconds in this process; an interval of 0 disables it.
+
+    Every worker process runs its own copy, so jobs scheduled this way must be
+    safe to run concurrently. Use the matching CLI command from cron instead
+    when one run per deployment is wanted.
+    """
+    if not interval:
+        return None
+    task = PeriodicTask(app, name, func, interval)
+    app.extensions.setdefault('periodic_tasks', {})[name] = task
+    task.start()
+    return task
+
+def enqueue(func, *args, **kwargs):
+    """Schedule func(*args, **kwargs) to run off the request path."""
+    return current_app.extensions['task_queue_backend'].enqueue(func, args, kwargs)
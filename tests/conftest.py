@@ -0,0 +1,78 @@
+"""Test setup: a throwaway SQLite database, with background work run inline or not at all."""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['TASK_QUEUE_BACKEND'] = 'eager'
+os.environ['TOKEN_DENYLIST_REFRESH_SECONDS'] = '0'
+# Tests drain domain events themselves
+os.environ['OUTBOX_WORKERS'] = '0'
+# No process pool; bcrypt runs inline
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+
+import warnings
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import SAWarning
+
+from app import app
+from extensions import db
+from identity import create_user_token
+from matching_engine import matching_index
+from models import User
+from passwords import hash_password
+
+PASSWORD = 'correct horse battery'
+
+def reset_database():
+    """Empty the test database and the in-process matching index."""
+    with app.app_context():
+        db.session.remove()
+        with warnings.catch_warnings():
+            # freight_request and quote reference each other, which SQLite cannot ALTER away
+            warnings.simplefilter('ignore', SAWarning)
+            db.drop_all()
+        db.create_all()
+        matching_index.reset()
+
+def create_user(email, user_type, service_areas=(), specialties=()):
+    """Add a user directly and return its id."""
+    with app.app_context():
+        user = User(email=email, password=hash_password(PASSWORD), company_name=email.split('@')[0],
+                    user_type=user_type)
+        db.session.add(user)
+        db.session.flush()
+        user.set_service_areas(list(service_areas))
+        user.set_specialties(list(specialties))
+        db.session.commit()
+        return user.id
+
+def headers(user_id):
+    """Authorization header with a fresh token for the user."""
+    with app.app_context():
+        return {'Authorization': f'Bearer {create_user_token(db.session.get(User, user_id))}'}
+
+def delivery():
+    """An estimated delivery date a few days out."""
+    return (datetime.utcnow() + timedelta(days=5)).isoformat()
+
+def new_request(client, shipper_id, **values):
+    """Create a sea freight request through the API and return its id."""
+    response = client.post('/api/freight-requests', headers=headers(shipper_id), json=dict({
+        'freight_type': 'sea', 'origin': 'Rotterdam', 'destination': 'Hamburg',
+        'cargo_details': 'Refrigerated containers', 'weight': 1200
+    }, **values))
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['freight_request']['id']
+
+def new_quote(client, provider_id, request_id):
+    """Quote a freight request through the API and return the quote id."""
+    response = client.post(f'/api/quotes/{request_id}', headers=headers(provider_id),
+                           json={'price': 900, 'estimated_delivery_date': delivery()})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['quote_id']
@@ -0,0 +1,79 @@
+"""Racing accepts and new quotes from a thread pool leave every request consistent.
+
+A small version of benchmarks/accept_contention.py against SQLite in WAL
+mode: worker threads accept every quote of each request while other
+providers keep quoting them.
+"""
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert
+
+from app import app
+from conftest import create_user, delivery, headers, reset_database
+from extensions import db
+from events import drain_outbox
+from models import FreightRequest, Quote
+
+REQUESTS = 6
+QUOTES_PER_REQUEST = 5
+LATE_PROVIDERS = 3
+WORKERS = 8
+
+def seed():
+    """Requests that each have several pending quotes; returns the shipper, late providers and quotes by request."""
+    reset_database()
+    shipper = create_user('shipper@example.com', 'shipper')
+    providers = [create_user(f'provider{i}@example.com', 'provider')
+                 for i in range(QUOTES_PER_REQUEST + LATE_PROVIDERS)]
+    with app.app_context():
+        now = datetime.utcnow()
+        request_ids = db.session.scalars(insert(FreightRequest).returning(FreightRequest.id), [{
+            'user_id': shipper, 'freight_type': 'road', 'origin': 'Hamburg', 'destination': 'Rotterdam',
+            'cargo_details': 'Pallets', 'status': 'quoted', 'quote_count': QUOTES_PER_REQUEST, 'created_at': now
+        } for _ in range(REQUESTS)]).all()
+        quotes = {request_id: db.session.scalars(insert(Quote).returning(Quote.id, sort_by_parameter_order=True), [{
+            'freight_request_id': request_id, 'provider_id': provider, 'price': 1000.0,
+            'estimated_delivery_date': now + timedelta(days=5), 'status': 'pending',
+            'valid_until': now + timedelta(hours=48), 'created_at': now
+        } for provider in providers[:QUOTES_PER_REQUEST]]).all() for request_id in request_ids}
+        db.session.commit()
+    return shipper, providers[QUOTES_PER_REQUEST:], quotes
+
+def test_one_accept_wins_and_counters_hold():
+    shipper, late_providers, quotes = seed()
+    shipper_auth = headers(shipper)
+    late_auth = [headers(provider) for provider in late_providers]
+
+    operations = []
+    for request_id, quote_ids in quotes.items():
+        operations += [('accept', f'/api/quotes/{quote_id}/accept', shipper_auth, None) for quote_id in quote_ids]
+        operations += [('submit', f'/api/quotes/{request_id}', auth,
+                        {'price': 900.0, 'estimated_delivery_date': delivery()}) for auth in late_auth]
+    random.Random(7).shuffle(operations)
+
+    def call(operation):
+        kind, path, auth, body = operation
+        return kind, app.test_client().post(path, headers=auth, json=body).status_code
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        outcomes = Counter(pool.map(call, operations))
+
+    assert not [status for _, status in outcomes if status >= 500], outcomes
+    assert outcomes[('accept', 200)] == REQUESTS, outcomes
+
+    with app.app_context():
+        drain_outbox()  # Rejects the quotes that lost
+        request_ids = list(quotes)
+        accepted = Counter(freight_request_id for (freight_request_id,) in db.session.query(Quote.freight_request_id)
+                           .filter(Quote.freight_request_id.in_(request_ids), Quote.status == 'accepted'))
+        counts = dict(db.session.query(Quote.freight_request_id, func.count(Quote.id))
+                      .filter(Quote.freight_request_id.in_(request_ids)).group_by(Quote.freight_request_id))
+        for freight_request in FreightRequest.query.filter(FreightRequest.id.in_(request_ids)):
+            assert accepted[freight_request.id] == 1, freight_request.id
+            assert freight_request.status == 'in_progress', freight_request.id
+            selected = db.session.get(Quote, freight_request.selected_quote_id)
+            assert selected is not None and selected.status == 'accepted', freight_request.id
+            assert freight_request.quote_count == counts[freight_request.id], freight_request.id
@@ -0,0 +1,30 @@
+"""Ranked matches leave out the open requests a provider has already quoted."""
+from app import app
+from conftest import create_user, headers, new_quote, new_request, reset_database
+from extensions import db
+from models import FreightRequest
+from query_plans import record_statements
+
+def test_quoted_requests_are_excluded_and_closed_ones_not_loaded():
+    reset_database()
+    shipper = create_user('shipper@example.com', 'shipper')
+    provider = create_user('carrier@example.com', 'provider', ['Rotterdam'], ['sea'])
+    client = app.test_client()
+
+    quoted, closed, unquoted = (new_request(client, shipper) for _ in range(3))
+    new_quote(client, provider, quoted)
+    new_quote(client, provider, closed)
+    with app.app_context():
+        FreightRequest.query.filter_by(id=closed).update({'status': 'completed'})
+        db.session.commit()
+
+    with app.app_context(), record_statements(db.engine) as statements:
+        response = client.get('/api/matching/available-requests', headers=headers(provider))
+    assert response.status_code == 200, response.get_json()
+    assert {match['request']['id'] for match in response.get_json()['matched_requests']} == {unquoted}
+
+    # The quoted-ids prefetch only returns the provider's open requests
+    [(prefetch, parameters)] = [(statement, parameters) for statement, parameters in statements.items()
+                                if statement.startswith('SELECT quote.freight_request_id')]
+    with app.app_context():
+        assert db.session.connection().exec_driver_sql(prefetch, parameters).all() == [(quoted,)]
@@ -0,0 +1,29 @@
+"""An invalidation in one worker reaches the responses cached by every other worker."""
+from app import app
+from cache import DatabaseBackend, ResponseCache
+from conftest import create_user, headers, new_request, reset_database
+from extensions import db
+from models import FreightRequest
+
+def test_invalidation_from_another_worker_is_seen():
+    reset_database()
+    shipper = create_user('shipper@example.com', 'shipper')
+    client = app.test_client()
+    request_id = new_request(client, shipper)
+    auth = headers(shipper)
+    url = f'/api/freight-requests/{request_id}'
+
+    cached = client.get(url, headers=auth)
+    assert cached.status_code == 200
+    assert client.get(url, headers=dict(auth, **{'If-None-Match': cached.headers['ETag']})).status_code == 304
+
+    # Another worker changes the request and invalidates from its own process-local cache
+    other_worker = ResponseCache(DatabaseBackend(100), 60)
+    with app.app_context():
+        FreightRequest.query.filter_by(id=request_id).update({'status': 'cancelled'})
+        db.session.commit()
+        other_worker.invalidate(f'freight_request:{request_id}')
+
+    fresh = client.get(url, headers=dict(auth, **{'If-None-Match': cached.headers['ETag']}))
+    assert fresh.status_code == 200
+    assert fresh.get_json()['status'] == 'cancelled'
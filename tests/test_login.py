@@ -0,0 +1,24 @@
+"""Login upgrades a hash made at another cost, on the request itself."""
+import bcrypt
+
+from app import app
+from conftest import PASSWORD, reset_database
+from extensions import db
+from models import User
+from passwords import hash_rounds
+
+def test_login_rehashes_at_the_current_cost():
+    reset_database()
+    with app.app_context():
+        old_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(5)).decode('utf-8')
+        db.session.add(User(email='carrier@example.com', password=old_hash, company_name='Carrier',
+                            user_type='provider'))
+        db.session.commit()
+
+    response = app.test_client().post('/api/auth/login', json={'email': 'carrier@example.com', 'password': PASSWORD})
+    assert response.status_code == 200, response.get_json()
+
+    with app.app_context():
+        new_hash = User.query.filter_by(email='carrier@example.com').one().password
+    assert new_hash != old_hash
+    assert hash_rounds(new_hash) == app.config['BCRYPT_LOG_ROUNDS']
@@ -0,0 +1,58 @@
+"""The matching index picks up requests committed by other workers, in whatever order they commit."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import app
+from conftest import create_user, headers, new_request, reset_database
+from extensions import db
+from matching_engine import matching_index
+from models import FreightRequest
+
+@pytest.fixture
+def parties():
+    reset_database()
+    return (create_user('shipper@example.com', 'shipper'),
+            create_user('carrier@example.com', 'provider', ['Rotterdam'], ['sea']))
+
+def commit_elsewhere(shipper_id, created_at=None, **values):
+    """Commit a request the way another worker would: straight to the database, not through this index."""
+    with app.app_context():
+        freight_request = FreightRequest(user_id=shipper_id, freight_type='sea', origin='Rotterdam',
+                                         destination='Hamburg', cargo_details='Steel coils', status='pending',
+                                         created_at=created_at or datetime.utcnow(), **values)
+        db.session.add(freight_request)
+        db.session.commit()
+        return freight_request.id
+
+def available_ids(client, provider_id):
+    response = client.get('/api/matching/available-requests', headers=headers(provider_id))
+    assert response.status_code == 200, response.get_json()
+    return {match['request']['id'] for match in response.get_json()['matched_requests']}
+
+def sync():
+    with app.app_context():
+        matching_index.sync()
+
+def test_request_from_another_worker_survives_a_local_add(parties):
+    shipper, provider = parties
+    client = app.test_client()
+    sync()
+
+    elsewhere = commit_elsewhere(shipper)
+    here = new_request(client, shipper)
+    assert here > elsewhere
+
+    assert available_ids(client, provider) == {elsewhere, here}
+
+def test_request_committed_after_a_higher_id_was_synced(parties):
+    shipper, provider = parties
+    client = app.test_client()
+    now = datetime.utcnow()
+
+    # id 3 was handed out first but its transaction commits after id 4 has been synced
+    later = commit_elsewhere(shipper, created_at=now, id=4)
+    sync()
+    earlier = commit_elsewhere(shipper, created_at=now - timedelta(seconds=1), id=3)
+
+    assert available_ids(client, provider) == {earlier, later}
@@ -0,0 +1,93 @@
+"""List endpoints issue a constant number of SQL statements, within their budget.
+
+Seeds conversations, messages and freight requests, then calls each list
+endpoint at several page sizes. A statement count that grows with the page
+size or exceeds the endpoint's budget fails the test.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import app
+from conftest import headers, reset_database
+from extensions import db
+from models import User, FreightRequest, Conversation, Message
+from messaging import reconcile_unread_counts
+
+PAGE_SIZES = [5, 20, 50]
+
+# Maximum statements per call, whatever the page size
+BUDGETS = {
+    '/api/conversations': 2,
+    '/api/conversations/{conversation}/messages': 7,
+    '/api/freight-requests': 2,
+}
+
+def seed(conversations=60, messages_per_conversation=60):
+    """More conversations and messages than the largest page; returns the shipper and first conversation ids."""
+    reset_database()
+    with app.app_context():
+        shipper = User(email='shipper@example.com', password='x', company_name='Shipper', user_type='shipper')
+        db.session.add(shipper)
+        providers = [User(email=f'provider{i}@example.com', password='x', company_name=f'Provider {i}',
+                          user_type='provider') for i in range(conversations)]
+        db.session.add_all(providers)
+        db.session.flush()
+
+        start = datetime.utcnow() - timedelta(days=1)
+        conversation_ids = []
+        for i, provider in enumerate(providers):
+            freight_request = FreightRequest(user_id=shipper.id, freight_type='road', origin='Hamburg',
+                                             destination='Rotterdam', cargo_details='Pallets', status='pending')
+            db.session.add(freight_request)
+            db.session.flush()
+            conversation = Conversation(freight_request_id=freight_request.id, shipper_id=shipper.id,
+                                        provider_id=provider.id, last_message_at=start + timedelta(minutes=i))
+            db.session.add(conversation)
+            db.session.flush()
+            conversation_ids.append(conversation.id)
+            db.session.add_all([Message(
+                conversation_id=conversation.id,
+                freight_request_id=freight_request.id,
+                sender_id=provider.id if j % 2 else shipper.id,
+                recipient_id=shipper.id if j % 2 else provider.id,
+                content=f'Message {j}',
+                message_type='text',
+                created_at=start + timedelta(seconds=j)
+            ) for j in range(messages_per_conversation)])
+        db.session.commit()
+        reconcile_unread_counts()
+        return shipper.id, conversation_ids[0]
+
+@contextmanager
+def count_statements(engine):
+    """Count the statements sent through engine inside the block; yields a one-item list."""
+    count = [0]
+
+    def on_execute(*args):
+        count[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        yield count
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+
+@pytest.mark.parametrize('url', BUDGETS)
+def test_statements_per_page_are_constant_and_within_budget(url):
+    client = app.test_client()
+    counts = []
+    for per_page in PAGE_SIZES:
+        # Fresh data each time so read-marking does not change later calls
+        shipper, conversation = seed()
+        auth = headers(shipper)
+        with app.app_context(), count_statements(db.engine) as count:
+            response = client.get(f'{url.format(conversation=conversation)}?per_page={per_page}', headers=auth)
+        assert response.status_code == 200, response.get_json()
+        counts.append(count[0])
+
+    sizes = ', '.join(f'{size}: {count}' for size, count in zip(PAGE_SIZES, counts))
+    assert len(set(counts)) == 1, f'statements grow with the page size -> {sizes}'
+    assert counts[0] <= BUDGETS[url], f'over budget ({BUDGETS[url]}) -> {sizes}'